@@ -11,15 +11,23 @@ from aws_cdk import (
     aws_events_targets as targets,
     aws_iam as iam,
     aws_glue as glue,
+    aws_dynamodb as dynamodb,
     aws_sns as sns,
-    aws_secretsmanager as secrets, Stack, Duration
+    aws_sns_subscriptions as subscriptions,
+    aws_sqs as sqs,
+    aws_secretsmanager as secrets, Stack, Duration, RemovalPolicy
 )
 from constructs import Construct
 
 import config as cf
-from common.utils import select_artifacts
+from common.utils import load_source_module, select_artifacts
 
-MONITOR_LAMBDA_ASSETS = {"zips": "*.zip", "lib_dir": "libs", "monitor_lambda": "handler.py"}
+MONITOR_LAMBDA_ASSETS = {
+    "zips": "*.zip",
+    "lib_dir": "libs",
+    "benchmarks": "benchmarks",
+    "monitor_lambda": "handler.py",
+}
 
 
 class DataLakeMonitoringStack(Stack):
@@ -29,8 +37,16 @@ class DataLakeMonitoringStack(Stack):
         """Create construct"""
         super().__init__(scope, construct_id, **kwargs)
 
-        lambda_timeout_seconds = 180
+        lambda_timeout_seconds = cf.MONITOR_TIMEOUT_SECONDS
+        architecture = (
+            lambda_.Architecture.ARM_64
+            if cf.MONITOR_ARCHITECTURE == "arm64"
+            else lambda_.Architecture.X86_64
+        )
         path_monitoring_lambda = os.path.join(cf.PATH_SRC, "datalake_monitoring")
+        monitor_schema = load_source_module(
+            "monitor_schema", os.path.join(path_monitoring_lambda, "monitor_schema.py")
+        )
         monitor_db = cf.MONITOR_DB
         monitor_table = cf.MONITOR_TABLE
 
@@ -55,7 +71,9 @@ class DataLakeMonitoringStack(Stack):
         )
 
         # Lambda layer - aws-wrangler
-        sp.call(["make", "bundle"], cwd=path_monitoring_lambda)
+        sp.call(
+            ["make", "bundle", f"WRANGLER_ASSET={cf.WRANGLER_ASSET}"], cwd=path_monitoring_lambda
+        )
 
         wrangler_layer = lambda_.LayerVersion(
             self,
@@ -63,10 +81,40 @@ class DataLakeMonitoringStack(Stack):
             code=lambda_.Code.from_asset(
                 os.path.join(path_monitoring_lambda, f"libs/{cf.WRANGLER_ASSET}")
             ),
+            compatible_architectures=[architecture],
         )
 
         sp.call(["make", "clean"], cwd=path_monitoring_lambda)
 
+        # The monitoring Lambda only needs a layer for the writer backend it is deployed with;
+        # compaction and rollups keep the awswrangler layer for its pyarrow. The slim layer of
+        # the pyarrow and ndjson backends holds requests for the webhook sinks, which the
+        # Lambda runtime does not provide, and pyarrow for the pyarrow backend
+        if cf.MONITOR_WRITER_BACKEND == "awswrangler":
+            monitoring_layers = [wrangler_layer]
+        else:
+            platform = "aarch64" if cf.MONITOR_ARCHITECTURE == "arm64" else "x86_64"
+            sp.call(
+                [
+                    "make",
+                    "slim-layer",
+                    f"SLIM_BACKEND={cf.MONITOR_WRITER_BACKEND}",
+                    f"SLIM_ASSET={cf.SLIM_ASSET}",
+                    f"PIP_PLATFORM=manylinux2014_{platform}",
+                ],
+                cwd=path_monitoring_lambda,
+            )
+            monitoring_layers = [
+                lambda_.LayerVersion(
+                    self,
+                    id=f"{cf.MONITOR_WRITER_BACKEND}-slim",
+                    code=lambda_.Code.from_asset(
+                        os.path.join(path_monitoring_lambda, f"libs/{cf.SLIM_ASSET}")
+                    ),
+                    compatible_architectures=[architecture],
+                )
+            ]
+
         monitoring_lambda = lambda_.Function(
             self,
             id="datalake-monitoring-lambda",
@@ -85,19 +133,209 @@ class DataLakeMonitoringStack(Stack):
                 "MONITOR_S3": cf.S3_MONITOR_BUCKET,
                 "MONITOR_DATABASE": cf.MONITOR_DB,
                 "MONITOR_TABLE": cf.MONITOR_TABLE,
+                "IDEMPOTENCY_TABLE": cf.MONITOR_IDEMPOTENCY_TABLE,
+                "RUN_STATE_TABLE": cf.MONITOR_RUN_STATE_TABLE,
+                "RUN_SLA_SECONDS": cf.MONITOR_RUN_SLA_SECONDS,
+                "WRITER_BACKEND": cf.MONITOR_WRITER_BACKEND,
+                "MONITOR_NDJSON_TABLE": cf.MONITOR_NDJSON_TABLE,
             },
-            layers=[wrangler_layer],
-            memory_size=128,
+            layers=monitoring_layers,
+            architecture=architecture,
+            # Memory sets the CPU share too, see `local_exec.py --tune`
+            memory_size=cf.MONITOR_MEMORY_SIZE,
             timeout=Duration.seconds(lambda_timeout_seconds),
+            reserved_concurrent_executions=cf.MONITOR_RESERVED_CONCURRENCY or None,
         )
 
         monitoring_secret.grant_read(monitoring_lambda)
 
-        # Create an SNS event source for Lambda
-        sns_event_source = lambda_event_source.SnsEventSource(self.dl_monitor_sns_topic)
+        # Notification sinks and routes; SNS email sinks publish to their topics
+        for variable, value in (
+            ("NOTIFY_SINKS", cf.MONITOR_NOTIFY_SINKS),
+            ("NOTIFY_ROUTES", cf.MONITOR_NOTIFY_ROUTES),
+            ("NOTIFY_SEVERITIES", cf.MONITOR_NOTIFY_SEVERITIES),
+        ):
+            if value:
+                monitoring_lambda.add_environment(variable, value)
+        notify_topics = [
+            spec["topic_arn"]
+            for spec in json.loads(cf.MONITOR_NOTIFY_SINKS or "{}").values()
+            if spec.get("type") == "sns"
+        ]
+        if notify_topics:
+            monitoring_lambda.add_to_role_policy(
+                iam.PolicyStatement(
+                    effect=iam.Effect.ALLOW, actions=["sns:Publish"], resources=notify_topics
+                )
+            )
+
+        # Provisioned concurrency keeps initialised containers behind an alias, which the event
+        # source then invokes instead of the function's $LATEST
+        monitoring_target = monitoring_lambda
+        if cf.MONITOR_PROVISIONED_CONCURRENCY:
+            monitoring_target = lambda_.Alias(
+                self,
+                id="datalake-monitoring-lambda-live",
+                alias_name="live",
+                version=monitoring_lambda.current_version,
+                provisioned_concurrent_executions=cf.MONITOR_PROVISIONED_CONCURRENCY,
+            )
+
+        # Keys of the monitoring events already written, expired through TTL
+        idempotency_table = dynamodb.Table(
+            self,
+            id="monitor-idempotency-table",
+            table_name=cf.MONITOR_IDEMPOTENCY_TABLE,
+            partition_key=dynamodb.Attribute(
+                name="idempotency_key", type=dynamodb.AttributeType.STRING
+            ),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="expires_at",
+            removal_policy=RemovalPolicy.DESTROY,
+        )
+        idempotency_table.grant_read_write_data(monitoring_lambda)
+
+        # Open runs of Glue jobs and crawlers, until their completion or TTL expiry
+        run_state_table = dynamodb.Table(
+            self,
+            id="monitor-run-state-table",
+            table_name=cf.MONITOR_RUN_STATE_TABLE,
+            partition_key=dynamodb.Attribute(name="run_key", type=dynamodb.AttributeType.STRING),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="expires_at",
+            removal_policy=RemovalPolicy.DESTROY,
+        )
+        run_state_table.grant_read_write_data(monitoring_lambda)
+
+        # Daily compaction of the monitor table's closed partitions
+        compaction_lambda = lambda_.Function(
+            self,
+            id="datalake-monitoring-compaction-lambda",
+            handler="compaction.handler",
+            runtime=lambda_.Runtime.PYTHON_3_10,
+            code=lambda_.Code.from_asset(
+                path=path_monitoring_lambda,
+                exclude=select_artifacts(
+                    artifacts=MONITOR_LAMBDA_ASSETS, keep_artifact="monitor_lambda"
+                ),
+            ),
+            function_name="datalake-monitoring-compaction-lambda",
+            environment={
+                "REGION": cf.REGION,
+                "MONITOR_S3": cf.S3_MONITOR_BUCKET,
+                "MONITOR_DATABASE": cf.MONITOR_DB,
+                "MONITOR_TABLE": cf.MONITOR_TABLE,
+                "COMPACTION_LOOKBACK_DAYS": str(cf.COMPACTION_LOOKBACK_DAYS),
+            },
+            layers=[wrangler_layer],
+            # The awswrangler layer is built for the monitoring Lambda's architecture
+            architecture=architecture,
+            memory_size=cf.COMPACTION_MEMORY_SIZE,
+            timeout=Duration.minutes(15),
+        )
+
+        events.Rule(
+            self,
+            id="monitor-compaction-schedule",
+            description="Compact the monitor table partitions of closed days",
+            rule_name="monitor-compaction-schedule",
+            enabled=True,
+            schedule=events.Schedule.cron(minute="30", hour="1"),
+            targets=[targets.LambdaFunction(handler=compaction_lambda)],
+        )
 
-        # Add SNS event source to the Lambda function
-        monitoring_lambda.add_event_source(sns_event_source)
+        # Hourly and daily rollups of the monitor table, refreshed in micro-batches
+        rollup_lambda = lambda_.Function(
+            self,
+            id="datalake-monitoring-rollup-lambda",
+            handler="rollup.handler",
+            runtime=lambda_.Runtime.PYTHON_3_10,
+            code=lambda_.Code.from_asset(
+                path=path_monitoring_lambda,
+                exclude=select_artifacts(
+                    artifacts=MONITOR_LAMBDA_ASSETS, keep_artifact="monitor_lambda"
+                ),
+            ),
+            function_name="datalake-monitoring-rollup-lambda",
+            environment={
+                "REGION": cf.REGION,
+                "MONITOR_S3": cf.S3_MONITOR_BUCKET,
+                "MONITOR_DATABASE": cf.MONITOR_DB,
+                "MONITOR_TABLE": cf.MONITOR_TABLE,
+                "MONITOR_HOURLY_TABLE": cf.MONITOR_HOURLY_TABLE,
+                "MONITOR_DAILY_TABLE": cf.MONITOR_DAILY_TABLE,
+                "ROLLUP_LOOKBACK_HOURS": "1",
+            },
+            layers=[wrangler_layer],
+            # The awswrangler layer is built for the monitoring Lambda's architecture
+            architecture=architecture,
+            memory_size=cf.ROLLUP_MEMORY_SIZE,
+            timeout=Duration.minutes(5),
+        )
+
+        events.Rule(
+            self,
+            id="monitor-rollup-schedule",
+            description="Refresh the monitor rollups of the hours being written",
+            rule_name="monitor-rollup-schedule",
+            enabled=True,
+            schedule=events.Schedule.rate(Duration.minutes(cf.ROLLUP_INTERVAL_MINUTES)),
+            targets=[targets.LambdaFunction(handler=rollup_lambda)],
+        )
+
+        # Once compaction has dropped duplicate rows, the rollups of closed days are rebuilt
+        events.Rule(
+            self,
+            id="monitor-rollup-rebuild-schedule",
+            description="Rebuild the monitor rollups of compacted days",
+            rule_name="monitor-rollup-rebuild-schedule",
+            enabled=True,
+            schedule=events.Schedule.cron(minute="30", hour="2"),
+            targets=[
+                targets.LambdaFunction(
+                    handler=rollup_lambda,
+                    event=events.RuleTargetInput.from_object(
+                        {"closed_days": cf.COMPACTION_LOOKBACK_DAYS}
+                    ),
+                )
+            ],
+        )
+
+        if cf.MONITOR_SQS_BUFFER:
+            # Buffer SNS through SQS so the Lambda receives large batches and retries only the
+            # records it reports as failed
+            monitor_dlq = sqs.Queue(
+                self,
+                id="dl-monitor-dlq",
+                queue_name=f"{cf.MONITOR_SQS_QUEUE}-dlq",
+                retention_period=Duration.days(14),
+            )
+            monitor_queue = sqs.Queue(
+                self,
+                id="dl-monitor-queue",
+                queue_name=cf.MONITOR_SQS_QUEUE,
+                visibility_timeout=Duration.seconds(6 * lambda_timeout_seconds),
+                dead_letter_queue=sqs.DeadLetterQueue(
+                    max_receive_count=cf.MONITOR_SQS_MAX_RECEIVE_COUNT, queue=monitor_dlq
+                ),
+            )
+            self.dl_monitor_sns_topic.add_subscription(
+                subscriptions.SqsSubscription(monitor_queue, raw_message_delivery=True)
+            )
+            monitoring_target.add_event_source(
+                lambda_event_source.SqsEventSource(
+                    monitor_queue,
+                    batch_size=cf.MONITOR_SQS_BATCH_SIZE,
+                    max_batching_window=Duration.seconds(cf.MONITOR_SQS_BATCHING_WINDOW_SECONDS),
+                    report_batch_item_failures=True,
+                )
+            )
+        else:
+            # Create an SNS event source for Lambda
+            sns_event_source = lambda_event_source.SnsEventSource(self.dl_monitor_sns_topic)
+
+            # Add SNS event source to the Lambda function
+            monitoring_target.add_event_source(sns_event_source)
 
         # Glue Events to SNS
 
@@ -111,7 +349,17 @@ class DataLakeMonitoringStack(Stack):
             event_pattern=events.EventPattern(
                 detail_type=["Glue Job State Change", "Glue Crawler State Change"],
                 detail={
-                    "state": ["TIMEOUT", "FAILED", "SUCCEEDED", "STOPPED", "Failed", "Succeeded"]
+                    # Run starts too, for the run durations
+                    "state": [
+                        "RUNNING",
+                        "TIMEOUT",
+                        "FAILED",
+                        "SUCCEEDED",
+                        "STOPPED",
+                        "Started",
+                        "Failed",
+                        "Succeeded",
+                    ]
                 },
             ),
             # targets=[targets.SqsQueue(self.central_state_queue)],
@@ -143,43 +391,28 @@ class DataLakeMonitoringStack(Stack):
             ),
         )
 
-        # Monitoring Table
-        service_metrics_columns = [
-            {"name": column_name, "type": "string", "comment": ""}
-            for column_name in [
-                "error_message",
-                "event_type",
-                "exception_details",
-                "retry_attempts",
-                "service_name",
-                "service_request_id",
-                "service_type",
-                "timestamp",
-            ]
-        ]
+        # Monitoring Table, generated from the schema the monitoring Lambda writes with
+        monitor_table_location = monitor_schema.table_location(
+            cf.S3_MONITOR_BUCKET, cf.MONITOR_DB, cf.MONITOR_TABLE
+        )
 
         service_metrics_table = glue.CfnTable.TableInputProperty(
             description="Monitor Table Attributes",
             name=cf.MONITOR_TABLE,
             parameters={
-                "classification": "json",
+                "classification": "parquet",
                 "has_encrypted_data": "false",
-                "projection.enabled": "true",
-                "projection.exported_on.type": "date",
-                "projection.exported_on.range": "2021-07-01,2021-12-31",
-                "projection.exported_on.format": "yyyy-MM-dd",
-                "projection.exported_on.interval": "1",
-                "projection.exported_on.interval.unit": "DAYS",
+                **monitor_schema.projection_parameters(monitor_table_location),
             },
-            partition_keys=[{"name": "exported_on", "type": "date", "comment": "Day of event"}],
+            partition_keys=monitor_schema.glue_partition_keys(),
             storage_descriptor=glue.CfnTable.StorageDescriptorProperty(
-                columns=service_metrics_columns,
-                input_format="org.apache.hadoop.mapred.TextInputFormat",
-                output_format="org.apache.hadoop.hive.ql.io.HiveIgnoreKeyTextOutputFormat",
+                columns=monitor_schema.glue_columns(),
+                input_format=monitor_schema.PARQUET_INPUT_FORMAT,
+                output_format=monitor_schema.PARQUET_OUTPUT_FORMAT,
                 compressed=True,
-                location=f"s3://{cf.S3_MONITOR_BUCKET}/{cf.MONITOR_DB}/{cf.MONITOR_TABLE}/",
+                location=f"{monitor_table_location}/",
                 serde_info=glue.CfnTable.SerdeInfoProperty(
-                    serialization_library="org.openx.data.jsonserde.JsonSerDe"
+                    serialization_library=monitor_schema.PARQUET_SERDE
                 ),
             ),
             table_type="EXTERNAL_TABLE",
@@ -196,6 +429,93 @@ class DataLakeMonitoringStack(Stack):
 
         monitor_table.add_depends_on(monitor_db)
 
+        # Rollup tables, one file per day, generated from the same schema module
+        for table_id, table_name, columns, description in (
+            (
+                "monitor-hourly-table",
+                cf.MONITOR_HOURLY_TABLE,
+                monitor_schema.HOURLY_ROLLUP_COLUMNS,
+                "Monitor events aggregated per service and hour",
+            ),
+            (
+                "monitor-daily-table",
+                cf.MONITOR_DAILY_TABLE,
+                monitor_schema.DAILY_ROLLUP_COLUMNS,
+                "Monitor events aggregated per service and day",
+            ),
+        ):
+            rollup_location = monitor_schema.table_location(
+                cf.S3_MONITOR_BUCKET, cf.MONITOR_DB, table_name
+            )
+            rollup_table = glue.CfnTable(
+                self,
+                id=table_id,
+                catalog_id=cf.ACCOUNT,
+                database_name=cf.MONITOR_DB,
+                table_input=glue.CfnTable.TableInputProperty(
+                    description=description,
+                    name=table_name,
+                    parameters={
+                        "classification": "parquet",
+                        "has_encrypted_data": "false",
+                        **monitor_schema.projection_parameters(
+                            rollup_location, monitor_schema.ROLLUP_PARTITION_KEYS
+                        ),
+                    },
+                    partition_keys=monitor_schema.glue_partition_keys(
+                        monitor_schema.ROLLUP_PARTITION_KEYS
+                    ),
+                    storage_descriptor=glue.CfnTable.StorageDescriptorProperty(
+                        columns=monitor_schema.glue_columns(columns),
+                        input_format=monitor_schema.PARQUET_INPUT_FORMAT,
+                        output_format=monitor_schema.PARQUET_OUTPUT_FORMAT,
+                        compressed=True,
+                        location=f"{rollup_location}/",
+                        serde_info=glue.CfnTable.SerdeInfoProperty(
+                            serialization_library=monitor_schema.PARQUET_SERDE
+                        ),
+                    ),
+                    table_type="EXTERNAL_TABLE",
+                ),
+            )
+            rollup_table.add_depends_on(monitor_db)
+
+        if cf.MONITOR_WRITER_BACKEND == "ndjson":
+            # Gzipped newline-delimited JSON rows of the ndjson writer backend, same columns and
+            # partitions as the monitor table
+            ndjson_location = monitor_schema.table_location(
+                cf.S3_MONITOR_BUCKET, cf.MONITOR_DB, cf.MONITOR_NDJSON_TABLE
+            )
+            ndjson_table = glue.CfnTable(
+                self,
+                id="monitor-ndjson-table",
+                catalog_id=cf.ACCOUNT,
+                database_name=cf.MONITOR_DB,
+                table_input=glue.CfnTable.TableInputProperty(
+                    description="Monitor Table Attributes, as gzipped JSON lines",
+                    name=cf.MONITOR_NDJSON_TABLE,
+                    parameters={
+                        "classification": "json",
+                        "compressionType": "gzip",
+                        "has_encrypted_data": "false",
+                        **monitor_schema.projection_parameters(ndjson_location),
+                    },
+                    partition_keys=monitor_schema.glue_partition_keys(),
+                    storage_descriptor=glue.CfnTable.StorageDescriptorProperty(
+                        columns=monitor_schema.glue_columns(),
+                        input_format=monitor_schema.TEXT_INPUT_FORMAT,
+                        output_format=monitor_schema.TEXT_OUTPUT_FORMAT,
+                        compressed=True,
+                        location=f"{ndjson_location}/",
+                        serde_info=glue.CfnTable.SerdeInfoProperty(
+                            serialization_library=monitor_schema.JSON_SERDE
+                        ),
+                    ),
+                    table_type="EXTERNAL_TABLE",
+                ),
+            )
+            ndjson_table.add_depends_on(monitor_db)
+
         # Policy for Lambda to create or replace view. Also update Glue and Athena artifacts
         monitoring_lambda.add_to_role_policy(
             iam.PolicyStatement(
@@ -241,6 +561,55 @@ class DataLakeMonitoringStack(Stack):
             )
         )
 
+        compaction_lambda.role.add_to_policy(
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=[
+                    "s3:PutObject*",
+                    "s3:DeleteObject*",
+                    "s3:GetObject*",
+                    "s3:GetBucket*",
+                    "s3:List*",
+                    "s3:Head*",
+                    "glue:GetPartition",
+                    "glue:UpdatePartition",
+                ],
+                resources=[
+                    f"arn:aws:s3:::{cf.S3_MONITOR_BUCKET}",
+                    f"arn:aws:s3:::{cf.S3_MONITOR_BUCKET}/{cf.MONITOR_DB}/*",
+                    f"arn:aws:glue:{cf.REGION}:{cf.ACCOUNT}:catalog",
+                    f"arn:aws:glue:{cf.REGION}:{cf.ACCOUNT}:database/{cf.MONITOR_DB}",
+                    f"arn:aws:glue:{cf.REGION}:{cf.ACCOUNT}:table/{cf.MONITOR_DB}/{cf.MONITOR_TABLE}",
+                ],
+            )
+        )
+
+        rollup_lambda.role.add_to_policy(
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=[
+                    "s3:PutObject*",
+                    "s3:GetObject*",
+                    "s3:GetBucket*",
+                    "s3:List*",
+                    "s3:Head*",
+                ],
+                resources=[
+                    f"arn:aws:s3:::{cf.S3_MONITOR_BUCKET}",
+                    f"arn:aws:s3:::{cf.S3_MONITOR_BUCKET}/{cf.MONITOR_DB}/*",
+                ],
+            )
+        )
+
+        # Run metrics of the Glue job rows
+        monitoring_lambda.role.add_to_policy(
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=["glue:GetJobRun", "glue:GetJobRuns", "glue:BatchGetJobs"],
+                resources=[f"arn:aws:glue:{cf.REGION}:{cf.ACCOUNT}:job/*"],
+            )
+        )
+
         # Database and Tables Access
         monitoring_lambda.role.add_to_policy(
             iam.PolicyStatement(
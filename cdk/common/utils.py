@@ -1,6 +1,16 @@
+import importlib.util
+from types import ModuleType
 from typing import Dict
 
 
 def select_artifacts(artifacts: Dict, keep_artifact:str):
     """Remove all other artifacts except for keep_artifact"""
     return [v for k, v in artifacts.items() if k != keep_artifact]
+
+
+def load_source_module(name: str, path: str) -> ModuleType:
+    """Load a dependency free module from the Lambda sources, e.g. the shared monitor schema"""
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
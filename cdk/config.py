@@ -1,4 +1,5 @@
 """Constants file for resource naming and env values"""
+import json
 import os
 ACCOUNT = os.environ["ACCOUNT"]
 REGION = os.environ["REGION"]
@@ -20,20 +21,101 @@ S3_MONITOR_BUCKET = f"{ACCOUNT}-{REGION}-monitor"
 # SNS
 MONITOR_SNS_TOPIC = "dl-monitor-sns"
 
+# MONITORING LAMBDA SIZING - recommended by `python local_exec.py --tune --write-tuning`
+# (src/datalake_monitoring), each overridable through the environment
+MONITOR_TUNING_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "monitor_tuning.json"
+)
+MONITOR_TUNING = {}
+if os.path.exists(MONITOR_TUNING_FILE):
+    with open(MONITOR_TUNING_FILE) as tuning_file:
+        MONITOR_TUNING = json.load(tuning_file)["recommended"]
+
+# SQS buffer between the SNS topic and the monitoring Lambda (optional)
+MONITOR_SQS_BUFFER = os.environ.get("MONITOR_SQS_BUFFER", "false").lower() == "true"
+MONITOR_SQS_QUEUE = "dl-monitor-queue"
+MONITOR_SQS_BATCH_SIZE = int(
+    os.environ.get("MONITOR_SQS_BATCH_SIZE", MONITOR_TUNING.get("sqs_batch_size", 100))
+)
+MONITOR_SQS_BATCHING_WINDOW_SECONDS = int(
+    os.environ.get("MONITOR_SQS_BATCHING_WINDOW_SECONDS", "30")
+)
+MONITOR_SQS_MAX_RECEIVE_COUNT = 5
+
+_MONITOR_EVENT_SOURCE = "sqs" if MONITOR_SQS_BUFFER else "sns"
+MONITOR_MEMORY_SIZE = int(
+    os.environ.get("MONITOR_MEMORY_SIZE", MONITOR_TUNING.get("memory_size", 512))
+)
+MONITOR_ARCHITECTURE = os.environ.get(
+    "MONITOR_ARCHITECTURE", MONITOR_TUNING.get("architecture", "x86_64")
+)  # x86_64 or arm64 (Graviton)
+MONITOR_TIMEOUT_SECONDS = int(os.environ.get("MONITOR_TIMEOUT_SECONDS", "180"))
+# 0 leaves the function unreserved, respectively without provisioned concurrency
+MONITOR_RESERVED_CONCURRENCY = int(
+    os.environ.get(
+        "MONITOR_RESERVED_CONCURRENCY",
+        MONITOR_TUNING.get("reserved_concurrency", {}).get(_MONITOR_EVENT_SOURCE, 0),
+    )
+)
+MONITOR_PROVISIONED_CONCURRENCY = int(
+    os.environ.get(
+        "MONITOR_PROVISIONED_CONCURRENCY",
+        MONITOR_TUNING.get("provisioned_concurrency", {}).get(_MONITOR_EVENT_SOURCE, 0),
+    )
+)
+
+# Cross-container idempotency store of the monitor table writes (DynamoDB)
+MONITOR_IDEMPOTENCY_TABLE = os.environ.get("MONITOR_IDEMPOTENCY_TABLE", "dl-monitor-idempotency")
+
+# Open Glue job and crawler runs (DynamoDB), matched with their completions for run durations;
+# SLAs in seconds per job or crawler name, or per service type, as JSON
+MONITOR_RUN_STATE_TABLE = os.environ.get("MONITOR_RUN_STATE_TABLE", "dl-monitor-run-state")
+MONITOR_RUN_SLA_SECONDS = os.environ.get("MONITOR_RUN_SLA_SECONDS", "{}")
+
+# Writer of the monitor rows: "awswrangler" (awswrangler layer), "pyarrow" (pyarrow-only
+# layer built by `make slim-layer`) or "ndjson" (no layer, rows in MONITOR_NDJSON_TABLE)
+MONITOR_WRITER_BACKEND = os.environ.get("MONITOR_WRITER_BACKEND", "awswrangler")
+
 # ATHENA
 MONITOR_DB = "monitor"
 MONITOR_TABLE = "monitor"
+MONITOR_NDJSON_TABLE = "monitor_ndjson"
 LEGISLATOR_DB = "legislators"
 
+# ROLLUPS - hourly and daily aggregates of the monitor table, refreshed every interval
+MONITOR_HOURLY_TABLE = "monitor_hourly"
+MONITOR_DAILY_TABLE = "monitor_daily"
+ROLLUP_INTERVAL_MINUTES = 15
+ROLLUP_MEMORY_SIZE = 512
+
+# COMPACTION
+COMPACTION_LOOKBACK_DAYS = 3
+COMPACTION_MEMORY_SIZE = 1024
+
 # NOTIFICATION - SLACK
 SLACK_WEBHOOK_SECRET_NAME = "slack_webhook"
 
+# NOTIFICATION - sinks, routing rules and severities of the monitoring Lambda as JSON (see
+# src/datalake_monitoring/config.py); empty keeps the Slack webhook alone. Webhook URLs and
+# routing keys are read from the monitoring secret, by each sink's "secret_key"
+MONITOR_NOTIFY_SINKS = os.environ.get("MONITOR_NOTIFY_SINKS", "")
+MONITOR_NOTIFY_ROUTES = os.environ.get("MONITOR_NOTIFY_ROUTES", "")
+MONITOR_NOTIFY_SEVERITIES = os.environ.get("MONITOR_NOTIFY_SEVERITIES", "")
+
 # REPO PATHS
 PATH_CDK = os.path.dirname(os.path.abspath(__file__))
 PATH_ROOT = os.path.dirname(PATH_CDK)
 PATH_SRC = os.path.join(PATH_ROOT, 'src')
 
-WRANGLER_ASSET = "awswrangler-layer-3.2.0-py3.10.zip"  # this is referenced in src/datalake_monitoring/Makefile
+# requests, and pyarrow for the pyarrow backend, for the pyarrow and ndjson writer backends;
+# built by src/datalake_monitoring/Makefile (make slim-layer)
+SLIM_ASSET = f"{MONITOR_WRITER_BACKEND}-layer-py3.10-{MONITOR_ARCHITECTURE}.zip"
+# this is downloaded by src/datalake_monitoring/Makefile, for the monitoring Lambda's architecture
+WRANGLER_ASSET = (
+    "awswrangler-layer-3.2.0-py3.10-arm64.zip"
+    if MONITOR_ARCHITECTURE == "arm64"
+    else "awswrangler-layer-3.2.0-py3.10.zip"
+)
 
 # Crawler source data
 LEGISLATORS_PATH = "legislators"
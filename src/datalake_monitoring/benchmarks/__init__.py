@@ -0,0 +1,2 @@
+"""Local benchmarks for the monitoring Lambda. Run from `src/datalake_monitoring`,
+e.g. `python -m benchmarks.batch_write`"""
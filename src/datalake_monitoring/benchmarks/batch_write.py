@@ -0,0 +1,75 @@
+"""Per-invocation latency of record-at-a-time vs batched Parquet persistence.
+
+S3, the Glue catalog and job run lookups, Secrets Manager and the payload store are the local
+stand-ins of local_exec.local_services, with the awswrangler writer the comparison is about.
+
+    python -m benchmarks.batch_write [--put-latency 0.03] [--catalog-latency 0.05]
+"""
+import argparse
+import logging
+import statistics
+import tempfile
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+import handler
+from benchmarks.events import sns_batch
+from commons.writers import BACKEND_AWSWRANGLER
+from local_exec import local_services
+
+BATCH_SIZES = (1, 10, 100)
+
+
+def run_invocation(event: dict, batched: bool) -> float:
+    """Time a single handler invocation against the local services"""
+    with mock.patch.object(handler.ProcessEvent, "notify", lambda self, item: None):
+        ps = handler.ProcessEvent(event=event, context={}, cf=handler.cf, log=logging.getLogger())
+        if not batched:
+            # Previous behaviour: one DataFrame and one dataset write per record
+            def put_per_record():
+                items = ps.items
+                for item in items:
+                    ps.items = [item]
+                    handler.ProcessEvent.put_items_athena(ps)
+                ps.items = items
+
+            ps.put_items_athena = put_per_record
+        start = time.perf_counter()
+        ps.execute()
+        return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--put-latency", type=float, default=0.03)
+    parser.add_argument("--catalog-latency", type=float, default=0.05)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    services_args = SimpleNamespace(
+        put_latency=args.put_latency,
+        catalog_latency=args.catalog_latency,
+        secret_latency=0.0,
+        webhook_delay=0.0,
+        writer=BACKEND_AWSWRANGLER,
+    )
+
+    print(f"{'batch':>6} {'mode':>10} {'latency_s':>10} {'files':>6} {'catalog':>8}")
+    for size in BATCH_SIZES:
+        for batched in (False, True):
+            with tempfile.TemporaryDirectory() as root, local_services(
+                services_args, root
+            ) as services:
+                timings = [run_invocation(sns_batch(size), batched) for _ in range(args.repeat)]
+                dataset = services.dataset
+                print(
+                    f"{size:>6} {'batched' if batched else 'per-record':>10} "
+                    f"{statistics.median(timings):>10.3f} "
+                    f"{dataset.files_written // args.repeat:>6} "
+                    f"{dataset.catalog_calls // args.repeat:>8}"
+                )
+
+
+if __name__ == "__main__":
+    main()
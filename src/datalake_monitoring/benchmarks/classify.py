@@ -0,0 +1,101 @@
+"""Records/sec of event classification and item composition: the registry dispatch against
+the previous try/except probing, on a synthetic mixed corpus.
+
+    python -m benchmarks.classify [--records 60000]
+"""
+import argparse
+import time
+from functools import reduce
+from operator import getitem
+
+from benchmarks.events import SAMPLE_BUILDERS
+from commons.event_registry import classify_event
+from commons.ddb_lambda_item import SUCCESS_ITEM as LAMBDA_SUCCESS_TEMPLATE
+from commons.ddb_lambda_item import FAILURE_ITEM as LAMBDA_FAILURE_TEMPLATE
+from commons.ddb_glue_job_item import SUCCESS_ITEM as GLUE_JOB_SUCCESS_TEMPLATE
+from commons.ddb_glue_job_item import FAILURE_ITEM as GLUE_JOB_FAILURE_TEMPLATE
+from commons.ddb_glue_crawler_item import SUCCESS_ITEM as GLUE_CRAWLER_SUCCESS_TEMPLATE
+from commons.ddb_glue_crawler_item import FAILURE_ITEM as GLUE_CRAWLER_FAILURE_TEMPLATE
+
+
+def legacy_compose(body: dict) -> dict:
+    """The previous identify_event_source / get_item_template / generic_compose_item path"""
+    item = {}
+    try:
+        if body["requestContext"]["functionArn"].find("lambda") != -1:
+            item["service_type"] = "lambda"
+            if body["requestContext"]["condition"].lower() == "success":
+                item["event_type"] = "succeeded"
+            else:
+                item["event_type"] = "failed"
+    except KeyError:
+        pass
+    try:
+        if body["detail-type"].lower().find("glue job") != -1:
+            item["service_type"] = "glue_job"
+            item["event_type"] = body["detail"]["state"].lower()
+    except KeyError:
+        pass
+    try:
+        if body["detail-type"].lower().find("glue crawler") != -1:
+            item["service_type"] = "glue_crawler"
+            item["event_type"] = body["detail"]["state"].lower()
+    except KeyError:
+        pass
+
+    job_succeeded = item["event_type"].lower() == "succeeded"
+    is_lambda = item["service_type"].lower() == "lambda"
+    is_glue_job = item["service_type"].lower() == "glue_job"
+    is_glue_crawler_job = item["service_type"].lower() == "glue_crawler"
+    if is_lambda and job_succeeded:
+        template = LAMBDA_SUCCESS_TEMPLATE
+    elif is_lambda and not job_succeeded:
+        template = LAMBDA_FAILURE_TEMPLATE
+    elif is_glue_job and not job_succeeded:
+        template = GLUE_JOB_FAILURE_TEMPLATE
+    elif is_glue_job and job_succeeded:
+        template = GLUE_JOB_SUCCESS_TEMPLATE
+    elif is_glue_crawler_job and not job_succeeded:
+        template = GLUE_CRAWLER_SUCCESS_TEMPLATE
+    else:
+        template = GLUE_CRAWLER_FAILURE_TEMPLATE
+
+    for key in template:
+        if len(template[key]) > 0:
+            item[key] = reduce(getitem, template[key], body)
+    return item
+
+
+def registry_compose(body: dict) -> dict:
+    """The registry dispatch used by ProcessEvent"""
+    event_class = classify_event(body)
+    item = {"service_type": event_class.service_type, "event_type": event_class.event_type}
+    event_class.extract(body, item)
+    return item
+
+
+def records_per_second(compose, corpus) -> float:
+    start = time.perf_counter()
+    for body in corpus:
+        compose(body)
+    return len(corpus) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--records", type=int, default=60000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    builders = list(SAMPLE_BUILDERS.values())
+    corpus = [builders[i % len(builders)]() for i in range(args.records)]
+
+    results = {}
+    for name, compose in (("legacy", legacy_compose), ("registry", registry_compose)):
+        results[name] = max(records_per_second(compose, corpus) for _ in range(args.repeat))
+        print(f"{name:>10}: {results[name]:>12,.0f} records/sec")
+    print(f"{'speedup':>10}: {results['registry'] / results['legacy']:>12.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Decode cost per record of the JSON backends, eager and lazy, on the sample messages and on
+large (~100 KB) ones: a Lambda destination failure carrying a big requestPayload and stackTrace,
+and a Glue job event with a big detail. Each record is decoded and its item composed the way
+the monitoring Lambda does.
+
+    python -m benchmarks.decode [--records 2000] [--large-kb 100]
+"""
+import argparse
+import json
+import time
+
+from benchmarks.events import SAMPLE_BUILDERS, glue_job_event, lambda_destination_event
+from commons.event_registry import EVENT_TYPE_SUCCESS, classify_event
+from commons.json_codec import BACKENDS, LAZY_BACKEND, JSONCodec, available
+
+
+def large_lambda_failure(size_kb: int) -> dict:
+    event = lambda_destination_event("lambda-fail", success=False)
+    rows = [
+        {"id": n, "name": f"record-{n}", "value": "x" * 40} for n in range(size_kb * 1024 // 140)
+    ]
+    event["requestPayload"] = {"version": "0", "detail": {"records": rows}}
+    frame = '  File "/var/task/lib/module.py", line 120, in transform\n    return step(row)\n'
+    event["responsePayload"]["stackTrace"] = [frame] * (size_kb * 1024 // (4 * len(frame)))
+    return event
+
+
+def large_glue_job_failure(size_kb: int) -> dict:
+    event = glue_job_event("glue-job-fail", "FAILED")
+    event["detail"]["arguments"] = {f"--arg-{n}": "v" * 80 for n in range(size_kb * 1024 // 100)}
+    return event
+
+
+def compose(body) -> dict:
+    """Classification, template extraction and the remedy fields read on failure"""
+    event_class = classify_event(body)
+    item = {}
+    event_class.extract(body, item)
+    failed = event_class.event_type != EVENT_TYPE_SUCCESS
+    if event_class.service_type == "lambda" and failed:
+        item["error_message"] = body["responsePayload"]["errorMessage"]
+        item["exception_details"] = body["responsePayload"]["stackTrace"][0]
+    elif event_class.service_type == "glue_job" and failed:
+        item["error_message"] = body["detail"]["message"]
+    return item
+
+
+def per_record_us(decode, messages, repeat: int = 3) -> float:
+    """Best of `repeat` runs, in microseconds per record"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for message in messages:
+            compose(decode(message))
+        best = min(best, time.perf_counter() - start)
+    return best / len(messages) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--records", type=int, default=2000)
+    parser.add_argument("--large-kb", type=int, default=100)
+    args = parser.parse_args()
+
+    builders = list(SAMPLE_BUILDERS.values())
+    small = [json.dumps(builders[n % len(builders)]()) for n in range(args.records)]
+    large_count = max(args.records // 10, 20)
+    large = [
+        json.dumps(
+            large_lambda_failure(args.large_kb) if n % 2 else large_glue_job_failure(args.large_kb)
+        )
+        for n in range(large_count)
+    ]
+    print(
+        f"small: {len(small):,} records of ~{sum(map(len, small)) // len(small):,} B, "
+        f"large: {len(large):,} records of ~{sum(map(len, large)) // len(large) // 1024:,} KB"
+    )
+    print(f"{'decoder':<28}{'small us/rec':>14}{'large us/rec':>14}")
+    decoders = [
+        (f"{backend} eager", JSONCodec(backend, lazy_min_bytes=-1).loads)
+        for backend in BACKENDS
+        if available(backend)
+    ]
+    if available(LAZY_BACKEND):
+        decoders.append((f"{LAZY_BACKEND} lazy", JSONCodec(lazy_min_bytes=0).lazy))
+        codec = JSONCodec()
+        decoders.append(
+            (f"default ({codec.backend}, lazy >= {codec.lazy_min_bytes // 1024} KB)", codec.lazy)
+        )
+    for name, decode in decoders:
+        print(
+            f"{name:<28}{per_record_us(decode, small):>14,.1f}"
+            f"{per_record_us(decode, large):>14,.1f}"
+        )
+    missing = [backend for backend in BACKENDS if not available(backend)]
+    if missing:
+        print(f"not installed: {', '.join(missing)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""Synthetic SNS events matching what EventBridge and Lambda destinations publish"""
+import json
+import random
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional
+
+ACCOUNT = "123456789012"
+REGION = "us-west-2"
+TOPIC_ARN = f"arn:aws:sns:{REGION}:{ACCOUNT}:dl-monitor-sns"
+
+
+def _now(at: Optional[datetime] = None) -> str:
+    return (at or datetime.now(timezone.utc)).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def glue_job_event(
+    job_name: str = "glue-job-fail",
+    state: str = "FAILED",
+    run_id: Optional[str] = None,
+    at: Optional[datetime] = None,
+) -> Dict:
+    """Glue Job State Change event; RUNNING starts run `run_id` (new if not given)"""
+    failed = state not in ("SUCCEEDED", "RUNNING")
+    messages = {"SUCCEEDED": "Job run succeeded", "RUNNING": "Job is running"}
+    return {
+        "version": "0",
+        "id": str(uuid.uuid4()),
+        "detail-type": "Glue Job State Change",
+        "source": "aws.glue",
+        "account": ACCOUNT,
+        "time": _now(at),
+        "region": REGION,
+        "resources": [],
+        "detail": {
+            "jobName": job_name,
+            "severity": "ERROR" if failed else "INFO",
+            "state": state,
+            "jobRunId": run_id or f"jr_{uuid.uuid4().hex}{uuid.uuid4().hex}",
+            "message": messages.get(state, "NameError: Raised a Glue Job Exception"),
+        },
+    }
+
+
+def glue_crawler_event(
+    crawler_name: str = "glue-crawler-fail", state: str = "Failed", at: Optional[datetime] = None
+) -> Dict:
+    """Glue Crawler State Change event; Started starts a run"""
+    detail = {
+        "crawlerName": crawler_name,
+        "state": state,
+        "message": f"Crawler {state}",
+        "accountId": ACCOUNT,
+    }
+    if state == "Failed":
+        detail["errorMessage"] = (
+            "Service Principal: glue.amazonaws.com is not authorized to perform: "
+            f"s3:GetObject on resource: arn:aws:s3:::{ACCOUNT}-{REGION}-landing/legislators"
+        )
+    return {
+        "version": "0",
+        "id": str(uuid.uuid4()),
+        "detail-type": "Glue Crawler State Change",
+        "source": "aws.glue",
+        "account": ACCOUNT,
+        "time": _now(at),
+        "region": REGION,
+        "resources": [],
+        "detail": detail,
+    }
+
+
+def lambda_destination_event(
+    function_name: str = "lambda-fail", success: bool = False, payload_bytes: int = 0
+) -> Dict:
+    """Lambda asynchronous invocation destination record; the request payload and stack trace
+    of a failure are padded to about `payload_bytes` each"""
+    request_id = str(uuid.uuid4())
+    padding = "x" * payload_bytes
+    return {
+        "version": "1.0",
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="milliseconds")[:-6] + "Z",
+        "requestContext": {
+            "requestId": request_id,
+            "functionArn": f"arn:aws:lambda:{REGION}:{ACCOUNT}:function:{function_name}:$LATEST",
+            "condition": "Success" if success else "RetriesExhausted",
+            "approximateInvokeCount": 1 if success else 3,
+        },
+        "requestPayload": {
+            "version": "0",
+            "id": str(uuid.uuid4()),
+            "detail": {"records": padding} if padding else {},
+        },
+        "responseContext": {"statusCode": 200, "executedVersion": "$LATEST"}
+        if success
+        else {"statusCode": 200, "executedVersion": "$LATEST", "functionError": "Unhandled"},
+        "responsePayload": None
+        if success
+        else {
+            "errorMessage": "Some serious exception ",
+            "errorType": "NameError",
+            "requestId": request_id,
+            "stackTrace": [
+                '  File "/var/task/lambda_fail.py", line 5, in handler\n'
+                '    raise NameError("Some serious exception ")\n'
+            ]
+            + ([f'  File "/var/task/lib.py", line 1, in {padding}\n'] if padding else []),
+        },
+    }
+
+
+SAMPLE_BUILDERS = {
+    "lambda_success": lambda: lambda_destination_event("lambda-success", success=True),
+    "lambda_failure": lambda: lambda_destination_event("lambda-fail", success=False),
+    "glue_job_success": lambda: glue_job_event("glue-job-success", "SUCCEEDED"),
+    "glue_job_failure": lambda: glue_job_event("glue-job-fail", "FAILED"),
+    "glue_crawler_success": lambda: glue_crawler_event("glue-crawler-success", "Succeeded"),
+    "glue_crawler_failure": lambda: glue_crawler_event("glue-crawler-fail", "Failed"),
+    # Close to SNS's 256 KB message limit
+    "lambda_failure_large": lambda: lambda_destination_event(
+        "lambda-fail-large", success=False, payload_bytes=100_000
+    ),
+}
+# Kinds left out of the default mix
+RARE_KINDS = ("lambda_failure_large",)
+
+
+def sns_record(message: Dict) -> Dict:
+    """Wrap a message the way SNS delivers it to a Lambda subscriber"""
+    return {
+        "EventSource": "aws:sns",
+        "EventVersion": "1.0",
+        "EventSubscriptionArn": f"{TOPIC_ARN}:{uuid.uuid4()}",
+        "Sns": {
+            "Type": "Notification",
+            "MessageId": str(uuid.uuid4()),
+            "TopicArn": TOPIC_ARN,
+            "Subject": None,
+            "Message": json.dumps(message),
+            "Timestamp": _now(),
+        },
+    }
+
+
+def sns_batch(size: int, kinds: List[str] = None) -> Dict:
+    """SNS event with `size` records cycling through `kinds` (default: all but the rare
+    kinds)"""
+    kinds = kinds or [kind for kind in SAMPLE_BUILDERS if kind not in RARE_KINDS]
+    return {"Records": [sns_record(SAMPLE_BUILDERS[kinds[i % len(kinds)]]()) for i in range(size)]}
+
+
+def parse_mix(spec: Optional[str]) -> Dict[str, float]:
+    """Weights per sample kind from `kind=weight,...`; all but the rare kinds equally when
+    empty"""
+    if not spec:
+        return {kind: 1.0 for kind in SAMPLE_BUILDERS if kind not in RARE_KINDS}
+    mix = {}
+    for part in spec.split(","):
+        kind, _, weight = part.strip().partition("=")
+        if kind not in SAMPLE_BUILDERS:
+            raise ValueError(f"Unknown kind {kind!r}, expected one of {list(SAMPLE_BUILDERS)}")
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+def mixed_batches(
+    mix: Dict[str, float], batch_size: int, batches: int, seed: int = 7
+) -> Iterator[Dict]:
+    """`batches` SNS events of `batch_size` records drawn from the kinds in `mix`"""
+    rnd = random.Random(seed)
+    kinds, weights = list(mix), list(mix.values())
+    for _ in range(batches):
+        yield {
+            "Records": [
+                sns_record(SAMPLE_BUILDERS[kind]())
+                for kind in rnd.choices(kinds, weights=weights, k=batch_size)
+            ]
+        }
+
+
+def replay_batches(path: str, batch_size: int) -> Iterator[Dict]:
+    """Events recorded one per line in a JSONL file, re-batched by `batch_size`. A line is a
+    Lambda event (its records are re-batched), an SNS or SQS record, or a bare monitoring
+    message, which is wrapped in an SNS record"""
+    records: List[Dict] = []
+    with open(path) as lines:
+        for line in lines:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if "Records" in entry:
+                records.extend(entry["Records"])
+            elif "Sns" in entry or "eventSource" in entry:
+                records.append(entry)
+            else:
+                records.append(sns_record(entry))
+            while len(records) >= batch_size:
+                yield {"Records": records[:batch_size]}
+                records = records[batch_size:]
+    if records:
+        yield {"Records": records}
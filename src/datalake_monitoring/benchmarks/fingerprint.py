@@ -0,0 +1,70 @@
+"""Throughput of error text normalization and fingerprinting on synthetic failure messages.
+
+    python -m benchmarks.fingerprint [--messages 100000]
+"""
+import argparse
+import random
+import time
+import uuid
+
+from commons.fingerprint import AlertDedup, error_fingerprint, normalize_error_text
+
+TEMPLATES = [
+    "An error occurred while calling o{n}.pyWriteDynamicFrame. Job run jr_{hex64} failed at {ts}",
+    "Object at 0x{hex12} has no attribute 'collect'; request {uuid} took {n}.{n} ms",
+    "Service Principal: glue.amazonaws.com is not authorized to perform: s3:GetObject on "
+    "resource: arn:aws:s3:::123456789012-us-west-2-landing/legislators/part-{n}.json",
+    "Task timed out after {n}.{n} seconds ({uuid})",
+    '{{"Exception": {{"error_message": "Connection reset by peer after {n} retries at {ts}"}}}}',
+]
+
+
+def synthetic_messages(count: int):
+    rnd = random.Random(7)
+    messages = []
+    for _ in range(count):
+        template = rnd.choice(TEMPLATES)
+        messages.append(
+            template.format(
+                n=rnd.randint(0, 100000),
+                hex64=uuid.uuid4().hex + uuid.uuid4().hex,
+                hex12=uuid.uuid4().hex[:12],
+                uuid=uuid.uuid4(),
+                ts=f"2023-07-{rnd.randint(10, 28)}T{rnd.randint(10, 23)}:14:0{rnd.randint(0, 9)}Z",
+            )
+        )
+    return messages
+
+
+def rate(function, messages, repeat: int = 3) -> float:
+    """Best of `repeat` runs, in messages/sec"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for message in messages:
+            function(message)
+        best = min(best, time.perf_counter() - start)
+    return len(messages) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=100000)
+    args = parser.parse_args()
+
+    messages = synthetic_messages(args.messages)
+    fingerprints = {error_fingerprint(message) for message in messages}
+    error_fingerprint.cache_clear()
+
+    print(f"messages            : {args.messages:,} ({len(TEMPLATES)} error templates)")
+    print(f"distinct fingerprints: {len(fingerprints):,}")
+    print(f"normalize           : {rate(normalize_error_text, messages):>12,.0f} msg/s")
+    print(f"fingerprint         : {rate(error_fingerprint.__wrapped__, messages):>12,.0f} msg/s")
+    dedup = AlertDedup(window_seconds=900)
+    keys = [error_fingerprint(message) for message in messages]
+    print(f"dedup lookup        : {rate(dedup.should_alert, keys):>12,.0f} msg/s")
+    print(f"alerts suppressed   : {dedup.suppressed:,}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Throughput and accuracy of the idempotency layer on a synthetic stream of monitoring events
+with at-least-once redeliveries, spread over several containers.
+
+    python -m benchmarks.idempotency [--events 200000] [--duplicates 0.05] [--containers 4]
+
+false positives: first deliveries dropped as duplicates (rows lost)
+missed duplicates: redeliveries that were written again (left for compaction)
+"""
+import argparse
+import random
+import time
+import uuid
+
+from commons.idempotency import IdempotencyGuard, InMemoryIdempotencyStore, idempotency_key
+
+
+def synthetic_stream(events: int, duplicate_ratio: float, max_delay: int, seed: int = 7):
+    """Items in delivery order; a redelivery arrives up to `max_delay` events after the
+    original"""
+    rnd = random.Random(seed)
+    stream = []
+    redeliveries = {}
+    for position in range(events):
+        item = {
+            "service_request_id": str(uuid.UUID(int=rnd.getrandbits(128))),
+            "event_type": rnd.choice(("succeeded", "failed")),
+        }
+        stream.append(item)
+        if rnd.random() < duplicate_ratio:
+            redeliveries.setdefault(position + rnd.randint(1, max_delay), []).append(dict(item))
+        stream.extend(redeliveries.pop(position, []))
+    for items in redeliveries.values():
+        stream.extend(items)
+    return stream
+
+
+def run(stream, guards, batch_size: int):
+    """Feed the stream in batches round-robin to the containers' guards; returns
+    (seconds, written keys)"""
+    written = []
+    start = time.perf_counter()
+    for number, offset in enumerate(range(0, len(stream), batch_size)):
+        guard = guards[number % len(guards)]
+        batch = stream[offset:offset + batch_size]
+        keep, keys, _ = guard.admit(batch)
+        guard.commit(keys)
+        written.extend(idempotency_key(batch[index]) for index in keep)
+    return time.perf_counter() - start, written
+
+
+def report(name: str, stream, guards, batch_size: int):
+    seconds, written = run(stream, guards, batch_size)
+    unique = {idempotency_key(item) for item in stream}
+    written_unique = set(written)
+    false_positives = len(unique - written_unique)
+    missed = len(written) - len(written_unique)
+    duplicates = len(stream) - len(unique)
+    print(
+        f"{name:<22}: {len(stream) / seconds:>12,.0f} events/s  "
+        f"false positives {false_positives / len(unique):.4%}  "
+        f"missed duplicates {missed:,}/{duplicates:,}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--events", type=int, default=200000)
+    parser.add_argument("--duplicates", type=float, default=0.05, help="redelivery ratio")
+    parser.add_argument("--max-delay", type=int, default=20000, help="in events")
+    parser.add_argument("--containers", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--cache-entries", type=int, default=16384)
+    args = parser.parse_args()
+
+    stream = synthetic_stream(args.events, args.duplicates, args.max_delay)
+    print(f"events              : {len(stream):,} ({args.duplicates:.0%} redelivered)")
+
+    def guards(store):
+        return [
+            IdempotencyGuard(store=store, max_entries=args.cache_entries)
+            for _ in range(args.containers)
+        ]
+
+    report("within batch only", stream, [IdempotencyGuard(max_entries=0)], args.batch_size)
+    report("LRU only", stream, guards(None), args.batch_size)
+    report("LRU + shared store", stream, guards(InMemoryIdempotencyStore()), args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Cold start import report for the monitoring Lambda.
+
+Each measurement runs in a fresh interpreter with `-X importtime`, comparing the handler as
+deployed (heavy modules imported lazily) against importing it together with everything it
+used to load eagerly.
+
+    python -m benchmarks.import_time [--repeat 5] [--top 10]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = {
+    "lazy": "import handler",
+    "eager": "import handler, awswrangler, pandas, requests, boto3",
+}
+
+
+def import_profile(statement: str) -> Tuple[int, List[Tuple[int, str]]]:
+    """Run `statement` in a fresh interpreter; return total and per-module self times in us"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=HERE,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    modules = []
+    total = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = [part.strip() for part in line[12:].split("|")]
+        modules.append((int(self_us), name.strip()))
+        if not name.startswith(" "):
+            total += int(cumulative_us)
+    return total, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    report: Dict[str, int] = {}
+    for scenario, statement in SCENARIOS.items():
+        totals = []
+        for _ in range(args.repeat):
+            total, modules = import_profile(statement)
+            totals.append(total)
+        report[scenario] = int(statistics.median(totals))
+        print(f"\n[{scenario}] {statement}")
+        print(f"  median import time : {report[scenario] / 1000:.1f} ms over {args.repeat} runs")
+        print(f"  modules imported   : {len(modules)}")
+        for self_us, name in sorted(modules, reverse=True)[: args.top]:
+            print(f"    {self_us / 1000:8.1f} ms  {name.strip()}")
+
+    saved = report["eager"] - report["lazy"]
+    print(f"\nCold start import saving: {saved / 1000:.1f} ms ({saved / report['eager']:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""Check that the monitoring Lambda can send notifications with only the Lambda runtime and a
+slim layer, as deployed with the pyarrow and ndjson writer backends.
+
+The handler is imported in a fresh interpreter whose imports are limited to the standard
+library, the packages the Lambda Python runtime provides, the layer and the Lambda's own
+modules; it then sends a notification through every webhook sink type to a local stub. A
+package missing from the layer fails the check instead of failing notifications silently.
+
+    python -m benchmarks.layer_check --layer libs/pyarrow-layer-py3.10-x86_64.zip
+    python -m benchmarks.layer_check --layer ./layer/python --writer ndjson
+
+The layer must be built for this machine's platform and Python version (`make
+slim-layer-check` does), as a directory of packages or a layer zip with a python/ folder.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import textwrap
+import zipfile
+from typing import Dict, List
+
+from benchmarks.stubs import WebhookStubServer
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Top-level modules of the packages the Lambda Python runtime provides, see
+# benchmarks.writers.RUNTIME_PACKAGES
+RUNTIME_MODULES = ("boto3", "botocore", "s3transfer", "jmespath", "urllib3", "dateutil", "six")
+SINK_TYPES = ("slack", "teams", "webhook")
+
+# Runs in the checked interpreter: blocks every import the Lambda could not resolve, then
+# sends one notification per sink
+CHECK_SCRIPT = textwrap.dedent(
+    """
+    import importlib.abc, json, os, sys
+
+    allowed = set(json.loads(os.environ["LAYER_CHECK_ALLOWED"]))
+
+    class LambdaImports(importlib.abc.MetaPathFinder):
+        def find_spec(self, name, path=None, target=None):
+            top = name.partition(".")[0]
+            if top in allowed or top in sys.stdlib_module_names or top.startswith("_"):
+                return None
+            raise ModuleNotFoundError(f"No module named {name!r} in the Lambda", name=name)
+
+    sys.meta_path.insert(0, LambdaImports())
+    sys.path.insert(0, os.environ["LAYER_CHECK_LAYER"])
+
+    import handler
+
+    outcomes = handler.NOTIFIER.send(
+        {"service": "lambda", "service_name": "layer-check", "service_id": "r-1",
+         "exception_details": "layer check", "time_stamp": "2026-10-17T10:00:00Z"}
+    )
+    print(json.dumps([[outcome.sink, outcome.ok, outcome.error] for outcome in outcomes]))
+    """
+)
+
+
+def layer_path(layer: str, workdir: str) -> str:
+    """Directory holding the packages of `layer`, a directory or a layer zip"""
+    if os.path.isdir(layer):
+        return layer
+    with zipfile.ZipFile(layer) as archive:
+        archive.extractall(workdir)
+    return os.path.join(workdir, "python")
+
+
+def allowed_modules(layer_dir: str) -> List[str]:
+    """Top-level modules importable in the Lambda besides the standard library"""
+    local = [name.rsplit(".py", 1)[0] for name in os.listdir(HERE) if not name.startswith(".")]
+    layer = [name.rsplit(".py", 1)[0] for name in os.listdir(layer_dir)]
+    return sorted({*RUNTIME_MODULES, *local, *layer})
+
+
+def check(layer: str, writer: str = "pyarrow") -> Dict:
+    """Send a notification through every webhook sink type with only `layer` installed;
+    returns {"ok": bool, "outcomes": [[sink, ok, error], ...], "stderr": str}"""
+    with tempfile.TemporaryDirectory() as workdir, WebhookStubServer() as stub:
+        layer_dir = layer_path(layer, workdir)
+        sinks = {name: {"type": name, "url": stub.url, "max_retries": 0} for name in SINK_TYPES}
+        env = {
+            **os.environ,
+            "LAYER_CHECK_LAYER": layer_dir,
+            "LAYER_CHECK_ALLOWED": json.dumps(allowed_modules(layer_dir)),
+            "WRITER_BACKEND": writer,
+            "NOTIFY_SINKS": json.dumps(sinks),
+            "NOTIFY_DEFAULT_SINKS": ",".join(SINK_TYPES),
+            "PYTHONNOUSERSITE": "1",
+        }
+        result = subprocess.run(
+            [sys.executable, "-c", CHECK_SCRIPT], cwd=HERE, env=env, capture_output=True, text=True
+        )
+        outcomes = json.loads(result.stdout.strip().splitlines()[-1]) if result.stdout else []
+        received = len(stub.received)
+    ok = (
+        result.returncode == 0
+        and len(outcomes) == len(SINK_TYPES)
+        and all(outcome[1] for outcome in outcomes)
+        and received == len(SINK_TYPES)
+    )
+    return {"ok": ok, "outcomes": outcomes, "stderr": result.stderr}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--layer", required=True, help="layer zip or directory of packages")
+    parser.add_argument("--writer", default="pyarrow", help="writer backend deployed with it")
+    args = parser.parse_args()
+    report = check(args.layer, args.writer)
+    for sink, ok, error in report["outcomes"]:
+        print(f"{sink:<8}: {'ok' if ok else f'FAILED {error}'}")
+    if not report["ok"]:
+        print(report["stderr"], file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""Wall time to notify N failures: one blocking request per failure (previous behaviour)
+against the pooled, concurrent SlackNotifier, using a local webhook stub.
+
+The routed run sends the failures through a Notifier with Slack, Teams, PagerDuty and SNS
+email sinks, each a local stub, where Teams answers after --slow-delay. It reports when each
+sink's last notification completed with a pool per sink, and with one pool shared by all
+sinks, where the slow sink holds up the others.
+
+    python -m benchmarks.notify [--failures 50] [--delay 0.2] [--workers 8] [--slow-delay 1]
+"""
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from benchmarks.stubs import LocalSNSClient, WebhookStubServer
+from commons.lazy_import import lazy_import
+from commons.notifier import (
+    NotificationOutcome,
+    Notifier,
+    PagerDutySink,
+    SlackNotifier,
+    SNSEmailSink,
+    TeamsSink,
+    gather,
+)
+from commons.routing import Router
+
+requests = lazy_import("requests")
+
+
+def sequential(url: str, messages) -> float:
+    start = time.perf_counter()
+    for message in messages:
+        requests.post(
+            url=url,
+            data=json.dumps(message),
+            headers={"Content-Type": "application/json"},
+            timeout=5,
+        )
+    return time.perf_counter() - start
+
+
+def pooled(url: str, messages, workers: int) -> float:
+    notifier = SlackNotifier(webhook_provider=lambda force_refresh: url, max_workers=workers)
+    start = time.perf_counter()
+    outcomes = notifier.send_all(messages)
+    elapsed = time.perf_counter() - start
+    assert all(outcome.ok for outcome in outcomes), [o for o in outcomes if not o.ok]
+    return elapsed
+
+
+def finished_at(outcomes: List[NotificationOutcome], ends: Dict[int, float]) -> Dict[str, float]:
+    """Seconds from the start until the last notification of each sink completed"""
+    finished: Dict[str, float] = {}
+    for index, outcome in enumerate(outcomes):
+        assert outcome.ok, outcome
+        finished[outcome.sink] = max(finished.get(outcome.sink, 0.0), ends[index])
+    return finished
+
+
+def routed(messages, delay: float, slow_delay: float, workers: int) -> Dict[str, Dict]:
+    """Completion time per sink with a pool per sink and with one shared pool"""
+    with WebhookStubServer(delay=delay) as slack, WebhookStubServer(
+        delay=slow_delay
+    ) as teams, WebhookStubServer(delay=delay, status=202) as pagerduty:
+        sinks = {
+            "slack": SlackNotifier(lambda _: slack.url, max_workers=workers),
+            "teams": TeamsSink("teams", lambda _: teams.url, max_workers=workers),
+            "pagerduty": PagerDutySink(
+                "pagerduty", lambda _: "routing-key", lambda _: pagerduty.url, max_workers=workers
+            ),
+            "email": SNSEmailSink(
+                "email", "arn:aws:sns:us-west-2:123:alerts", client=LocalSNSClient, max_workers=2
+            ),
+        }
+        router = Router(
+            [
+                {"severity": "critical", "sinks": ["pagerduty"]},
+                {"service_type": "glue_*", "sinks": ["slack", "teams", "email"]},
+            ],
+            default_sinks=["slack"],
+        )
+        notifier = Notifier(sinks, router)
+        results = {}
+        for mode in ("per-sink pools", "shared pool"):
+            start = time.perf_counter()
+            ends: Dict[int, float] = {}
+            futures = []
+            if mode == "shared pool":
+                pool = ThreadPoolExecutor(max_workers=workers * len(sinks))
+                for message in messages:
+                    for name in router.sinks(message):
+                        futures.append(pool.submit(sinks[name].send, message))
+            else:
+                for message in messages:
+                    futures.extend(notifier.submit(message))
+            for index, future in enumerate(futures):
+                future.add_done_callback(
+                    lambda _, index=index: ends.__setitem__(index, time.perf_counter() - start)
+                )
+            results[mode] = finished_at(gather(futures), ends)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--failures", type=int, default=50)
+    parser.add_argument("--delay", type=float, default=0.2, help="webhook response time (s)")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--slow-delay", type=float, default=1.0, help="slow sink response (s)")
+    args = parser.parse_args()
+
+    messages = [
+        {
+            "service": "glue_job",
+            "service_name": f"glue-job-{i}",
+            "service_id": str(i),
+            "exception_details": "NameError: Raised a Glue Job Exception",
+            "time_stamp": "2023-07-01T00:00:00Z",
+            "severity": "critical" if i % 5 == 0 else "error",
+        }
+        for i in range(args.failures)
+    ]
+    with WebhookStubServer(delay=args.delay) as server:
+        serial = sequential(server.url, messages)
+        concurrent = pooled(server.url, messages, args.workers)
+    print(f"failures={args.failures} webhook_delay={args.delay}s workers={args.workers}")
+    print(f"  sequential : {serial:8.2f} s")
+    print(f"  pooled     : {concurrent:8.2f} s  ({serial / concurrent:.1f}x)")
+
+    print(f"\nrouted, teams answering after {args.slow_delay}s (last notification done, s)")
+    results = routed(messages, args.delay, args.slow_delay, args.workers)
+    names = sorted({name for finished in results.values() for name in finished})
+    print(f"  {'':<16}" + "".join(f"{name:>11}" for name in names))
+    for mode, finished in results.items():
+        print(f"  {mode:<16}" + "".join(f"{finished.get(name, 0):>11.2f}" for name in names))
+
+
+if __name__ == "__main__":
+    main()
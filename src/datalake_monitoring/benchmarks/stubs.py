@@ -0,0 +1,247 @@
+"""Local stand-ins for the AWS services the monitoring Lambda talks to"""
+import os
+import time
+import uuid
+import zlib
+from typing import Dict, Iterable, Iterator, List, Optional
+
+
+class LocalParquetDataset:
+    """Stand-in for `wr.s3.to_parquet`: writes partitioned Parquet files under a local
+    directory and sleeps to simulate S3 PUT and Glue catalog round trips"""
+
+    def __init__(self, root: str, put_latency: float = 0.03, catalog_latency: float = 0.05):
+        self.root = root
+        self.put_latency = put_latency
+        self.catalog_latency = catalog_latency
+        self.files_written = 0
+        self.catalog_calls = 0
+
+    def to_parquet(
+        self,
+        df,
+        path: str,
+        dataset: bool = True,
+        table: Optional[str] = None,
+        database: Optional[str] = None,
+        partition_cols: Optional[List[str]] = None,
+        dtype: Optional[Dict[str, str]] = None,
+        compression: str = "snappy",
+        mode: str = "append",
+        **kwargs,
+    ) -> Dict:
+        """Same call shape as awswrangler; returns the written paths"""
+        table_dir = os.path.join(self.root, path.replace("s3://", ""))
+        partition_cols = partition_cols or []
+        groups = df.groupby(partition_cols) if partition_cols else [((), df)]
+        paths = []
+        for values, part_df in groups:
+            values = values if isinstance(values, tuple) else (values,)
+            part_dir = os.path.join(
+                table_dir, *[f"{col}={val}" for col, val in zip(partition_cols, values)]
+            )
+            os.makedirs(part_dir, exist_ok=True)
+            file_path = os.path.join(part_dir, f"{uuid.uuid4().hex}.snappy.parquet")
+            part_df.drop(columns=partition_cols).to_parquet(
+                file_path, compression=compression, index=False
+            )
+            time.sleep(self.put_latency)
+            self.files_written += 1
+            paths.append(file_path)
+        if table and database:
+            # get_table + create/update table + batch_create_partition
+            time.sleep(self.catalog_latency * 3)
+            self.catalog_calls += 3
+        return {"paths": paths}
+
+
+class LocalObjectStore:
+    """Stand-in for S3 PUTs of the writers in commons.writers: stores s3:// objects under a
+    local directory after `latency` seconds"""
+
+    def __init__(self, root: str, latency: float = 0.03):
+        self.root = root
+        self.latency = latency
+        self.files_written = 0
+        self.bytes_written = 0
+
+    def put(self, uri: str, data: bytes) -> None:
+        path = os.path.join(self.root, uri.replace("s3://", ""))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as file:
+            file.write(data)
+        time.sleep(self.latency)
+        self.files_written += 1
+        self.bytes_written += len(data)
+
+
+class WebhookStubServer:
+    """Local HTTP server standing in for a Slack webhook. Each POST is answered after
+    `delay` seconds with `status` (default 200); received JSON bodies are kept in `received`."""
+
+    def __init__(self, delay: float = 0.0, status: int = 200, headers: Optional[Dict] = None):
+        import json
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        stub = self
+        self.delay = delay
+        self.status = status
+        self.headers = headers or {}
+        self.received: List[Dict] = []
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                stub.received.append(json.loads(body or b"{}"))
+                time.sleep(stub.delay)
+                self.send_response(stub.status)
+                for name, value in stub.headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", "2")
+                self.end_headers()
+                self.wfile.write(b"ok")
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/webhook"
+
+    def __enter__(self) -> "WebhookStubServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class LocalGlueClient:
+    """Stand-in for the Glue client: answers GetTable with the monitor table as the monitoring
+    stack defines it, and the job and job run lookups with synthetic runs derived from the run
+    id, after `latency` seconds. GetJobRuns lists the runs of the events passed through
+    `track_runs`."""
+
+    def __init__(self, latency: float = 0.05):
+        self.latency = latency
+        self.calls = 0
+        self.job_runs: Dict[str, Dict[str, None]] = {}
+
+    def track_runs(self, batches: Iterable[Dict]) -> Iterator[Dict]:
+        """Yield `batches`, remembering the Glue job runs their events refer to"""
+        from commons.envelopes import unwrap_record
+
+        for event in batches:
+            for record in event["Records"]:
+                try:
+                    _, body = unwrap_record(record)
+                    detail = body["detail"]
+                    self.job_runs.setdefault(detail["jobName"], {})[detail["jobRunId"]] = None
+                except Exception:
+                    continue
+            yield event
+
+    @staticmethod
+    def job_run(job_name: str, run_id: str) -> Dict:
+        seed = zlib.crc32(run_id.encode())
+        workers = 2 + seed % 9
+        return {
+            "Id": run_id,
+            "JobName": job_name,
+            "Attempt": seed % 3,
+            "ExecutionTime": 30 + seed % 3600,
+            "WorkerType": "G.1X",
+            "NumberOfWorkers": workers,
+            "MaxCapacity": float(workers),
+            "GlueVersion": "4.0",
+        }
+
+    def get_job_run(self, JobName: str, RunId: str, **kwargs) -> Dict:
+        time.sleep(self.latency)
+        self.calls += 1
+        return {"JobRun": self.job_run(JobName, RunId)}
+
+    def get_job_runs(self, JobName: str, MaxResults: int = 200, **kwargs) -> Dict:
+        time.sleep(self.latency)
+        self.calls += 1
+        run_ids = list(self.job_runs.get(JobName, {}))[-MaxResults:]
+        return {"JobRuns": [self.job_run(JobName, run_id) for run_id in reversed(run_ids)]}
+
+    def batch_get_jobs(self, JobNames: List[str]) -> Dict:
+        time.sleep(self.latency)
+        self.calls += 1
+        return {
+            "Jobs": [
+                {
+                    "Name": name,
+                    "WorkerType": "G.1X",
+                    "NumberOfWorkers": 10,
+                    "MaxCapacity": 10.0,
+                    "GlueVersion": "4.0",
+                }
+                for name in JobNames
+            ],
+            "JobsNotFound": [],
+        }
+
+    def get_table(self, DatabaseName: str, Name: str) -> Dict:
+        import monitor_schema
+
+        time.sleep(self.latency)
+        self.calls += 1
+
+        def glue(columns):
+            return [{"Name": column["name"], "Type": column["type"]} for column in columns]
+
+        return {
+            "Table": {
+                "Name": Name,
+                "DatabaseName": DatabaseName,
+                "StorageDescriptor": {"Columns": glue(monitor_schema.glue_columns())},
+                "PartitionKeys": glue(monitor_schema.glue_partition_keys()),
+            }
+        }
+
+    def batch_create_partition(
+        self, DatabaseName: str, TableName: str, PartitionInputList: List[Dict]
+    ) -> Dict:
+        time.sleep(self.latency)
+        self.calls += 1
+        return {"Errors": []}
+
+
+class LocalSNSClient:
+    """Stand-in for the SNS client of the email sink: keeps published messages after `latency`
+    seconds"""
+
+    def __init__(self, latency: float = 0.02):
+        self.latency = latency
+        self.published: List[Dict] = []
+
+    def publish(self, TopicArn: str, Message: str, Subject: Optional[str] = None, **kwargs):
+        time.sleep(self.latency)
+        self.published.append({"TopicArn": TopicArn, "Subject": Subject, "Message": Message})
+        return {"MessageId": str(uuid.uuid4()), "ResponseMetadata": {"HTTPStatusCode": 200}}
+
+
+class LocalSecretStore:
+    """Stand-in for `get_secret`: returns `secret` after `latency` seconds"""
+
+    def __init__(self, secret: Dict, latency: float = 0.05):
+        self.secret = secret
+        self.latency = latency
+        self.calls = 0
+
+    def get_secret(self, secret_id: str, region_name: str = None, **kwargs) -> Dict:
+        time.sleep(self.latency)
+        self.calls += 1
+        return dict(self.secret)
@@ -0,0 +1,229 @@
+"""Memory, architecture and concurrency recommendations for the monitoring Lambda, from local
+replay measurements (`python local_exec.py --tune`).
+
+Each batch size is replayed in a fresh interpreter, which reports its CPU time, wall time and
+peak RSS. Lambda allocates CPU in proportion to memory, a full vCPU at 1,769 MB, so the CPU part
+of an invocation is stretched by 1769 / memory below that, while the time spent waiting on S3,
+Glue and Slack is not. The duration and cost of every memory size and architecture follow from
+that model:
+
+- memory: the cheapest size per record whose duration stays within the latency budget and
+  which holds the peak RSS plus the runtime overhead
+- architecture: arm64 is priced 20% below x86_64 per GB-second, but its CPU speed relative to
+  the measuring machine cannot be measured locally. It is only recommended when that factor has
+  been measured on arm64 and is given (`--arm64-cpu-factor`); otherwise its estimates assume
+  the same speed, are marked unmeasured and x86_64 is recommended
+- SQS batch size: the measured size with the lowest cost per record within the budget
+- reserved concurrency: invocations in flight at the peak event rate (Little's law) with
+  headroom, per event source (SNS delivers one record per invocation). For SQS it is at least
+  the 5 concurrent batches the event source mapping polls with, below which it is throttled
+- provisioned concurrency: the invocations in flight at the steady event rate, only when the
+  cold start exceeds its budget
+
+The recommendations are written to cdk/monitor_tuning.json, where cdk/config.py reads them.
+"""
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from benchmarks.import_time import import_profile
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TUNING_FILE = os.path.join(
+    os.path.dirname(os.path.dirname(HERE)), "cdk", "monitor_tuning.json"
+)
+
+FULL_VCPU_MB = 1769
+MEMORY_SIZES = (128, 256, 512, 768, 1024, 1536, 1769, 2048, 3008)
+ARCHITECTURES = ("x86_64", "arm64")
+# USD per GB-second and per request (us-east-1)
+GB_SECOND_PRICE = {"x86_64": 0.0000166667, "arm64": 0.0000133334}
+REQUEST_PRICE = 0.0000002
+# In-flight invocations at the peak rate are reserved with this much headroom
+CONCURRENCY_HEADROOM = 1.5
+# An SQS event source mapping starts with 5 concurrent pollers; less reserved concurrency than
+# that throttles its invocations and returns the messages to the queue
+SQS_MIN_RESERVED_CONCURRENCY = 5
+
+
+def measure(argv: List[str], batch_size: int, warmup: bool = True) -> Dict:
+    """Replay report of `local_exec.py` run in a fresh interpreter with `argv` and `batch_size`"""
+    command = [sys.executable, "local_exec.py", *argv, "--json", "--batch-size", str(batch_size)]
+    if not warmup:
+        command.append("--no-warmup")
+    result = subprocess.run(command, cwd=HERE, capture_output=True, text=True, check=True)
+    report = json.loads(result.stdout)
+    report["batch_size"] = batch_size
+    return report
+
+
+def cold_start_ms(argv: List[str], repeat: int = 3) -> float:
+    """Import time of the handler plus its first invocation, median of `repeat` runs"""
+    runs = []
+    for _ in range(repeat):
+        import_us, _modules = import_profile("import handler")
+        first = measure([*argv, "--batches", "1"], batch_size=1, warmup=False)
+        runs.append(import_us / 1000 + first["invocation_p50_ms"])
+    return sorted(runs)[len(runs) // 2]
+
+
+def estimate_seconds(
+    measurement: Dict, memory_size: int, cpu_factor: float = 1.0
+) -> Optional[float]:
+    """Mean invocation duration at `memory_size`, or None if the measurement has no invocations"""
+    invocations = measurement["invocations"]
+    if not invocations:
+        return None
+    cpu = measurement["cpu_seconds"] / invocations
+    wait = max(0.0, measurement["elapsed_seconds"] / invocations - cpu)
+    return cpu * cpu_factor * max(1.0, FULL_VCPU_MB / memory_size) + wait
+
+
+def cost_per_record(seconds: float, memory_size: int, architecture: str, batch_size: int) -> float:
+    gb_seconds = seconds * memory_size / 1024
+    return (gb_seconds * GB_SECOND_PRICE[architecture] + REQUEST_PRICE) / batch_size
+
+
+def in_flight(rate: float, batch_size: int, seconds: float) -> float:
+    """Concurrent invocations needed for `rate` records per second"""
+    return rate / batch_size * seconds
+
+
+def cpu_factor(architecture: str, arm64_cpu_factor: Optional[float]) -> float:
+    """CPU time on `architecture` relative to the measuring machine; arm64 is assumed as fast
+    when its factor has not been measured"""
+    if architecture == "arm64" and arm64_cpu_factor is not None:
+        return arm64_cpu_factor
+    return 1.0
+
+
+def estimates(
+    measurements: List[Dict],
+    memory_overhead_mb: float,
+    max_duration_seconds: float,
+    arm64_cpu_factor: Optional[float],
+) -> List[Dict]:
+    """Duration and cost of every architecture, memory size and measured batch size"""
+    rows = []
+    for measurement in measurements:
+        required_mb = measurement["peak_rss_mb"] + memory_overhead_mb
+        for architecture in ARCHITECTURES:
+            factor = cpu_factor(architecture, arm64_cpu_factor)
+            measured = architecture != "arm64" or arm64_cpu_factor is not None
+            for memory_size in MEMORY_SIZES:
+                seconds = estimate_seconds(measurement, memory_size, factor)
+                if seconds is None:
+                    continue
+                rows.append(
+                    {
+                        "architecture": architecture,
+                        "memory_size": memory_size,
+                        "batch_size": measurement["batch_size"],
+                        "duration_ms": round(seconds * 1000, 1),
+                        "usd_per_million_records": round(
+                            cost_per_record(
+                                seconds, memory_size, architecture, measurement["batch_size"]
+                            )
+                            * 1e6,
+                            4,
+                        ),
+                        "feasible": memory_size >= required_mb
+                        and seconds <= max_duration_seconds,
+                        "cpu_measured": measured,
+                    }
+                )
+    return rows
+
+
+def recommend(
+    measurements: List[Dict],
+    cold_start: float,
+    peak_rate: float,
+    steady_rate: float,
+    cold_start_budget_ms: float,
+    memory_overhead_mb: float = 96,
+    max_duration_seconds: float = 30,
+    arm64_cpu_factor: Optional[float] = None,
+) -> Dict:
+    """The tuning report: inputs, measurements, estimates and the recommended settings"""
+    rows = estimates(measurements, memory_overhead_mb, max_duration_seconds, arm64_cpu_factor)
+    feasible = [row for row in rows if row["feasible"] and row["cpu_measured"]]
+    if not feasible:
+        raise ValueError(
+            f"No memory size up to {MEMORY_SIZES[-1]} MB fits the peak RSS and runs a batch "
+            f"within {max_duration_seconds} s"
+        )
+    best = min(feasible, key=lambda row: (row["usd_per_million_records"], row["duration_ms"]))
+    by_batch = {measurement["batch_size"]: measurement for measurement in measurements}
+
+    def concurrency(batch_size: int, min_reserved: int) -> Dict[str, int]:
+        factor = cpu_factor(best["architecture"], arm64_cpu_factor)
+        seconds = estimate_seconds(by_batch[batch_size], best["memory_size"], factor)
+        reserved = math.ceil(in_flight(peak_rate, batch_size, seconds) * CONCURRENCY_HEADROOM)
+        provisioned = 0
+        if cold_start > cold_start_budget_ms:
+            provisioned = max(1, math.ceil(in_flight(steady_rate, batch_size, seconds)))
+        return {"reserved": max(min_reserved, reserved), "provisioned": provisioned}
+
+    # SNS invokes the function once per message; the smallest measured batch stands for it
+    sns = concurrency(min(by_batch), 1)
+    sqs = concurrency(best["batch_size"], SQS_MIN_RESERVED_CONCURRENCY)
+    return {
+        "generated_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "measured_on": {"machine": platform.machine(), "python": platform.python_version()},
+        "inputs": {
+            "peak_records_per_second": peak_rate,
+            "steady_records_per_second": steady_rate,
+            "cold_start_budget_ms": cold_start_budget_ms,
+            "memory_overhead_mb": memory_overhead_mb,
+            "max_duration_seconds": max_duration_seconds,
+            "arm64_cpu_factor": arm64_cpu_factor,
+        },
+        "recommended": {
+            "architecture": best["architecture"],
+            "memory_size": best["memory_size"],
+            "sqs_batch_size": best["batch_size"],
+            "reserved_concurrency": {"sns": sns["reserved"], "sqs": sqs["reserved"]},
+            "provisioned_concurrency": {"sns": sns["provisioned"], "sqs": sqs["provisioned"]},
+        },
+        "cold_start_ms": round(cold_start, 1),
+        "measurements": [
+            {
+                "batch_size": measurement["batch_size"],
+                "records": measurement["records"],
+                "cpu_ms_per_record": round(
+                    measurement["cpu_seconds"] / max(1, measurement["records"]) * 1000, 3
+                ),
+                "invocation_p99_ms": round(measurement["invocation_p99_ms"], 1),
+                "peak_rss_mb": round(measurement["peak_rss_mb"], 1),
+            }
+            for measurement in measurements
+        ],
+        "estimates": [row for row in rows if row["batch_size"] == best["batch_size"]],
+    }
+
+
+def print_tuning(report: Dict) -> None:
+    recommended = report["recommended"]
+    print(f"{'batch':>6}{'cpu ms/rec':>12}{'p99 ms':>10}{'peak RSS MB':>13}")
+    for row in report["measurements"]:
+        print(
+            f"{row['batch_size']:>6}{row['cpu_ms_per_record']:>12.3f}"
+            f"{row['invocation_p99_ms']:>10.1f}{row['peak_rss_mb']:>13.1f}"
+        )
+    print(f"\nestimates at batch size {recommended['sqs_batch_size']}:")
+    print(f"{'arch':>8}{'memory MB':>11}{'duration ms':>13}{'USD/M records':>15}")
+    for row in report["estimates"]:
+        print(
+            f"{row['architecture']:>8}{row['memory_size']:>11}{row['duration_ms']:>13.1f}"
+            f"{row['usd_per_million_records']:>15.4f}"
+            f"{'' if row['feasible'] else '  (excluded)'}"
+            f"{'' if row['cpu_measured'] else '  (CPU speed unmeasured, not recommended)'}"
+        )
+    print(f"\ncold start     : {report['cold_start_ms']:.0f} ms")
+    print(f"recommended    : {json.dumps(recommended)}")
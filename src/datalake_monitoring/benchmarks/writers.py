@@ -0,0 +1,188 @@
+"""Deployment size, cold import time and write cost of the monitor row writer backends.
+
+- size: installed size of the packages each backend needs beyond the Lambda runtime (which
+  provides boto3), following their requirements, and the awswrangler layer zip if downloaded
+- import: median import time of the backend's modules in a fresh interpreter
+- when awswrangler is not installed, its size and import time are those of pandas and pyarrow,
+  a lower bound
+- write: encoding cost per record and bytes per record, for batches of composed items; the
+  awswrangler backend is measured through the pandas to Parquet path it takes
+
+    python -m benchmarks.writers [--batch-size 100] [--repeat 5]
+"""
+import argparse
+import io
+import logging
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from importlib import metadata
+from typing import Dict, List, Optional, Set
+from unittest import mock
+
+import handler
+from benchmarks.events import sns_batch
+from commons.writers import BACKEND_AWSWRANGLER, BACKEND_NDJSON, BACKEND_PYARROW, make_writer
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Every backend also needs requests for the webhook sinks, which the Lambda runtime lacks
+PACKAGES = {
+    BACKEND_AWSWRANGLER: ("awswrangler", "requests"),
+    BACKEND_PYARROW: ("pyarrow", "requests"),
+    BACKEND_NDJSON: ("requests",),
+}
+IMPORTS = {
+    BACKEND_AWSWRANGLER: "import awswrangler, pandas",
+    BACKEND_PYARROW: "import pyarrow, pyarrow.parquet",
+    BACKEND_NDJSON: "import gzip, json",
+}
+# What awswrangler brings along at least, measured when it is not installed
+WRANGLER_LOWER_BOUND = (
+    ("pandas", "pyarrow", "requests"), "import pandas, pyarrow, pyarrow.parquet"
+)
+# Provided by the Lambda Python runtime
+RUNTIME_PACKAGES = {
+    "boto3", "botocore", "s3transfer", "jmespath", "urllib3", "python-dateutil", "six"
+}
+
+
+def _normalize(name: str) -> str:
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def closure(packages, seen: Optional[Set[str]] = None) -> Optional[Set[str]]:
+    """Installed distributions `packages` need, runtime packages excluded; None if one of
+    `packages` is not installed"""
+    seen = set() if seen is None else seen
+    for package in packages:
+        name = _normalize(package)
+        if name in seen or name in RUNTIME_PACKAGES:
+            continue
+        try:
+            requires = metadata.requires(name) or []
+        except metadata.PackageNotFoundError:
+            return None
+        seen.add(name)
+        required = [
+            re.split(r"[ ;<>=!~\[(]", requirement, maxsplit=1)[0]
+            for requirement in requires
+            if "extra ==" not in requirement
+        ]
+        # Requirements that are not installed are optional at runtime (e.g. platform markers)
+        closure([package for package in required if _installed(package)], seen)
+    return seen
+
+
+def _installed(package: str) -> bool:
+    try:
+        metadata.distribution(package)
+    except metadata.PackageNotFoundError:
+        return False
+    return True
+
+
+def installed_mb(distributions: Set[str]) -> float:
+    total = 0
+    for name in distributions:
+        for file in metadata.distribution(name).files or []:
+            path = file.locate()
+            if os.path.isfile(path):
+                total += os.path.getsize(path)
+    return total / (1024 * 1024)
+
+
+def import_ms(statement: str) -> float:
+    """Time `statement` takes in a fresh interpreter, start-up excluded"""
+    timed = (
+        f"import time; start = time.perf_counter(); {statement}; "
+        "print(time.perf_counter() - start)"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", timed], cwd=HERE, capture_output=True, text=True, check=True
+    )
+    return float(result.stdout) * 1000
+
+
+def composed_items(batch_size: int) -> List[Dict]:
+    """Items as the handler composes them from a mixed batch"""
+    event = sns_batch(batch_size)
+    with mock.patch.object(handler.ProcessEvent, "notify", lambda self, item: None):
+        process = handler.ProcessEvent(event, {}, handler.cf, logging.getLogger())
+        for index, record in enumerate(event["Records"]):
+            process.process_record(record, str(index))
+    return process.items
+
+
+def wrangler_encode(items: List[Dict]) -> int:
+    """Bytes of the pandas to Parquet encoding awswrangler performs, one file per partition"""
+    import pandas as pd
+
+    written = 0
+    for _, partition in pd.DataFrame.from_records(items).groupby("service_type"):
+        buffer = io.BytesIO()
+        partition.drop(columns=["service_type"]).to_parquet(
+            buffer, compression="snappy", index=False
+        )
+        written += buffer.tell()
+    return written
+
+
+def write_cost(backend: str, items: List[Dict], repeat: int) -> Dict[str, float]:
+    """Microseconds and bytes per record of encoding `items`, best of `repeat`"""
+    types = handler.schema.column_types(dict.fromkeys(key for item in items for key in item))
+    if backend == BACKEND_AWSWRANGLER:
+        def write():
+            return wrangler_encode(items)
+    else:
+        writer = make_writer(backend, "s3://bucket/monitor/monitor", put=lambda uri, data: None)
+
+        def write():
+            return writer.write(items, types, datetime.now(timezone.utc)).bytes_written
+
+    best = float("inf")
+    written = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        written = write()
+        best = min(best, time.perf_counter() - start)
+    return {"us_per_record": best / len(items) * 1e6, "bytes_per_record": written / len(items)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    items = composed_items(args.batch_size)
+    print(f"{'backend':<13}{'size MB':>9}{'import ms':>11}{'us/record':>11}{'bytes/record':>14}")
+    for backend in (BACKEND_AWSWRANGLER, BACKEND_PYARROW, BACKEND_NDJSON):
+        packages, statement, bound = PACKAGES[backend], IMPORTS[backend], ""
+        distributions = closure(packages)
+        if distributions is None and backend == BACKEND_AWSWRANGLER:
+            (packages, statement), bound = WRANGLER_LOWER_BOUND, ">="
+            distributions = closure(packages)
+        size = f"{bound}{installed_mb(distributions):.1f}"
+        median_ms = statistics.median(import_ms(statement) for _ in range(args.repeat))
+        imports = f"{bound}{median_ms:.1f}"
+        cost = write_cost(backend, items, args.repeat)
+        print(
+            f"{backend:<13}{size:>9}{imports:>11}"
+            f"{cost['us_per_record']:>11.1f}{cost['bytes_per_record']:>14.1f}"
+        )
+
+    layer = os.path.join(HERE, "libs", "awswrangler-layer-3.2.0-py3.10.zip")
+    if os.path.exists(layer):
+        print(f"\nawswrangler layer zip: {os.path.getsize(layer) / (1024 * 1024):.1f} MB")
+    if closure(PACKAGES[BACKEND_AWSWRANGLER]) is None:
+        print("\nawswrangler is not installed: its size and import time are lower bounds")
+
+
+if __name__ == "__main__":
+    main()
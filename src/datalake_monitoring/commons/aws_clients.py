@@ -0,0 +1,31 @@
+"""Boto3 session and clients created once per Lambda container and reused across invocations"""
+import os
+from functools import lru_cache
+from typing import Optional
+
+from commons.lazy_import import lazy_import
+
+boto3 = lazy_import("boto3")
+botocore_config = lazy_import("botocore.config")
+
+
+@lru_cache(maxsize=None)
+def get_session():
+    """Container wide boto3 session, honouring AWS_PROFILE for local runs"""
+    return boto3.session.Session(profile_name=os.getenv("AWS_PROFILE"))
+
+
+@lru_cache(maxsize=None)
+def get_client(
+    service_name: str, region_name: Optional[str] = None, timeout_seconds: Optional[float] = None
+):
+    """Cached boto3 client for `service_name` in `region_name`; with `timeout_seconds`, its
+    connections and reads time out after that long and failed calls are not retried"""
+    config = None
+    if timeout_seconds is not None:
+        config = botocore_config.Config(
+            connect_timeout=timeout_seconds,
+            read_timeout=timeout_seconds,
+            retries={"total_max_attempts": 1},
+        )
+    return get_session().client(service_name=service_name, region_name=region_name, config=config)
@@ -4,6 +4,7 @@ SUCCESS_ITEM = dict(
     service_name=['detail', 'jobName'],
     event_type='',
     timestamp=['time'],
+    service_run_id=['detail', 'jobRunId'],
 )
 
 FAILURE_ITEM = dict(
@@ -12,5 +13,6 @@ FAILURE_ITEM = dict(
     service_name=['detail', 'jobName'],
     event_type='',
     timestamp=['time'],
+    service_run_id=['detail', 'jobRunId'],
     request_payload={},
 )
@@ -13,4 +13,6 @@ FAILURE_ITEM = dict(
     event_type='',
     timestamp=['timestamp'],
     retry_attempts=['requestContext', 'approximateInvokeCount'],
+    request_payload={},
+    stack_trace={},
 )
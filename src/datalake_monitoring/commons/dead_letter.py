@@ -0,0 +1,117 @@
+"""Dead-letter capture of monitoring records that can never be processed: they are written in
+bulk, once per invocation, to a local JSONL file or to an S3 object, instead of being retried"""
+import gzip
+import json
+import os
+import traceback
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Iterable, Iterator, List, NamedTuple, Optional
+
+from commons.aws_clients import get_client
+from commons.event_registry import PermanentEventError
+
+# Errors of reading a malformed message: not JSON, or missing or mistyped fields
+MALFORMED_MESSAGE_ERRORS = (ValueError, KeyError, IndexError, TypeError, AttributeError)
+
+
+@contextmanager
+def reading_message(stage: str) -> Iterator[None]:
+    """Raise the errors of reading a malformed message in the block as PermanentEventError.
+    Only wrap code that reads the message (decode, classify, extract), so that a bug or an
+    outage elsewhere is still retried"""
+    try:
+        yield
+    except PermanentEventError:
+        raise
+    except MALFORMED_MESSAGE_ERRORS as exc:
+        raise PermanentEventError(f"{stage}: {type(exc).__name__}: {exc}") from exc
+
+
+def is_permanent_error(exc: BaseException) -> bool:
+    """True when the record that raised `exc` should be dead-lettered rather than retried"""
+    return isinstance(exc, PermanentEventError)
+
+
+class DeadLetter(NamedTuple):
+    record_id: str
+    error: str
+    traceback: str
+    record: dict
+    failed_at: str
+
+    @classmethod
+    def from_exception(cls, record_id: str, record: dict, exc: BaseException) -> "DeadLetter":
+        return cls(
+            record_id=record_id,
+            error=f"{type(exc).__name__}: {exc}",
+            traceback="".join(traceback.format_exception(type(exc), exc, exc.__traceback__)),
+            record=record,
+            failed_at=f"{datetime.utcnow().isoformat()}Z",
+        )
+
+
+def to_jsonl(letters: Iterable[DeadLetter]) -> bytes:
+    return "".join(json.dumps(letter._asdict(), default=str) + "\n" for letter in letters).encode()
+
+
+class LocalFileSink:
+    """Appends dead letters to a JSONL file"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def write(self, letters: List[DeadLetter]) -> Optional[str]:
+        if not letters:
+            return None
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, "ab") as handle:
+            handle.write(to_jsonl(letters))
+        return self.path
+
+
+class S3Sink:
+    """Writes the dead letters of an invocation as one gzipped JSONL object under
+    `<prefix>/<yyyymmdd>/`"""
+
+    def __init__(self, bucket: str, prefix: str = "", region_name: Optional[str] = None):
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.region_name = region_name
+
+    def write(self, letters: List[DeadLetter]) -> Optional[str]:
+        if not letters:
+            return None
+        now = datetime.now(timezone.utc)
+        key = "/".join(
+            part
+            for part in (
+                self.prefix,
+                now.strftime("%Y%m%d"),
+                f"{now.strftime('%H%M%S')}-{uuid.uuid4().hex}.jsonl.gz",
+            )
+            if part
+        )
+        get_client("s3", self.region_name).put_object(
+            Bucket=self.bucket,
+            Key=key,
+            Body=gzip.compress(to_jsonl(letters)),
+            ContentType="application/x-ndjson",
+            ContentEncoding="gzip",
+        )
+        return f"s3://{self.bucket}/{key}"
+
+
+def dead_letter_sink(uri: str, region_name: Optional[str] = None):
+    """Sink for `uri`: `s3://bucket/prefix` or a local file path; None when `uri` is empty"""
+    if not uri:
+        return None
+    if uri.startswith("s3://"):
+        bucket, _, prefix = uri[len("s3://"):].partition("/")
+        return S3Sink(bucket, prefix, region_name=region_name)
+    if uri.startswith("file://"):
+        uri = uri[len("file://"):]
+    return LocalFileSink(uri)
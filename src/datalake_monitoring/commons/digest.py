@@ -0,0 +1,113 @@
+"""Coalesce failure notifications into digest messages so failure storms do not flood Slack"""
+import time
+from typing import Callable, Dict, List, Tuple
+
+from commons.fingerprint import error_fingerprint
+
+DigestKey = Tuple[str, str, str]
+
+
+class _Group:
+    __slots__ = ("first", "count", "first_time_stamp", "last_time_stamp")
+
+    def __init__(self, message: dict):
+        self.first = message
+        self.count = 0
+        self.first_time_stamp = message["time_stamp"]
+        self.last_time_stamp = message["time_stamp"]
+
+    def add(self, message: dict) -> None:
+        self.count += 1
+        time_stamp = message["time_stamp"]
+        # Rows whose timestamp could not be parsed have none
+        if time_stamp is None:
+            return
+        if self.first_time_stamp is None or time_stamp < self.first_time_stamp:
+            self.first_time_stamp = time_stamp
+        if self.last_time_stamp is None or time_stamp > self.last_time_stamp:
+            self.last_time_stamp = time_stamp
+
+
+class DigestCoalescer:
+    """
+    Groups Slack messages (as built by ProcessEvent.compose_message) by service, service_name
+    and the fingerprint of exception_details; `flush` returns one message per group.
+
+    With `window_seconds` > 0 the coalescer lives across invocations: once a digest for a
+    group has been sent, further failures of that group are held and rolled into the next
+    digest, sent by the first flush after the window has elapsed. Held failures only live in
+    the container: `held` counts them, and `drain` returns their digests regardless of the
+    window, for when the container shuts down.
+    """
+
+    def __init__(
+        self,
+        window_seconds: float = 0,
+        key: Callable[[str], str] = error_fingerprint,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.window_seconds = window_seconds
+        self.key = key
+        self.clock = clock
+        self._pending: Dict[DigestKey, _Group] = {}
+        self._last_sent: Dict[DigestKey, float] = {}
+
+    def digest_key(self, message: dict) -> DigestKey:
+        return (
+            message["service"],
+            message["service_name"],
+            self.key(message["exception_details"]),
+        )
+
+    def add(self, message: dict) -> None:
+        key = self.digest_key(message)
+        group = self._pending.get(key)
+        if group is None:
+            group = self._pending[key] = _Group(message)
+        group.add(message)
+
+    def flush(self) -> List[dict]:
+        """Digest messages for every group that is due"""
+        now = self.clock()
+        messages = []
+        for key, group in list(self._pending.items()):
+            sent_at = self._last_sent.get(key)
+            if sent_at is not None and now - sent_at < self.window_seconds:
+                continue
+            messages.append(self.render(group))
+            del self._pending[key]
+            if self.window_seconds > 0:
+                self._last_sent[key] = now
+        for key, sent_at in list(self._last_sent.items()):
+            if now - sent_at >= self.window_seconds and key not in self._pending:
+                del self._last_sent[key]
+        return messages
+
+    def held(self) -> int:
+        """Number of failures held back for a later digest"""
+        return sum(group.count for group in self._pending.values())
+
+    def drain(self) -> List[Tuple[dict, int]]:
+        """Digest messages of every pending group, due or not, with their failure counts"""
+        groups = list(self._pending.values())
+        self._pending.clear()
+        return [(self.render(group), group.count) for group in groups]
+
+    @staticmethod
+    def render(group: _Group) -> dict:
+        """Single failures are sent as is; repeats keep the message fields, with counts and
+        the first/last timestamps rolled into them"""
+        if group.count == 1:
+            return group.first
+        message = dict(group.first)
+        message["service_id"] = f"{group.first['service_id']} (+{group.count - 1} more)"
+        message["time_stamp"] = group.first_time_stamp
+        between = (
+            f" between {group.first_time_stamp} and {group.last_time_stamp}"
+            if group.first_time_stamp is not None
+            else ""
+        )
+        message["exception_details"] = (
+            f"{group.count} failures{between}: {group.first['exception_details']}"
+        )
+        return message
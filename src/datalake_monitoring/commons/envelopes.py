@@ -0,0 +1,34 @@
+"""Unwrap the monitoring messages from the Lambda event envelopes: SNS records, and SQS
+records from a queue subscribed to the topic with or without raw message delivery"""
+from collections.abc import Mapping
+from typing import Tuple
+
+from commons.json_codec import lazy_loads
+
+SQS_EVENT_SOURCE = "aws:sqs"
+
+
+def is_sqs_event(event: dict) -> bool:
+    """True for an SQS batch, which supports partial batch responses"""
+    records = event.get("Records") or [{}]
+    return records[0].get("eventSource") == SQS_EVENT_SOURCE
+
+
+def record_id(record: dict, index: int) -> str:
+    """Identifier of the record at `index` of its batch: the SQS messageId (the itemIdentifier
+    of partial batch responses), the SNS MessageId, or the index for records without one"""
+    if record.get("eventSource") == SQS_EVENT_SOURCE:
+        return record["messageId"]
+    return (record.get("Sns") or {}).get("MessageId") or str(index)
+
+
+def unwrap_record(record: dict) -> Tuple[str, dict]:
+    """(record id, decoded monitoring message) of an SNS or SQS record; the message is decoded
+    lazily when the JSON backend supports it"""
+    if record.get("eventSource") == SQS_EVENT_SOURCE:
+        body = lazy_loads(record["body"])
+        # Without raw message delivery the SQS body is the SNS notification
+        if isinstance(body, Mapping) and body.get("Type") == "Notification" and "Message" in body:
+            body = lazy_loads(body["Message"])
+        return record["messageId"], body
+    return record["Sns"].get("MessageId", ""), lazy_loads(record["Sns"]["Message"])
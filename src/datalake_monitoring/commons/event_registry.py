@@ -0,0 +1,186 @@
+"""Registry classifying SNS messages into (service_type, event_type) and the item template
+used to compose them. Built once at import; classification is a dictionary lookup."""
+from typing import Any, Callable, Dict, Iterable, NamedTuple, Optional, Tuple
+
+from commons.ddb_lambda_item import SUCCESS_ITEM as LAMBDA_SUCCESS_TEMPLATE
+from commons.ddb_lambda_item import FAILURE_ITEM as LAMBDA_FAILURE_TEMPLATE
+
+from commons.ddb_glue_job_item import SUCCESS_ITEM as GLUE_JOB_SUCCESS_TEMPLATE
+from commons.ddb_glue_job_item import FAILURE_ITEM as GLUE_JOB_FAILURE_TEMPLATE
+
+from commons.ddb_glue_crawler_item import SUCCESS_ITEM as GLUE_CRAWLER_SUCCESS_TEMPLATE
+from commons.ddb_glue_crawler_item import FAILURE_ITEM as GLUE_CRAWLER_FAILURE_TEMPLATE
+
+from commons.item_compiler import Extractor, get_compiled_template
+from commons.utils import get_lambda_name_from_arn
+
+EVENT_TYPE_SUCCESS = "succeeded"
+EVENT_TYPE_FAIL = "failed"
+# A run started; correlated with its completion rather than written as a monitor row
+EVENT_TYPE_STARTED = "started"
+
+# Lambda destination records carry neither `source` nor `detail-type`
+LAMBDA_DESTINATION_SOURCE = "lambda.destination"
+LAMBDA_DESTINATION_DETAIL_TYPE = "Lambda Destination Record"
+
+StateReader = Callable[[dict], str]
+
+
+class PermanentEventError(Exception):
+    """Raised for messages that can never be processed: they cannot be decoded, classified or
+    lack the fields their template reads. Retrying them cannot help"""
+
+
+class InvalidEventError(PermanentEventError):
+    """Raised for messages no registered service can classify"""
+
+
+class EventClass(NamedTuple):
+    service_type: str
+    event_type: str
+    template: dict
+    extract: Extractor
+
+
+class _ServiceEntry(NamedTuple):
+    service_type: str
+    read_state: StateReader
+    success_states: frozenset
+    start_states: frozenset
+    failure_event_type: Optional[str]
+    success_template: dict
+    failure_template: dict
+    transforms: Dict[str, Callable[[Any], Any]]
+
+
+_SERVICES: Dict[Tuple[str, str], _ServiceEntry] = {}
+_CLASSES: Dict[Tuple[str, str, str], EventClass] = {}
+# States first seen in messages are cached up to this many classes in all, so a stream of
+# distinct states cannot grow the registry without bound; further ones are classified uncached
+MAX_CLASSES = 1024
+
+
+def register_event_source(
+    source: str,
+    detail_type: str,
+    service_type: str,
+    success_template: dict,
+    failure_template: dict,
+    success_states: Iterable[str],
+    known_states: Iterable[str] = (),
+    start_states: Iterable[str] = (),
+    read_state: StateReader = lambda body: body["detail"]["state"],
+    failure_event_type: Optional[str] = None,
+    transforms: Optional[Dict[str, Callable[[Any], Any]]] = None,
+) -> None:
+    """
+    Register a service publishing messages with `source` and `detail-type`.
+    States in `success_states` (case-insensitive) map to the success template, any other state
+    to the failure template with `failure_event_type`, or the lower-cased state, as event_type.
+    States in `start_states` mark the start of a run: success template, EVENT_TYPE_STARTED.
+    `known_states` are precompiled; other states are classified on first sight and cached, up
+    to MAX_CLASSES. Registering a source again replaces its templates and cached classes.
+    `transforms` post-process extracted template fields, e.g. ARN to function name.
+    """
+    success_states = tuple(success_states)
+    start_states = tuple(start_states)
+    entry = _ServiceEntry(
+        service_type=service_type,
+        read_state=read_state,
+        success_states=frozenset(state.lower() for state in success_states),
+        start_states=frozenset(state.lower() for state in start_states),
+        failure_event_type=failure_event_type,
+        success_template=success_template,
+        failure_template=failure_template,
+        transforms=transforms or {},
+    )
+    _SERVICES[(source, detail_type)] = entry
+    for key in [key for key in _CLASSES if key[:2] == (source, detail_type)]:
+        del _CLASSES[key]
+    for state in (*success_states, *known_states, *start_states):
+        _CLASSES[(source, detail_type, state)] = _compile(entry, state)
+
+
+def _compile(entry: _ServiceEntry, state: str) -> EventClass:
+    if state.lower() in entry.success_states:
+        template, event_type = entry.success_template, EVENT_TYPE_SUCCESS
+    elif state.lower() in entry.start_states:
+        template, event_type = entry.success_template, EVENT_TYPE_STARTED
+    else:
+        template = entry.failure_template
+        event_type = entry.failure_event_type or state.lower()
+    extract = get_compiled_template(template, entry.transforms)
+    return EventClass(entry.service_type, event_type, template, extract)
+
+
+def event_key(body: dict) -> Tuple[str, str, str]:
+    """(source, detail-type, state) of an SNS message"""
+    detail_type = body.get("detail-type")
+    if detail_type is None:
+        if "requestContext" not in body:
+            raise InvalidEventError(f"Invalid SNS Event message : {body}")
+        source, detail_type = LAMBDA_DESTINATION_SOURCE, LAMBDA_DESTINATION_DETAIL_TYPE
+    else:
+        source = body.get("source", "")
+    entry = _SERVICES.get((source, detail_type))
+    if entry is None:
+        raise InvalidEventError(f"Invalid SNS Event message : {body}")
+    try:
+        return source, detail_type, entry.read_state(body)
+    except (KeyError, TypeError, AttributeError) as exc:
+        raise InvalidEventError(f"Invalid SNS Event message : {body}") from exc
+
+
+def classify_event(body: dict) -> EventClass:
+    """Return the EventClass for an SNS message"""
+    key = event_key(body)
+    event_class = _CLASSES.get(key)
+    if event_class is None:
+        event_class = _compile(_SERVICES[key[:2]], key[2])
+        if len(_CLASSES) < MAX_CLASSES:
+            _CLASSES[key] = event_class
+    return event_class
+
+
+def registered_service(source: str, detail_type: str) -> Optional[str]:
+    """service_type registered for (source, detail-type), if any"""
+    entry = _SERVICES.get((source, detail_type))
+    return entry.service_type if entry else None
+
+
+# Built-in services
+
+register_event_source(
+    source=LAMBDA_DESTINATION_SOURCE,
+    detail_type=LAMBDA_DESTINATION_DETAIL_TYPE,
+    service_type="lambda",
+    success_template=LAMBDA_SUCCESS_TEMPLATE,
+    failure_template=LAMBDA_FAILURE_TEMPLATE,
+    success_states=("Success",),
+    known_states=("RetriesExhausted", "EventAgeExceeded"),
+    read_state=lambda body: body["requestContext"]["condition"],
+    failure_event_type=EVENT_TYPE_FAIL,
+    transforms={"service_name": get_lambda_name_from_arn},
+)
+
+register_event_source(
+    source="aws.glue",
+    detail_type="Glue Job State Change",
+    service_type="glue_job",
+    success_template=GLUE_JOB_SUCCESS_TEMPLATE,
+    failure_template=GLUE_JOB_FAILURE_TEMPLATE,
+    success_states=("SUCCEEDED",),
+    known_states=("FAILED", "TIMEOUT", "STOPPED"),
+    start_states=("RUNNING",),
+)
+
+register_event_source(
+    source="aws.glue",
+    detail_type="Glue Crawler State Change",
+    service_type="glue_crawler",
+    success_template=GLUE_CRAWLER_SUCCESS_TEMPLATE,
+    failure_template=GLUE_CRAWLER_FAILURE_TEMPLATE,
+    success_states=("Succeeded",),
+    known_states=("Failed",),
+    start_states=("Started",),
+)
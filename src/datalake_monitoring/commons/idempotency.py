@@ -0,0 +1,279 @@
+"""Idempotent writes of monitor rows. SNS and asynchronous Lambda delivery are at-least-once, so
+a monitoring event can arrive more than once; a row is written only for the first delivery of
+each (service_request_id, event_type).
+
+- fast path: LRU of the keys this container has already written
+- durable path: a key store shared by all containers (DynamoDB), in which a write first claims
+  its keys with a lease and commits them once the rows are persisted; a lease left behind by a
+  crashed invocation expires, so its records are written on retry
+
+A key leased by another invocation is in flight, not a duplicate: that invocation may still
+fail, so its records are retried rather than dropped.
+"""
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from commons.aws_clients import get_client
+
+STATE_PENDING = "pending"
+STATE_COMMITTED = "committed"
+
+
+class Claim(NamedTuple):
+    # Keys claimed by this invocation
+    claimed: Set[str]
+    # Keys leased by another invocation that has not committed them yet
+    in_flight: Set[str]
+
+
+class Admission(NamedTuple):
+    # Indexes of the items to write
+    keep: List[int]
+    # Keys claimed for them
+    keys: List[str]
+    # Indexes of the items whose key is in flight in another invocation, to retry
+    in_flight: List[int]
+
+
+def make_key(request_id: Optional[str], event_type: Optional[str]) -> Optional[str]:
+    """Key of a (service_request_id, event_type) pair; None without a request id to dedup on"""
+    if not request_id:
+        return None
+    return f"{request_id}:{event_type or ''}"
+
+
+def idempotency_key(item: dict) -> Optional[str]:
+    """Key of a monitor row"""
+    return make_key(item.get("service_request_id"), item.get("event_type"))
+
+
+class RecentKeys:
+    """LRU of the keys written by this container"""
+
+    def __init__(self, max_entries: int = 16384):
+        self.max_entries = max_entries
+        self.hits = 0
+        self._keys: "OrderedDict[str, None]" = OrderedDict()
+
+    def __contains__(self, key: str) -> bool:
+        if key in self._keys:
+            self._keys.move_to_end(key)
+            self.hits += 1
+            return True
+        return False
+
+    def add(self, keys: Iterable[str]) -> None:
+        for key in keys:
+            self._keys[key] = None
+            self._keys.move_to_end(key)
+        while len(self._keys) > self.max_entries:
+            self._keys.popitem(last=False)
+
+    def discard(self, keys: Iterable[str]) -> None:
+        for key in keys:
+            self._keys.pop(key, None)
+
+
+class InMemoryIdempotencyStore:
+    """Local stand-in for DynamoDBIdempotencyStore with the same claim/commit/release
+    semantics, for tests, benchmarks and local runs"""
+
+    def __init__(
+        self,
+        lease_seconds: float = 900,
+        ttl_seconds: float = 7 * 24 * 3600,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.lease_seconds = lease_seconds
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self._lock = threading.Lock()
+        # key -> (state, expires_at)
+        self._entries: Dict[str, Tuple[str, float]] = {}
+
+    def claim(self, keys: Iterable[str]) -> Claim:
+        """Claim the keys that are not committed nor leased by another invocation"""
+        now = self.clock()
+        claim = Claim(set(), set())
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None or entry[1] <= now:
+                    self._entries[key] = (STATE_PENDING, now + self.lease_seconds)
+                    claim.claimed.add(key)
+                elif entry[0] == STATE_PENDING:
+                    claim.in_flight.add(key)
+        return claim
+
+    def commit(self, keys: Iterable[str]) -> None:
+        expires_at = self.clock() + self.ttl_seconds
+        with self._lock:
+            for key in keys:
+                self._entries[key] = (STATE_COMMITTED, expires_at)
+
+    def release(self, keys: Iterable[str]) -> None:
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+
+class DynamoDBIdempotencyStore:
+    """
+    Keys in a DynamoDB table with partition key `idempotency_key` and TTL attribute
+    `expires_at`.
+
+    A claim is a conditional PutItem that succeeds if the key is absent or its lease or
+    retention has expired, returning the entry that holds the key otherwise. The claims of a
+    batch are made concurrently from a pool of `max_workers` threads (at most the 10 pooled
+    connections of the default client config); commits and releases go through
+    BatchWriteItem, 25 keys per call.
+    """
+
+    def __init__(
+        self,
+        table_name: str,
+        lease_seconds: float = 900,
+        ttl_seconds: float = 7 * 24 * 3600,
+        region_name: Optional[str] = None,
+        clock: Callable[[], float] = time.time,
+        max_workers: int = 10,
+    ):
+        self.table_name = table_name
+        self.lease_seconds = lease_seconds
+        self.ttl_seconds = ttl_seconds
+        self.region_name = region_name
+        self.clock = clock
+        self.max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def client(self):
+        return get_client("dynamodb", self.region_name)
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="idempotency"
+            )
+        return self._executor
+
+    def claim(self, keys: Iterable[str]) -> Claim:
+        now = int(self.clock())
+        futures = {key: self.executor.submit(self._claim_key, key, now) for key in keys}
+        claim = Claim(set(), set())
+        error = None
+        for key, future in futures.items():
+            try:
+                state = future.result()
+            except Exception as exc:
+                error = error or exc
+                continue
+            if state is None:
+                claim.claimed.add(key)
+            elif state == STATE_PENDING:
+                claim.in_flight.add(key)
+        if error is not None:
+            # Leases left behind would make the retry treat these records as in flight
+            self.release(claim.claimed)
+            raise error
+        return claim
+
+    def _claim_key(self, key: str, now: int) -> Optional[str]:
+        """None if `key` was claimed, else the state of the entry holding it"""
+        client = self.client
+        try:
+            client.put_item(
+                TableName=self.table_name,
+                Item={
+                    "idempotency_key": {"S": key},
+                    "state": {"S": STATE_PENDING},
+                    "expires_at": {"N": str(now + int(self.lease_seconds))},
+                },
+                ConditionExpression="attribute_not_exists(idempotency_key) OR expires_at <= :now",
+                ExpressionAttributeValues={":now": {"N": str(now)}},
+                ReturnValuesOnConditionCheckFailure="ALL_OLD",
+            )
+        except client.exceptions.ConditionalCheckFailedException as exc:
+            return exc.response.get("Item", {}).get("state", {}).get("S", STATE_COMMITTED)
+        return None
+
+    def commit(self, keys: Iterable[str]) -> None:
+        expires_at = str(int(self.clock() + self.ttl_seconds))
+        self._batch_write(
+            {
+                "PutRequest": {
+                    "Item": {
+                        "idempotency_key": {"S": key},
+                        "state": {"S": STATE_COMMITTED},
+                        "expires_at": {"N": expires_at},
+                    }
+                }
+            }
+            for key in keys
+        )
+
+    def release(self, keys: Iterable[str]) -> None:
+        self._batch_write(
+            {"DeleteRequest": {"Key": {"idempotency_key": {"S": key}}}} for key in keys
+        )
+
+    def _batch_write(self, requests: Iterable[dict]) -> None:
+        requests = list(requests)
+        client = self.client
+        for offset in range(0, len(requests), 25):
+            pending = {self.table_name: requests[offset:offset + 25]}
+            for attempt in range(5):
+                unprocessed = client.batch_write_item(RequestItems=pending).get(
+                    "UnprocessedItems"
+                )
+                if not unprocessed:
+                    break
+                pending = unprocessed
+                time.sleep(min(0.05 * 2 ** attempt, 1))
+
+
+class IdempotencyGuard:
+    """Filters the rows of a batch down to the first delivery of each key.
+
+    `admit(items)` picks the rows to write and claims their keys, which must then be
+    `commit`ted after a successful write or `release`d after a failed one. Rows whose key
+    another invocation is writing are neither written nor dropped, but left for a retry.
+    """
+
+    def __init__(self, store=None, max_entries: int = 16384):
+        self.store = store
+        self.recent = RecentKeys(max_entries)
+        self.duplicates = 0
+
+    def admit(self, items: List[dict]) -> Admission:
+        candidates: "OrderedDict[str, int]" = OrderedDict()
+        keep = []
+        for index, item in enumerate(items):
+            key = idempotency_key(item)
+            if key is None:
+                keep.append(index)
+            elif key not in candidates and key not in self.recent:
+                candidates[key] = index
+        if self.store is None:
+            claim = Claim(set(candidates), set())
+        else:
+            claim = self.store.claim(candidates)
+        keep.extend(index for key, index in candidates.items() if key in claim.claimed)
+        keep.sort()
+        in_flight = [index for key, index in candidates.items() if key in claim.in_flight]
+        self.duplicates += len(items) - len(keep) - len(in_flight)
+        return Admission(keep, [key for key in candidates if key in claim.claimed], in_flight)
+
+    def commit(self, keys: List[str]) -> None:
+        if self.store is not None and keys:
+            self.store.commit(keys)
+        self.recent.add(keys)
+
+    def release(self, keys: List[str]) -> None:
+        if self.store is not None and keys:
+            self.store.release(keys)
+        self.recent.discard(keys)
@@ -0,0 +1,63 @@
+"""Compile ddb_*_item templates into flat extractor functions.
+
+A template maps item keys to a path into the SNS message body, e.g.
+`service_name=['detail', 'jobName']`; keys with an empty path are filled elsewhere. Each
+template is turned once into generated code along the lines of
+
+    def extract(body, item):
+        try:
+            item['service_name'] = body['detail']['jobName']
+        except (KeyError, IndexError, TypeError):
+            item['service_name'] = None
+
+so composing an item does no per-key path walking and allocates nothing besides the item.
+"""
+from typing import Any, Callable, Dict, Optional, Tuple
+
+Extractor = Callable[[dict, dict], None]
+
+# Extractors by the identity of their template and transforms, which are kept alongside so
+# their ids cannot be reused. A service registered again with another template gets a new
+# extractor; templates are not modified once registered.
+_COMPILED: Dict[Tuple[int, int], Tuple[dict, Any, Extractor]] = {}
+
+
+def compile_template(
+    template: dict,
+    transforms: Optional[Dict[str, Callable[[Any], Any]]] = None,
+    default: Any = None,
+) -> Extractor:
+    """Generate the extractor for `template`; a missing path yields `default`.
+    `transforms` are applied to the extracted value of the given keys."""
+    transforms = transforms or {}
+    namespace: Dict[str, Any] = {"_default": default}
+    lines = ["def extract(body, item):"]
+    for index, (key, path) in enumerate(template.items()):
+        if len(path) == 0:
+            continue
+        value = "body" + "".join(f"[{part!r}]" for part in path)
+        if key in transforms:
+            namespace[f"_transform_{index}"] = transforms[key]
+            value = f"_transform_{index}({value})"
+        lines += [
+            "    try:",
+            f"        item[{key!r}] = {value}",
+            "    except (KeyError, IndexError, TypeError):",
+            f"        item[{key!r}] = _default",
+        ]
+    if len(lines) == 1:
+        lines.append("    pass")
+    exec(compile("\n".join(lines), f"<item template {sorted(template)}>", "exec"), namespace)
+    return namespace["extract"]
+
+
+def get_compiled_template(
+    template: dict,
+    transforms: Optional[Dict[str, Callable[[Any], Any]]] = None,
+) -> Extractor:
+    """Extractor for `template` and `transforms`, compiled on first use"""
+    key = (id(template), id(transforms))
+    cached = _COMPILED.get(key)
+    if cached is None or cached[0] is not template or cached[1] is not transforms:
+        cached = _COMPILED[key] = (template, transforms, compile_template(template, transforms))
+    return cached[2]
@@ -0,0 +1,289 @@
+"""Run metrics of Glue job runs, added to the monitor rows of their state changes.
+
+A Glue job state change names the job run but not what it cost. For the Glue job rows of an
+invocation, `JobRunEnricher`:
+
+- looks up each distinct run once: a job with a single run in the batch through GetJobRun, a
+  job with several through one GetJobRuns page (newest runs first), falling back to GetJobRun
+  for the runs not on it
+- reads the definitions of the jobs it has not cached, or cached more than
+  `definition_ttl_seconds` ago, with BatchGetJobs, 25 jobs per call; the settings a run was
+  started with take precedence over its job's
+- takes a token from a `TokenBucket` before every Glue call, and leaves the remaining rows
+  without run metrics once a token would take longer than `max_wait_seconds`
+- makes no Glue call later than `deadline_seconds` after the enrichment started, so that a slow
+  or throttled Glue API delays the invocation by that much at most; the remaining rows are
+  written without run metrics
+
+Lookups are best effort: a run that cannot be read leaves its row without run metrics.
+"""
+import logging
+import threading
+import time
+from collections import Counter
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+LOGGER = logging.getLogger(__name__)
+
+# Monitor columns added by the enrichment, and the JobRun / Job fields they come from
+RUN_FIELDS = {
+    "job_attempt": "Attempt",
+    "job_execution_seconds": "ExecutionTime",
+    "job_dpu_seconds": "DPUSeconds",
+}
+SETTING_FIELDS = {
+    "job_worker_type": "WorkerType",
+    "job_number_of_workers": "NumberOfWorkers",
+    "job_max_capacity": "MaxCapacity",
+    "job_glue_version": "GlueVersion",
+}
+
+# DPUs of a worker, for the DPU-seconds of runs Glue does not report them for
+WORKER_DPUS = {
+    "Standard": 1.0,
+    "G.025X": 0.25,
+    "G.1X": 1.0,
+    "G.2X": 2.0,
+    "G.4X": 4.0,
+    "G.8X": 8.0,
+    "Z.2X": 2.0,
+}
+
+# GetJobRuns returns at most 200 runs per page, BatchGetJobs is called with 25 jobs at a time
+MAX_RUNS_PER_PAGE = 200
+MAX_JOBS_PER_CALL = 25
+
+
+class TokenBucket:
+    """
+    Allows `rate` calls per second on average and bursts of up to `burst` calls. The bucket
+    lives as long as the container, so warm invocations share it; the account wide limit is
+    shared by all containers, so `rate` should be that limit divided by the concurrency.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = self.burst
+        self.updated_at = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def acquire(self, max_wait_seconds: Optional[float] = None) -> Optional[float]:
+        """Take a token, waiting for it if the bucket is empty; returns the seconds waited, or
+        None without taking a token if that would take longer than `max_wait_seconds`"""
+        with self._lock:
+            self._refill()
+            wait = max(0.0, (1 - self.tokens) / self.rate)
+            if max_wait_seconds is not None and wait > max_wait_seconds:
+                return None
+            # The token is taken now, so concurrent callers queue up behind it
+            self.tokens -= 1
+        if wait:
+            self.sleep(wait)
+        return wait
+
+
+class CachedDefinition(NamedTuple):
+    settings: Dict
+    fetched_at: float
+
+
+class RateLimited(Exception):
+    """No token for a Glue call within the wait budget"""
+
+
+class DeadlineExceeded(RateLimited):
+    """No time left for a Glue call before the enrichment deadline"""
+
+
+def dpu_seconds(run: Dict, settings: Dict) -> Optional[float]:
+    """DPU-seconds Glue reports for the run, or else its execution time times its capacity"""
+    if run.get("DPUSeconds") is not None:
+        return float(run["DPUSeconds"])
+    execution_time = run.get("ExecutionTime")
+    if execution_time is None:
+        return None
+    capacity = settings.get("MaxCapacity")
+    if capacity is None and settings.get("WorkerType") in WORKER_DPUS:
+        capacity = WORKER_DPUS[settings["WorkerType"]] * (settings.get("NumberOfWorkers") or 0)
+    return float(execution_time) * capacity if capacity else None
+
+
+def run_columns(run: Dict, definition: Dict) -> Dict:
+    """Monitor columns of a JobRun, completed with the settings of its job definition"""
+    settings = {
+        field: run[field] if run.get(field) is not None else definition.get(field)
+        for field in SETTING_FIELDS.values()
+    }
+    columns = {column: run.get(field) for column, field in RUN_FIELDS.items()}
+    columns.update({column: settings[field] for column, field in SETTING_FIELDS.items()})
+    columns["job_dpu_seconds"] = dpu_seconds(run, settings)
+    if columns["job_max_capacity"] is not None:
+        columns["job_max_capacity"] = float(columns["job_max_capacity"])
+    return columns
+
+
+class JobRunEnricher:
+    """Adds run metrics to Glue job rows, calling Glue through `client()`"""
+
+    def __init__(
+        self,
+        client: Callable[[], object],
+        rate_limiter: Optional[TokenBucket] = None,
+        definition_ttl_seconds: float = 900,
+        max_wait_seconds: float = 10,
+        deadline_seconds: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.client = client
+        self.rate_limiter = rate_limiter
+        self.definition_ttl_seconds = definition_ttl_seconds
+        self.max_wait_seconds = max_wait_seconds
+        self.deadline_seconds = deadline_seconds
+        self.clock = clock
+        self._definitions: Dict[str, CachedDefinition] = {}
+        self._lock = threading.Lock()
+
+    def call(self, stats: Counter, deadline: Optional[float], operation: str, **kwargs) -> Dict:
+        """One rate limited Glue call, made before the `clock()` time `deadline` or not at all"""
+        remaining = None if deadline is None else deadline - self.clock()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceeded(operation)
+        if self.rate_limiter is not None:
+            max_wait = self.max_wait_seconds
+            if remaining is not None and remaining < max_wait:
+                max_wait = remaining
+            waited = self.rate_limiter.acquire(max_wait)
+            if waited is None:
+                if max_wait < self.max_wait_seconds:
+                    raise DeadlineExceeded(operation)
+                raise RateLimited(operation)
+            stats["throttle_ms"] += waited * 1000
+        stats["api_calls"] += 1
+        return getattr(self.client(), operation)(**kwargs)
+
+    def definitions(
+        self, job_names: List[str], stats: Counter, deadline: Optional[float] = None
+    ) -> Dict[str, Dict]:
+        """Settings of `job_names`, from the cache or BatchGetJobs; unknown jobs have none"""
+        now = self.clock()
+        with self._lock:
+            entries = {name: self._definitions.get(name) for name in job_names}
+        cached = {
+            name: entry.settings
+            for name, entry in entries.items()
+            if entry is not None and now - entry.fetched_at < self.definition_ttl_seconds
+        }
+        stats["definition_hits"] += len(cached)
+        missing = [name for name in job_names if name not in cached]
+        for offset in range(0, len(missing), MAX_JOBS_PER_CALL):
+            chunk = missing[offset:offset + MAX_JOBS_PER_CALL]
+            response = self.call(stats, deadline, "batch_get_jobs", JobNames=chunk)
+            fetched = {name: {} for name in response.get("JobsNotFound", [])}
+            for job in response.get("Jobs", []):
+                fetched[job["Name"]] = {field: job.get(field) for field in SETTING_FIELDS.values()}
+            with self._lock:
+                for name, settings in fetched.items():
+                    self._definitions[name] = CachedDefinition(settings, now)
+            cached.update(fetched)
+        return cached
+
+    def runs(
+        self,
+        job_name: str,
+        run_ids: List[str],
+        stats: Counter,
+        deadline: Optional[float] = None,
+    ) -> Dict[str, Dict]:
+        """JobRuns of `run_ids` found for `job_name`"""
+        found: Dict[str, Dict] = {}
+        if len(run_ids) > 1:
+            response = self.call(
+                stats, deadline, "get_job_runs", JobName=job_name, MaxResults=MAX_RUNS_PER_PAGE
+            )
+            wanted = set(run_ids)
+            found = {run["Id"]: run for run in response.get("JobRuns", []) if run["Id"] in wanted}
+        for run_id in run_ids:
+            if run_id in found:
+                continue
+            try:
+                found[run_id] = self.call(
+                    stats, deadline, "get_job_run", JobName=job_name, RunId=run_id
+                )["JobRun"]
+            except RateLimited:
+                raise
+            except Exception as exc:
+                if _error_code(exc) != "EntityNotFoundException":
+                    raise
+        return found
+
+    def enrich(self, items: List[dict]) -> Counter:
+        """Add run metrics to the Glue job rows among `items`; returns counts of rows enriched,
+        runs not found, rows skipped for the rate limit or the deadline, lookup errors, Glue
+        calls, definition cache hits and the milliseconds spent waiting on the rate limit"""
+        stats: Counter = Counter()
+        deadline = None
+        if self.deadline_seconds is not None:
+            deadline = self.clock() + self.deadline_seconds
+        by_job: Dict[str, Dict[str, List[dict]]] = {}
+        for item in items:
+            if item.get("service_type") == "glue_job" and item.get("service_run_id"):
+                runs = by_job.setdefault(item["service_name"], {})
+                runs.setdefault(item["service_run_id"], []).append(item)
+        if not by_job:
+            return stats
+
+        try:
+            definitions = self.definitions(list(by_job), stats, deadline)
+        except RateLimited as exc:
+            stats[_skip_reason(exc)] += sum(len(runs) for runs in by_job.values())
+            return stats
+        except Exception:
+            LOGGER.warning("Could not read Glue job definitions", exc_info=True)
+            stats["errors"] += 1
+            definitions = {}
+
+        pending = list(by_job.items())
+        for index, (job_name, runs) in enumerate(pending):
+            try:
+                found = self.runs(job_name, list(runs), stats, deadline)
+            except RateLimited as exc:
+                stats[_skip_reason(exc)] += sum(len(runs) for _, runs in pending[index:])
+                break
+            except Exception:
+                LOGGER.warning(f"Could not read the runs of Glue job {job_name}", exc_info=True)
+                stats["errors"] += 1
+                continue
+            for run_id, run_items in runs.items():
+                run = found.get(run_id)
+                if run is None:
+                    stats["not_found"] += 1
+                    continue
+                columns = run_columns(run, definitions.get(job_name, {}))
+                for item in run_items:
+                    item.update(columns)
+                stats["enriched"] += len(run_items)
+        return stats
+
+
+def _skip_reason(exc: RateLimited) -> str:
+    """Stat counting the rows left without run metrics because of `exc`"""
+    return "deadline_exceeded" if isinstance(exc, DeadlineExceeded) else "rate_limited"
+
+
+def _error_code(exc: Exception) -> Optional[str]:
+    """Error code of a botocore ClientError"""
+    return getattr(exc, "response", {}).get("Error", {}).get("Code")
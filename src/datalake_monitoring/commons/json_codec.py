@@ -0,0 +1,163 @@
+"""JSON decoding of monitoring messages with the fastest installed backend.
+
+Messages are decoded eagerly with the first installed of orjson, simdjson and the standard
+library, or the backend named by JSON_BACKEND. Messages of at least JSON_LAZY_MIN_BYTES are
+parsed lazily with simdjson when it is installed: only the fields the item templates read
+(event key, template fields, remedy details) become Python objects, and large payloads such as
+a Lambda destination's requestPayload or a Glue event's detail are never materialized. For
+small messages the wrapping costs more than it saves, see benchmarks/decode.py.
+"""
+import json
+import os
+from collections.abc import Mapping, Sequence
+from typing import Any, Callable, Optional
+
+BACKENDS = ("orjson", "simdjson", "json")
+LAZY_BACKEND = "simdjson"
+
+
+def _simdjson_lazy(data):
+    import simdjson
+
+    # A parser can only hold one document at a time, so every message gets its own
+    return _wrap(simdjson.Parser().parse(_to_bytes(data)))
+
+
+def _simdjson_loads(data):
+    import simdjson
+
+    return simdjson.loads(data)
+
+
+def _orjson_loads(data):
+    import orjson
+
+    return orjson.loads(data)
+
+
+def _to_bytes(data) -> bytes:
+    return data.encode() if isinstance(data, str) else data
+
+
+def available(backend: str) -> bool:
+    """True if the backend's package is installed"""
+    if backend == "json":
+        return True
+    try:
+        __import__(backend)
+    except ImportError:
+        return False
+    return True
+
+
+def select_backend(name: Optional[str] = None) -> str:
+    """The backend to use: `name` if installed, else the first installed of BACKENDS"""
+    name = (name or os.environ.get("JSON_BACKEND", "auto")).lower()
+    if name != "auto":
+        if name not in BACKENDS:
+            raise ValueError(f"Unknown JSON backend {name!r}, expected one of {BACKENDS}")
+        if available(name):
+            return name
+    return next(backend for backend in BACKENDS if available(backend))
+
+
+_LOADS = {"simdjson": _simdjson_loads, "orjson": _orjson_loads, "json": json.loads}
+
+
+class JSONCodec:
+    """Decoder bound to a backend. `loads` returns plain Python objects; `lazy` returns a
+    read-only mapping whose values are decoded on first access for messages of at least
+    `lazy_min_bytes` (negative to disable), plain objects otherwise. Both raise ValueError on
+    invalid JSON."""
+
+    def __init__(self, backend: Optional[str] = None, lazy_min_bytes: Optional[int] = None):
+        self.backend = select_backend(backend)
+        if lazy_min_bytes is None:
+            lazy_min_bytes = int(os.environ.get("JSON_LAZY_MIN_BYTES", "16384"))
+        self.lazy_min_bytes = lazy_min_bytes if available(LAZY_BACKEND) else -1
+        self._loads: Callable[[Any], Any] = _LOADS[self.backend]
+
+    def loads(self, data):
+        return self._loads(data)
+
+    def lazy(self, data):
+        if 0 <= self.lazy_min_bytes <= len(data):
+            return _simdjson_lazy(data)
+        return self._loads(data)
+
+
+class LazyObject(Mapping):
+    """Read-only view of a simdjson object; nested values are decoded when accessed"""
+
+    __slots__ = ("_object", "_cache")
+
+    def __init__(self, document):
+        self._object = document
+        self._cache = {}
+
+    def __getitem__(self, key):
+        try:
+            return self._cache[key]
+        except KeyError:
+            value = self._cache[key] = _wrap(self._object[key])
+            return value
+
+    def __contains__(self, key) -> bool:
+        return key in self._cache or key in self._object
+
+    def __iter__(self):
+        return iter(self._object.keys())
+
+    def __len__(self) -> int:
+        return len(self._object)
+
+    def materialize(self) -> dict:
+        """The object as plain Python dicts and lists"""
+        return self._object.as_dict()
+
+    def __repr__(self) -> str:
+        return self._object.mini.decode()
+
+
+class LazyArray(Sequence):
+    """Read-only view of a simdjson array; elements are decoded when accessed"""
+
+    __slots__ = ("_array",)
+
+    def __init__(self, array):
+        self._array = array
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[position] for position in range(*index.indices(len(self)))]
+        return _wrap(self._array[index])
+
+    def __len__(self) -> int:
+        return len(self._array)
+
+    def materialize(self) -> list:
+        return self._array.as_list()
+
+    def __repr__(self) -> str:
+        return self._array.mini.decode()
+
+
+def _wrap(value):
+    kind = type(value).__name__
+    if kind == "Object":
+        return LazyObject(value)
+    if kind == "Array":
+        return LazyArray(value)
+    return value
+
+
+def materialize(value):
+    """Plain Python value of a decoded (possibly lazy) value"""
+    if isinstance(value, (LazyObject, LazyArray)):
+        return value.materialize()
+    return value
+
+
+CODEC = JSONCodec()
+loads = CODEC.loads
+lazy_loads = CODEC.lazy
@@ -0,0 +1,28 @@
+"""Defer importing heavy modules until they are first used"""
+import importlib
+from types import ModuleType
+from typing import Optional
+
+
+class LazyModule:
+    """Module proxy that imports `name` on first attribute access"""
+
+    __slots__ = ("_name", "_module")
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module: Optional[ModuleType] = None
+
+    def __getattr__(self, attr: str):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+    def __repr__(self) -> str:
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module '{self._name}' ({state})>"
+
+
+def lazy_import(name: str) -> LazyModule:
+    """Return a proxy for module `name`; the import happens on first use"""
+    return LazyModule(name)
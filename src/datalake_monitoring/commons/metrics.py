@@ -0,0 +1,137 @@
+"""Per-invocation stage timings and counters, emitted as a single CloudWatch Embedded Metric
+Format (EMF) log line. CloudWatch extracts the metrics from the log line, so emitting them costs
+no API calls."""
+import json
+import random
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Union
+
+MILLISECONDS = "Milliseconds"
+COUNT = "Count"
+BYTES = "Bytes"
+
+# EMF accepts at most 100 values per metric and 100 metrics per log line
+MAX_VALUES = 100
+
+
+class InvocationMetrics:
+    """
+    Accumulates metrics for one invocation and emits them with `emit()`.
+
+    - `add(name, value, unit)` sums into a single value, e.g. records processed
+    - `observe(name, value, unit)` keeps each value, e.g. the latency of every notification
+    - `add_time(stage, start)` adds the milliseconds since `start` (a `now()` reading) to the
+      `<stage>Time` metric
+
+    Only a `sample_rate` fraction of invocations is emitted; `reset()` starts the next
+    invocation and draws its sample. Safe to update from worker threads.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        dimensions: Dict[str, str],
+        sample_rate: float = 1.0,
+        clock: Callable[[], float] = time.perf_counter,
+    ):
+        self.namespace = namespace
+        self.dimensions = dimensions
+        self.sample_rate = sample_rate
+        self.now = clock
+        self._lock = threading.Lock()
+        self._values: Dict[str, Union[float, List[float]]] = {}
+        self._units: Dict[str, str] = {}
+        self.sampled = True
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._values = {}
+            self._units = {}
+        self.sampled = self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def add(self, name: str, value: float, unit: str = COUNT) -> None:
+        with self._lock:
+            self._values[name] = self._values.get(name, 0) + value
+            self._units[name] = unit
+
+    def observe(self, name: str, value: float, unit: str = MILLISECONDS) -> None:
+        with self._lock:
+            values = self._values.setdefault(name, [])
+            if len(values) < MAX_VALUES:
+                values.append(value)
+            self._units[name] = unit
+
+    def add_time(self, stage: str, start: float) -> None:
+        self.add(f"{stage}Time", (self.now() - start) * 1000, MILLISECONDS)
+
+    def value(self, name: str) -> Optional[Union[float, List[float]]]:
+        return self._values.get(name)
+
+    def values(self) -> Dict[str, Union[float, List[float]]]:
+        with self._lock:
+            return dict(self._values)
+
+    def to_emf(self, timestamp_ms: Optional[int] = None) -> dict:
+        """The EMF document of the metrics recorded so far"""
+        with self._lock:
+            values = dict(self._values)
+            units = dict(self._units)
+        names = list(values)[:MAX_VALUES]
+        return {
+            "_aws": {
+                "Timestamp": timestamp_ms if timestamp_ms is not None else int(time.time() * 1000),
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": self.namespace,
+                        "Dimensions": [list(self.dimensions)],
+                        "Metrics": [{"Name": name, "Unit": units[name]} for name in names],
+                    }
+                ],
+            },
+            **self.dimensions,
+            **{name: values[name] for name in names},
+        }
+
+    def emit(self, write: Callable[[str], None] = print) -> Optional[str]:
+        """Write the EMF line if this invocation is sampled; Lambda sends stdout to CloudWatch
+        Logs as is"""
+        if not self.sampled or not self._values:
+            return None
+        line = json.dumps(self.to_emf(), separators=(",", ":"))
+        write(line)
+        return line
+
+
+class SampledLogger:
+    """Structured JSON log lines for a `sample_rate` fraction of calls, with string fields cut
+    to `max_chars`, so logging cost does not grow with batch or payload size. Errors are
+    always logged."""
+
+    def __init__(self, log, sample_rate: float = 0.01, max_chars: int = 512):
+        self.log = log
+        self.sample_rate = sample_rate
+        self.max_chars = max_chars
+
+    def sampled(self) -> bool:
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def info(self, message: str, **fields) -> None:
+        if self.sampled():
+            self.log.info(self.format(message, **fields))
+
+    def error(self, message: str, **fields) -> None:
+        self.log.error(self.format(message, **fields))
+
+    def format(self, message: str, **fields) -> str:
+        """JSON log line with truncated string fields"""
+        def short(value):
+            if isinstance(value, str) and len(value) > self.max_chars:
+                return f"{value[:self.max_chars]}...(+{len(value) - self.max_chars} chars)"
+            return value
+
+        return json.dumps(
+            {"message": message, **{key: short(value) for key, value in fields.items()}},
+            default=str,
+        )
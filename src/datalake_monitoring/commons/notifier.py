@@ -0,0 +1,417 @@
+"""Failure notifications to Slack, Microsoft Teams, PagerDuty-style HTTP endpoints and email
+through SNS, sent concurrently.
+
+Every sink has its own connection pool, thread pool (its concurrency cap), timeout and retry
+budget, so a slow or failing sink only delays its own notifications. `Notifier` hands each
+message to the sinks a `Router` picks for it and returns one future per sink; `gather` waits
+for them until a deadline, and reports the notifications still queued or in flight by then as
+failed, leaving them to finish in the background.
+"""
+import json
+import logging
+import random
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional
+
+from commons.aws_clients import get_session
+from commons.lazy_import import lazy_import
+from commons.routing import Router
+
+requests = lazy_import("requests")
+botocore_config = lazy_import("botocore.config")
+
+LOGGER = logging.getLogger(__name__)
+
+# Returns the webhook URL; `True` asks for a fresh copy (e.g. after the webhook was rotated)
+WebhookProvider = Callable[[bool], str]
+# Returns a secret value by key, see WebhookProvider for the flag
+SecretProvider = Callable[[str, bool], str]
+
+PAGERDUTY_EVENTS_URL = "https://events.pagerduty.com/v2/enqueue"
+PAGERDUTY_SEVERITIES = ("critical", "error", "warning", "info")
+
+
+class NotificationOutcome(NamedTuple):
+    message: dict
+    status_code: Optional[int]
+    error: Optional[str]
+    elapsed_seconds: float
+    sink: str = "slack"
+    # Not sent by the deadline `gather` waited until
+    timed_out: bool = False
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code is not None and 200 <= self.status_code < 300
+
+
+class PendingNotification(Future):
+    """Future of `message` sent by sink `sink`"""
+
+    def __init__(self, message: dict, sink: str):
+        super().__init__()
+        self.message = message
+        self.sink = sink
+        self.submitted_at = time.perf_counter()
+
+    def timed_out(self) -> NotificationOutcome:
+        """Outcome of a notification not sent by the deadline"""
+        state = "in flight" if self.running() else "queued"
+        return NotificationOutcome(
+            self.message,
+            None,
+            f"Not sent by the deadline, still {state}",
+            time.perf_counter() - self.submitted_at,
+            self.sink,
+            timed_out=True,
+        )
+
+
+def is_client_error(status_code: int) -> bool:
+    """Whether `status_code` rejects the request itself, rather than rate limiting it"""
+    return 400 <= status_code < 500 and status_code != 429
+
+
+class Sink(ABC):
+    """
+    Delivers messages from a thread pool of `max_workers`, its concurrency cap. Subclasses
+    implement `deliver`, which returns an HTTP-like status code. Create one per container and
+    reuse it across invocations.
+    """
+
+    kind = ""
+
+    def __init__(
+        self,
+        name: str,
+        max_workers: int = 8,
+        timeout: float = 5,
+        max_retries: int = 3,
+        backoff_seconds: float = 0.5,
+        max_backoff_seconds: float = 10,
+    ):
+        self.name = name
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix=f"notify-{self.name}"
+            )
+        return self._executor
+
+    @abstractmethod
+    def deliver(self, message: dict) -> int:
+        """Deliver `message`; returns an HTTP-like status code"""
+
+    def send(self, message: dict) -> NotificationOutcome:
+        """Send `message` synchronously"""
+        start = time.perf_counter()
+        try:
+            status_code = self.deliver(message)
+            return NotificationOutcome(
+                message, status_code, None, time.perf_counter() - start, self.name
+            )
+        except Exception as exc:
+            LOGGER.warning("Notification to %s failed: %s", self.name, exc)
+            return NotificationOutcome(
+                message, None, repr(exc), time.perf_counter() - start, self.name
+            )
+
+    def submit(self, message: dict) -> PendingNotification:
+        """Queue `message` to be sent in the background"""
+        future = PendingNotification(message, self.name)
+        self.executor.submit(self._send_pending, future)
+        return future
+
+    def _send_pending(self, future: PendingNotification) -> None:
+        if future.set_running_or_notify_cancel():
+            future.set_result(self.send(future.message))
+
+    def send_all(self, messages: Iterable[dict]) -> List[NotificationOutcome]:
+        """Send `messages` concurrently and wait for all of them"""
+        return gather([self.submit(message) for message in messages])
+
+
+class WebhookSink(Sink):
+    """
+    Posts messages as JSON to a webhook, reusing connections from its own `requests.Session`.
+    Rate limited (429) and server error responses are retried up to `max_retries` times; a
+    client error re-reads the webhook once, in case it was rotated.
+    """
+
+    kind = "webhook"
+
+    def __init__(self, name: str, webhook_provider: WebhookProvider, **kwargs):
+        super().__init__(name, **kwargs)
+        self.webhook_provider = webhook_provider
+        self._session = None
+
+    @property
+    def session(self):
+        if self._session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=1, pool_maxsize=self.max_workers
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers.update({"Content-Type": "application/json"})
+            self._session = session
+        return self._session
+
+    def format(self, message: dict) -> dict:
+        """Request body of `message`"""
+        return message
+
+    def post(self, webhook: str, body: dict) -> int:
+        """POST a single request body, retrying on 429 and 5xx; returns the HTTP status code"""
+        payload = json.dumps(body)
+        attempt = 0
+        while True:
+            response = self.session.post(url=webhook, data=payload, timeout=self.timeout)
+            retryable = response.status_code == 429 or response.status_code >= 500
+            if not retryable or attempt >= self.max_retries:
+                return response.status_code
+            time.sleep(self.retry_delay(response.headers.get("Retry-After"), attempt))
+            attempt += 1
+
+    def retry_delay(self, retry_after: Optional[str], attempt: int) -> float:
+        """Honour Retry-After when given, else exponential backoff with jitter"""
+        try:
+            delay = float(retry_after)
+        except (TypeError, ValueError):
+            delay = self.backoff_seconds * 2**attempt * random.uniform(0.5, 1.0)
+        return min(max(delay, 0.0), self.max_backoff_seconds)
+
+    def deliver(self, message: dict) -> int:
+        webhook = self.webhook_provider(False)
+        body = self.format(message)
+        status_code = self.post(webhook, body)
+        if is_client_error(status_code):
+            # The webhook may have been rotated: re-read the secret and retry once
+            refreshed = self.webhook_provider(True)
+            if refreshed != webhook:
+                status_code = self.post(refreshed, body)
+        return status_code
+
+
+class SlackNotifier(WebhookSink):
+    """Slack workflow webhook, which takes the message fields as its variables"""
+
+    kind = "slack"
+
+    def __init__(self, webhook_provider: WebhookProvider, name: str = "slack", **kwargs):
+        super().__init__(name, webhook_provider, **kwargs)
+
+    def format(self, message: dict) -> dict:
+        return {key: value for key, value in message.items() if key != "severity"}
+
+
+def _title(message: dict) -> str:
+    return f"{message['service']} failure: {message['service_name']}"
+
+
+class TeamsSink(WebhookSink):
+    """Microsoft Teams incoming webhook, as a MessageCard listing the message fields"""
+
+    kind = "teams"
+
+    def format(self, message: dict) -> dict:
+        return {
+            "@type": "MessageCard",
+            "@context": "https://schema.org/extensions",
+            "summary": _title(message),
+            "title": _title(message),
+            "themeColor": "D13438" if message.get("severity") == "critical" else "FF8C00",
+            "sections": [
+                {
+                    "facts": [
+                        {"name": key, "value": str(value)} for key, value in message.items()
+                    ]
+                }
+            ],
+        }
+
+
+class PagerDutySink(WebhookSink):
+    """PagerDuty Events API v2 style endpoint: triggers an alert per message, deduplicated per
+    service and service name, with the routing key from `routing_key_provider`. A client error
+    re-reads the routing key once, in case it was rotated."""
+
+    kind = "pagerduty"
+
+    def __init__(
+        self,
+        name: str,
+        routing_key_provider: WebhookProvider,
+        webhook_provider: Optional[WebhookProvider] = None,
+        **kwargs,
+    ):
+        super().__init__(name, webhook_provider or (lambda _: PAGERDUTY_EVENTS_URL), **kwargs)
+        self.routing_key_provider = routing_key_provider
+
+    def format(self, message: dict, routing_key: Optional[str] = None) -> dict:
+        severity = message.get("severity")
+        return {
+            "routing_key": routing_key or self.routing_key_provider(False),
+            "event_action": "trigger",
+            "dedup_key": f"{message['service']}:{message['service_name']}",
+            "payload": {
+                "summary": f"{_title(message)}: {message.get('exception_details')}"[:1024],
+                "source": message["service_name"],
+                "severity": severity if severity in PAGERDUTY_SEVERITIES else "error",
+                "timestamp": message.get("time_stamp"),
+                "custom_details": message,
+            },
+        }
+
+    def deliver(self, message: dict) -> int:
+        webhook = self.webhook_provider(False)
+        routing_key = self.routing_key_provider(False)
+        status_code = self.post(webhook, self.format(message, routing_key))
+        if is_client_error(status_code):
+            refreshed = self.routing_key_provider(True)
+            if refreshed != routing_key:
+                status_code = self.post(webhook, self.format(message, refreshed))
+        return status_code
+
+
+class SNSEmailSink(Sink):
+    """Publishes messages to an SNS topic with email subscriptions, through a client of its
+    own whose connection pool, timeouts and retries follow the sink's settings"""
+
+    kind = "sns"
+
+    def __init__(
+        self,
+        name: str,
+        topic_arn: str,
+        region_name: Optional[str] = None,
+        client: Optional[Callable[[], object]] = None,
+        **kwargs,
+    ):
+        super().__init__(name, **kwargs)
+        self.topic_arn = topic_arn
+        self.region_name = region_name
+        self._client_factory = client
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            if self._client_factory is not None:
+                self._client = self._client_factory()
+            else:
+                self._client = get_session().client(
+                    "sns",
+                    region_name=self.region_name,
+                    config=botocore_config.Config(
+                        max_pool_connections=self.max_workers,
+                        connect_timeout=self.timeout,
+                        read_timeout=self.timeout,
+                        retries={"max_attempts": self.max_retries + 1, "mode": "standard"},
+                    ),
+                )
+        return self._client
+
+    def deliver(self, message: dict) -> int:
+        lines = [f"{key}: {value}" for key, value in message.items()]
+        response = self.client.publish(
+            TopicArn=self.topic_arn,
+            # SNS subjects are limited to 100 characters
+            Subject=_title(message)[:100],
+            Message="\n".join(lines),
+        )
+        return response.get("ResponseMetadata", {}).get("HTTPStatusCode", 200)
+
+
+SINK_TYPES = {
+    sink_type.kind: sink_type
+    for sink_type in (WebhookSink, SlackNotifier, TeamsSink, PagerDutySink, SNSEmailSink)
+}
+SINK_SETTINGS = ("max_workers", "timeout", "max_retries", "backoff_seconds", "max_backoff_seconds")
+
+
+def make_sink(
+    name: str,
+    spec: dict,
+    secret: SecretProvider,
+    region_name: Optional[str] = None,
+    defaults: Optional[Dict] = None,
+) -> Sink:
+    """
+    Sink `name` from its configuration: `type` (slack, teams, pagerduty, webhook or sns), the
+    webhook as a literal `url` or the `secret_key` holding it (for pagerduty, the routing
+    key), `topic_arn` for sns, and any of SINK_SETTINGS, which default to `defaults`.
+    """
+    sink_type = spec.get("type", "slack")
+    if sink_type not in SINK_TYPES:
+        raise ValueError(
+            f"Unknown sink type {sink_type!r} of {name!r}, expected one of {list(SINK_TYPES)}"
+        )
+    settings = {**(defaults or {}), **{key: spec[key] for key in SINK_SETTINGS if key in spec}}
+
+    def from_secret(key: str) -> WebhookProvider:
+        return lambda force_refresh: secret(key, force_refresh)
+
+    if sink_type == SNSEmailSink.kind:
+        return SNSEmailSink(name, spec["topic_arn"], region_name=region_name, **settings)
+    url = spec.get("url")
+    if sink_type == PagerDutySink.kind:
+        return PagerDutySink(
+            name,
+            routing_key_provider=from_secret(spec["secret_key"]),
+            webhook_provider=(lambda _: url) if url else None,
+            **settings,
+        )
+    webhook_provider = (lambda _: url) if url else from_secret(spec["secret_key"])
+    if sink_type == SlackNotifier.kind:
+        return SlackNotifier(webhook_provider, name=name, **settings)
+    return SINK_TYPES[sink_type](name, webhook_provider, **settings)
+
+
+class Notifier:
+    """Sends each message to the sinks `router` picks for it"""
+
+    def __init__(self, sinks: Dict[str, Sink], router: Router):
+        unknown = router.sink_names - set(sinks)
+        if unknown:
+            raise ValueError(f"Notification routes name unknown sinks: {sorted(unknown)}")
+        self.sinks = sinks
+        self.router = router
+
+    def submit(self, message: dict) -> List["Future[NotificationOutcome]"]:
+        """Queue `message` on each of its sinks"""
+        return [self.sinks[name].submit(message) for name in self.router.sinks(message)]
+
+    def send(self, message: dict) -> List[NotificationOutcome]:
+        """Send `message` to its sinks and wait for them"""
+        return gather(self.submit(message))
+
+    def send_all(self, messages: Iterable[dict]) -> List[NotificationOutcome]:
+        """Send `messages` concurrently and wait for all of them"""
+        return gather([future for message in messages for future in self.submit(message)])
+
+
+def gather(
+    futures: Iterable["Future[NotificationOutcome]"], timeout: Optional[float] = None
+) -> List[NotificationOutcome]:
+    """Wait for submitted notifications, in submission order. With a `timeout`, those not sent
+    within it, which must be `PendingNotification`s, are reported as timed out and left to be
+    sent in the background"""
+    futures = list(futures)
+    if timeout is not None:
+        wait(futures, timeout=max(0.0, timeout))
+        return [
+            future.result() if future.done() else future.timed_out() for future in futures
+        ]
+    return [future.result() for future in futures]
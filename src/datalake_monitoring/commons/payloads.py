@@ -0,0 +1,184 @@
+"""Bounded payload columns for Lambda failure rows.
+
+A Lambda destination message carries the function's whole `requestPayload` and `stackTrace`,
+up to SNS's 256 KB. The failure row keeps them as `request_payload` and `stack_trace` strings,
+and the error message as `error_message`, of at most `max_chars` characters each. When one of
+them had to be cut, the originals are stored once, gzipped, under a key derived from the
+SHA-256 of their content, and the row gets its URI as `payload_ref`, so identical payloads
+share one object. `payload_bytes` is the size of the original request payload.
+
+Offloads are collected per invocation (`SlimPayload.offload`) and written before the rows that
+refer to them.
+"""
+import gzip
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, NamedTuple, Optional
+
+from commons.aws_clients import get_client
+from commons.json_codec import LazyArray, LazyObject, materialize
+
+TRUNCATION_MARKER = "... [{} more chars]"
+
+
+def looks_like_json(text: Any) -> bool:
+    """True if `text` is a string holding a JSON object or array, judged by its first
+    character, so plain error messages are not run through the JSON parser"""
+    if not isinstance(text, str):
+        return False
+    stripped = text.lstrip()
+    return stripped[:1] in ("{", "[")
+
+
+def json_text(value: Any) -> Optional[str]:
+    """Compact JSON of a decoded value; lazily decoded values are serialized without being
+    turned into Python objects"""
+    if value is None:
+        return None
+    if isinstance(value, (LazyObject, LazyArray)):
+        return repr(value)
+    return json.dumps(value, separators=(",", ":"), default=str)
+
+
+def truncate(text: Optional[str], max_chars: int) -> Optional[str]:
+    """`text` cut to `max_chars` characters plus a marker with the number of characters cut"""
+    if text is None or len(text) <= max_chars:
+        return text
+    return text[:max_chars] + TRUNCATION_MARKER.format(len(text) - max_chars)
+
+
+class Offload(NamedTuple):
+    uri: str
+    data: bytes
+
+
+class SlimPayload(NamedTuple):
+    error_message: Optional[str]
+    request_payload: Optional[str]
+    stack_trace: Optional[str]
+    payload_bytes: int
+    offload: Optional[Offload]
+
+    def columns(self) -> dict:
+        return {
+            "error_message": self.error_message,
+            "request_payload": self.request_payload,
+            "stack_trace": self.stack_trace,
+            "payload_bytes": self.payload_bytes,
+            "payload_ref": self.offload.uri if self.offload is not None else None,
+        }
+
+
+# Error codes of a HeadObject on a key that does not exist
+MISSING_OBJECT_CODES = ("404", "NoSuchKey", "NotFound")
+
+
+def put_once(uri: str, data: bytes, region_name: Optional[str] = None) -> None:
+    """Write `data` to an s3:// URI unless an object exists there already, or to a local path.
+    The content is keyed by its hash, so an existing object holds the same payload, and two
+    containers writing the same key at once write the same bytes."""
+    if uri.startswith("s3://"):
+        bucket, _, key = uri[len("s3://"):].partition("/")
+        s3 = get_client("s3", region_name)
+        try:
+            s3.head_object(Bucket=bucket, Key=key)
+            return
+        except Exception as exc:
+            code = getattr(exc, "response", {}).get("Error", {}).get("Code")
+            if code not in MISSING_OBJECT_CODES:
+                raise
+        s3.put_object(Bucket=bucket, Key=key, Body=data)
+        return
+    if uri.startswith("file://"):
+        uri = uri[len("file://"):]
+    if os.path.exists(uri):
+        return
+    os.makedirs(os.path.dirname(uri), exist_ok=True)
+    with open(uri, "wb") as file:
+        file.write(data)
+
+
+class PayloadSlimmer:
+    """
+    Cuts payloads to `max_chars` and prepares the offload of oversized originals under
+    `offload_uri` (an s3:// or local prefix; None to only cut them). The hashes stored by this
+    container are remembered, up to `max_entries`, so a payload is written once per container
+    and, as existing objects are not written again, about once overall.
+    """
+
+    def __init__(
+        self,
+        max_chars: int = 4096,
+        offload_uri: Optional[str] = None,
+        put: Optional[Callable[[str, bytes], None]] = None,
+        region_name: Optional[str] = None,
+        max_entries: int = 4096,
+        max_workers: int = 8,
+    ):
+        self.max_chars = max_chars
+        self.offload_uri = offload_uri.rstrip("/") if offload_uri else None
+        self.put = put or (lambda uri, data: put_once(uri, data, region_name))
+        self.max_entries = max_entries
+        self.max_workers = max_workers
+        self._stored: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def truncate(self, text: Any) -> Optional[str]:
+        return truncate(None if text is None else str(text), self.max_chars)
+
+    def slim(self, error_message: Any, request_payload: Any, stack_trace: Any) -> SlimPayload:
+        """Bounded columns of a Lambda failure's error message, request payload and stack
+        trace"""
+        payload_text = json_text(request_payload)
+        if isinstance(stack_trace, (list, tuple, LazyArray)):
+            trace_text = "".join(str(frame) for frame in stack_trace)
+        else:
+            trace_text = None if stack_trace is None else str(stack_trace)
+        payload_bytes = len(payload_text.encode()) if payload_text is not None else 0
+
+        message_text = None if error_message is None else str(error_message)
+        texts = (message_text, payload_text, trace_text)
+        slim_message, slim_payload, slim_trace = (truncate(text, self.max_chars) for text in texts)
+        cut = (slim_message, slim_payload, slim_trace) != texts
+        offload = None
+        if self.offload_uri and cut:
+            original = json.dumps(
+                {
+                    "errorMessage": error_message,
+                    "requestPayload": materialize(request_payload),
+                    "stackTrace": materialize(stack_trace),
+                },
+                separators=(",", ":"),
+                sort_keys=True,
+                default=str,
+            ).encode()
+            digest = hashlib.sha256(original).hexdigest()
+            uri = f"{self.offload_uri}/{digest[:2]}/{digest}.json.gz"
+            offload = Offload(uri, gzip.compress(original, compresslevel=6))
+        return SlimPayload(slim_message, slim_payload, slim_trace, payload_bytes, offload)
+
+    def store(self, offloads: List[Offload]) -> int:
+        """Write the offloaded payloads this container has not stored yet, `max_workers` at a
+        time; returns the number of objects written"""
+        pending = {}
+        with self._lock:
+            for uri, data in {offload.uri: offload.data for offload in offloads}.items():
+                if uri in self._stored:
+                    self._stored.move_to_end(uri)
+                else:
+                    pending[uri] = data
+        if not pending:
+            return 0
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(pending))) as pool:
+            # list() re-raises the first failed PUT
+            list(pool.map(self.put, pending, pending.values()))
+        with self._lock:
+            for uri in pending:
+                self._stored[uri] = None
+            while len(self._stored) > self.max_entries:
+                self._stored.popitem(last=False)
+        return len(pending)
@@ -0,0 +1,106 @@
+"""Routing of failure notifications to sinks by service type, service name and severity.
+
+Rules are plain dicts, evaluated first to last:
+
+    {"service_name": "prod-*", "severity": "critical", "sinks": ["pagerduty"], "stop": true}
+
+A rule matches when every key it sets matches the message: `service_type`, `service_name` and
+`severity`, each a shell-style pattern or a list of them. The sinks of every matching rule are
+collected up to the first matching rule with `stop`; a message no rule matches goes to the
+default sinks. Severity rules have the same match keys and a `severity` value; the first one
+matching a service wins.
+
+Patterns are compiled once, and the outcome is remembered per (service type, service name,
+severity), of which a deployment has few, so routing a message is a dict lookup.
+"""
+import re
+from fnmatch import translate
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+MATCH_KEYS = ("service_type", "service_name", "severity")
+# Message fields holding the match keys (ProcessEvent.compose_message)
+MESSAGE_FIELDS = {"service_type": "service", "service_name": "service_name", "severity": "severity"}
+
+Matcher = Callable[[Dict[str, str]], bool]
+
+
+def compile_patterns(patterns) -> Callable[[str], bool]:
+    """One regex for a pattern or list of shell-style patterns"""
+    if isinstance(patterns, str):
+        patterns = [patterns]
+    regex = re.compile("|".join(f"(?:{translate(pattern)})" for pattern in patterns))
+    return lambda value: regex.match(value or "") is not None
+
+
+def compile_rule(rule: dict) -> Matcher:
+    """Matcher of the keys `rule` sets; a rule without any matches everything"""
+    checks = [
+        (key, compile_patterns(rule[key])) for key in MATCH_KEYS if rule.get(key) is not None
+    ]
+    return lambda fields: all(check(fields.get(key)) for key, check in checks)
+
+
+class Router:
+    """Compiled routing and severity rules, see the module docstring"""
+
+    def __init__(
+        self,
+        routes: Iterable[dict] = (),
+        default_sinks: Iterable[str] = (),
+        severities: Iterable[dict] = (),
+        default_severity: str = "error",
+        max_entries: int = 4096,
+    ):
+        routes = list(routes)
+        self.default_sinks = tuple(default_sinks)
+        self.default_severity = default_severity
+        self.max_entries = max_entries
+        self._routes: List[Tuple[Matcher, Tuple[str, ...], bool]] = [
+            (compile_rule(rule), tuple(rule.get("sinks", ())), bool(rule.get("stop")))
+            for rule in routes
+        ]
+        self._severities: List[Tuple[Matcher, str]] = [
+            (compile_rule({**rule, "severity": None}), rule["severity"]) for rule in severities
+        ]
+        self.sink_names = set(self.default_sinks).union(
+            *(sinks for _, sinks, _ in self._routes)
+        )
+        self._sinks_memo: Dict[Tuple[Optional[str], ...], Tuple[str, ...]] = {}
+        self._severity_memo: Dict[Tuple[Optional[str], ...], str] = {}
+
+    def _remember(self, memo: dict, key, value):
+        if len(memo) >= self.max_entries:
+            memo.clear()
+        memo[key] = value
+        return value
+
+    def severity(self, service_type: Optional[str], service_name: Optional[str]) -> str:
+        """Severity of a failure of the service"""
+        key = (service_type, service_name)
+        severity = self._severity_memo.get(key)
+        if severity is not None:
+            return severity
+        fields = {"service_type": service_type, "service_name": service_name}
+        severity = next(
+            (severity for match, severity in self._severities if match(fields)),
+            self.default_severity,
+        )
+        return self._remember(self._severity_memo, key, severity)
+
+    def sinks(self, message: dict) -> Tuple[str, ...]:
+        """Names of the sinks `message` goes to, in rule order without repeats"""
+        key = tuple(message.get(field) for field in MESSAGE_FIELDS.values())
+        sinks = self._sinks_memo.get(key)
+        if sinks is not None:
+            return sinks
+        fields = dict(zip(MESSAGE_FIELDS, key))
+        matched: Dict[str, None] = {}
+        any_match = False
+        for match, rule_sinks, stop in self._routes:
+            if match(fields):
+                any_match = True
+                matched.update(dict.fromkeys(rule_sinks))
+                if stop:
+                    break
+        sinks = tuple(matched) if any_match else self.default_sinks
+        return self._remember(self._sinks_memo, key, sinks)
@@ -0,0 +1,247 @@
+"""Run durations and SLA breaches, from correlating the start and completion events of a run.
+
+Glue jobs and crawlers publish a state change when a run starts (RUNNING, Started) as well as
+when it ends. Open runs are kept in a small state store keyed by run: the job run id of a Glue
+job, the crawler name of a crawler (a crawler runs once at a time). The monitor row of a run's
+completion gets its `duration_ms` and, when an SLA applies to the service, `sla_breached`.
+
+Events arrive at least once and in any order:
+
+- the starts and completions of a batch are applied starts first, in event time order
+- a repeated start keeps the later start time of an open run: a redelivery repeats the same
+  time, and a later start of a crawler is a new run whose completion was missed
+- a completion leaves its run closed with its end time and duration, so a repeated completion
+  gets the same duration, and a start that arrives after its run's completion (its event time
+  is not later than the end) is ignored instead of opening a run that never closes
+- a completion without a known start has no duration
+
+Entries of closed and abandoned runs expire after `ttl_seconds`.
+"""
+import threading
+import time
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from commons.aws_clients import get_client
+
+# Service types whose runs are correlated, and the item column identifying a run
+RUN_ID_COLUMNS = {"glue_job": "service_run_id", "glue_crawler": "service_name"}
+
+
+class RunEvent(NamedTuple):
+    key: str
+    at_ms: int
+
+
+class RunState(NamedTuple):
+    started_at_ms: Optional[int] = None
+    ended_at_ms: Optional[int] = None
+    duration_ms: Optional[int] = None
+
+
+def run_key(item: dict) -> Optional[str]:
+    """Key of the run a monitor item belongs to; None for services without run events"""
+    column = RUN_ID_COLUMNS.get(item.get("service_type"))
+    run_id = item.get(column) if column else None
+    if not run_id:
+        return None
+    return f"{item['service_type']}:{run_id}"
+
+
+def run_event(item: dict) -> Optional[RunEvent]:
+    """Start or completion of a run, from a composed item"""
+    key = run_key(item)
+    if key is None or item.get("event_epoch_ms") is None:
+        return None
+    return RunEvent(key, item["event_epoch_ms"])
+
+
+class InMemoryRunStore:
+    """Local stand-in for DynamoDBRunStore, for tests, benchmarks and local runs"""
+
+    def __init__(self, ttl_seconds: float = 2 * 24 * 3600, clock: Callable[[], float] = time.time):
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self._lock = threading.Lock()
+        # key -> (state, expires_at)
+        self._entries: Dict[str, Tuple[RunState, float]] = {}
+
+    def load(self, keys: Iterable[str]) -> Dict[str, RunState]:
+        now = self.clock()
+        with self._lock:
+            return {
+                key: self._entries[key][0]
+                for key in keys
+                if key in self._entries and self._entries[key][1] > now
+            }
+
+    def save(self, states: Dict[str, RunState]) -> None:
+        expires_at = self.clock() + self.ttl_seconds
+        with self._lock:
+            for key, state in states.items():
+                self._entries[key] = (state, expires_at)
+
+
+class DynamoDBRunStore:
+    """
+    Run states in a DynamoDB table with partition key `run_key` and TTL attribute `expires_at`,
+    one item per run. Loads go through BatchGetItem, 100 keys per call, and saves through
+    BatchWriteItem, 25 runs per call.
+    """
+
+    ATTRIBUTES = ("started_at_ms", "ended_at_ms", "duration_ms")
+
+    def __init__(
+        self,
+        table_name: str,
+        ttl_seconds: float = 2 * 24 * 3600,
+        region_name: Optional[str] = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.table_name = table_name
+        self.ttl_seconds = ttl_seconds
+        self.region_name = region_name
+        self.clock = clock
+
+    @property
+    def client(self):
+        return get_client("dynamodb", self.region_name)
+
+    def load(self, keys: Iterable[str]) -> Dict[str, RunState]:
+        keys = list(keys)
+        client = self.client
+        now = int(self.clock())
+        states = {}
+        for offset in range(0, len(keys), 100):
+            pending = {
+                self.table_name: {
+                    "Keys": [{"run_key": {"S": key}} for key in keys[offset:offset + 100]],
+                    "ConsistentRead": True,
+                }
+            }
+            for attempt in range(5):
+                response = client.batch_get_item(RequestItems=pending)
+                for item in response.get("Responses", {}).get(self.table_name, []):
+                    # TTL deletion lags behind expiry
+                    if int(item["expires_at"]["N"]) > now:
+                        states[item["run_key"]["S"]] = RunState(
+                            *(
+                                int(item[name]["N"]) if name in item else None
+                                for name in self.ATTRIBUTES
+                            )
+                        )
+                pending = response.get("UnprocessedKeys")
+                if not pending:
+                    break
+                time.sleep(min(0.05 * 2 ** attempt, 1))
+        return states
+
+    def save(self, states: Dict[str, RunState]) -> None:
+        expires_at = str(int(self.clock() + self.ttl_seconds))
+        requests = []
+        for key, state in states.items():
+            item = {"run_key": {"S": key}, "expires_at": {"N": expires_at}}
+            for name, value in zip(self.ATTRIBUTES, state):
+                if value is not None:
+                    item[name] = {"N": str(value)}
+            requests.append({"PutRequest": {"Item": item}})
+        client = self.client
+        for offset in range(0, len(requests), 25):
+            pending = {self.table_name: requests[offset:offset + 25]}
+            for attempt in range(5):
+                unprocessed = client.batch_write_item(RequestItems=pending).get(
+                    "UnprocessedItems"
+                )
+                if not unprocessed:
+                    break
+                pending = unprocessed
+                time.sleep(min(0.05 * 2 ** attempt, 1))
+
+
+class RunCorrelator:
+    """Matches run completions with their starts through `store`. `sla_seconds` maps a
+    service name, or else a service type, to the longest acceptable run."""
+
+    def __init__(self, store=None, sla_seconds: Optional[Dict[str, float]] = None):
+        self.store = store if store is not None else InMemoryRunStore()
+        self.sla_seconds = sla_seconds or {}
+
+    def correlate(
+        self, starts: List[RunEvent], completions: List[RunEvent]
+    ) -> Tuple[Dict[RunEvent, Optional[int]], Counter]:
+        """Record `starts` and close the runs of `completions`; returns the duration of each
+        completion and counts of late starts and unmatched completions"""
+        stats: Counter = Counter()
+        if not starts and not completions:
+            return {}, stats
+        states = self.store.load({event.key for event in (*starts, *completions)})
+        changed: Dict[str, RunState] = {}
+
+        for key, at_ms in sorted(starts, key=lambda event: event.at_ms):
+            state = states.get(key)
+            if state is not None and state.ended_at_ms is not None and state.ended_at_ms >= at_ms:
+                stats["late_starts"] += 1
+                continue
+            if state is not None and state.ended_at_ms is None and state.started_at_ms >= at_ms:
+                continue
+            states[key] = changed[key] = RunState(started_at_ms=at_ms)
+
+        durations: Dict[RunEvent, Optional[int]] = {}
+        for event in sorted(completions, key=lambda event: event.at_ms):
+            state = states.get(event.key)
+            if state is not None and state.ended_at_ms is not None:
+                if event.at_ms == state.ended_at_ms:
+                    durations[event] = state.duration_ms
+                    continue
+                if event.at_ms < state.ended_at_ms:
+                    # Completion of an earlier run, delivered after a later one
+                    durations[event] = None
+                    stats["unmatched"] += 1
+                    continue
+                state = None
+            if state is not None and state.started_at_ms <= event.at_ms:
+                duration = event.at_ms - state.started_at_ms
+                states[event.key] = changed[event.key] = RunState(
+                    state.started_at_ms, event.at_ms, duration
+                )
+                durations[event] = duration
+            elif state is not None:
+                # The open run started after this completion: the start of a later run
+                durations[event] = None
+                stats["unmatched"] += 1
+            else:
+                states[event.key] = changed[event.key] = RunState(ended_at_ms=event.at_ms)
+                durations[event] = None
+                stats["unmatched"] += 1
+
+        if changed:
+            self.store.save(changed)
+        return durations, stats
+
+    def sla_for(self, item: dict) -> Optional[float]:
+        for name in (item.get("service_name"), item.get("service_type")):
+            if name in self.sla_seconds:
+                return self.sla_seconds[name]
+        return None
+
+    def annotate(self, items: List[dict], starts: List[RunEvent]) -> Counter:
+        """Record `starts` and add `duration_ms` and `sla_breached` to the items completing a
+        run; returns counts of timed runs, SLA breaches, late starts and unmatched completions"""
+        completions = []
+        for index, item in enumerate(items):
+            event = run_event(item)
+            if event is not None:
+                completions.append((index, event))
+        durations, stats = self.correlate(starts, [event for _, event in completions])
+        for index, event in completions:
+            item = items[index]
+            item["duration_ms"] = durations.get(event)
+            sla = self.sla_for(item)
+            item["sla_breached"] = (
+                None
+                if sla is None or item["duration_ms"] is None
+                else item["duration_ms"] > sla * 1000
+            )
+            stats["timed"] += item["duration_ms"] is not None
+            stats["sla_breaches"] += bool(item["sla_breached"])
+        return stats
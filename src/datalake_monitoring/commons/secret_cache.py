@@ -0,0 +1,135 @@
+"""In-memory secret cache with TTL and stale-while-revalidate, shared across invocations"""
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, NamedTuple
+
+LOGGER = logging.getLogger(__name__)
+
+
+class CachedSecret(NamedTuple):
+    value: Any
+    fetched_at: float
+
+
+class SecretCache:
+    """
+    Caches secrets fetched through `fetch(secret_id)`.
+
+    - younger than `ttl_seconds`: served from memory
+    - within the following `stale_seconds`: served from memory while a background refresh runs
+    - older, missing or `force_refresh`: fetched synchronously; if that fetch fails the last
+      known value is served so a throttled Secrets Manager does not stop monitoring
+    - `force_refresh` within `min_refresh_seconds` of the last fetch serves the cached value,
+      so a persistently failing webhook does not fetch the secret on every send
+
+    A secret is fetched by one thread at a time: threads that need it meanwhile wait for that
+    fetch and use its value instead of fetching it again.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[str], Any],
+        ttl_seconds: float = 300,
+        stale_seconds: float = 3600,
+        min_refresh_seconds: float = 30,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.fetch = fetch
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.min_refresh_seconds = min_refresh_seconds
+        self.clock = clock
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.throttled_refreshes = 0
+        self._entries: Dict[str, CachedSecret] = {}
+        self._refreshing: Dict[str, threading.Thread] = {}
+        self._fetching: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def get(self, secret_id: str, force_refresh: bool = False) -> Any:
+        """Return the secret value, fetching it only when the cached copy is too old"""
+        entry = self._entries.get(secret_id)
+        if entry is not None:
+            age = self.clock() - entry.fetched_at
+            if force_refresh and age < self.min_refresh_seconds:
+                self._count("throttled_refreshes")
+                return entry.value
+            if not force_refresh and age < self.ttl_seconds:
+                self._count("hits")
+                return entry.value
+            if not force_refresh and age < self.ttl_seconds + self.stale_seconds:
+                self._count("stale_hits")
+                self._refresh_in_background(secret_id)
+                return entry.value
+
+        with self._fetch_lock(secret_id):
+            # Another thread may have fetched the secret while this one waited for the lock
+            current = self._entries.get(secret_id)
+            if current is not None and current is not entry:
+                max_age = self.min_refresh_seconds if force_refresh else self.ttl_seconds
+                if self.clock() - current.fetched_at < max_age:
+                    self._count("hits")
+                    return current.value
+            self._count("misses")
+            try:
+                return self._refresh(secret_id)
+            except Exception:
+                self._count("errors")
+                last_known = current if current is not None else entry
+                if last_known is None:
+                    raise
+                LOGGER.warning("Refreshing secret %s failed, serving cached value", secret_id)
+                return last_known.value
+
+    def invalidate(self, secret_id: str) -> None:
+        """Drop the cached value so the next `get` fetches it again"""
+        self._entries.pop(secret_id, None)
+
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss counters since the container started"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "errors": self.errors,
+                "throttled_refreshes": self.throttled_refreshes,
+            }
+
+    def _count(self, counter: str) -> None:
+        # Sends on several threads read secrets at once; += is not atomic
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _fetch_lock(self, secret_id: str) -> threading.Lock:
+        """Lock held while `secret_id` is fetched"""
+        with self._lock:
+            return self._fetching.setdefault(secret_id, threading.Lock())
+
+    def _refresh(self, secret_id: str) -> Any:
+        value = self.fetch(secret_id)
+        self._entries[secret_id] = CachedSecret(value, self.clock())
+        return value
+
+    def _refresh_in_background(self, secret_id: str) -> None:
+        with self._lock:
+            running = self._refreshing.get(secret_id)
+            if running is not None and running.is_alive():
+                return
+            thread = threading.Thread(
+                target=self._background_refresh, args=(secret_id,), daemon=True
+            )
+            self._refreshing[secret_id] = thread
+        thread.start()
+
+    def _background_refresh(self, secret_id: str) -> None:
+        try:
+            with self._fetch_lock(secret_id):
+                self._refresh(secret_id)
+        except Exception:
+            self._count("errors")
+            LOGGER.warning("Background refresh of secret %s failed", secret_id)
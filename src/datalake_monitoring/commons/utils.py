@@ -2,28 +2,24 @@ import json
 import logging
 from typing import Dict, Union
 
-import boto3
+from commons.aws_clients import get_client
 
 LOGGER = logging.getLogger(__name__)
 
 
 def get_lambda_name_from_arn(arn: str) -> str:
-    """Fetch Lambda function name from ARN"""
-    arn_type = "function"
-    return arn[arn.find(f"{arn_type}:") + len(arn_type) + 1 : len(arn)][
-        : arn[arn.find(f"{arn_type}:") + len(arn_type) + 1 : len(arn)].find(":")
-    ]
+    """Fetch Lambda function name from ARN, with or without a version/alias qualifier"""
+    return arn.split(":function:", 1)[-1].split(":", 1)[0]
 
 
 def get_secret(
-    secret_id: str, region_name: str = "us-west-2", is_json: bool = True
+    secret_id: str, region_name: str = "us-west-2", is_json: bool = True, client=None
 ) -> Union[str, Dict[str, str]]:
     """
     Gets credentials from secretsmanager
     """
 
-    session = boto3.session.Session()
-    client = session.client(service_name="secretsmanager", region_name=region_name)
+    client = client or get_client("secretsmanager", region_name)
     response = client.get_secret_value(SecretId=secret_id)
     secret = json.loads(response["SecretString"]) if is_json else response["SecretString"]
     LOGGER.info("Retrieved Secret for %s", secret_id)
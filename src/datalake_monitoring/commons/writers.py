@@ -0,0 +1,238 @@
+"""Writers of the monitor rows that do without awswrangler and pandas.
+
+- `ParquetWriter` encodes each partition with pyarrow directly; the writer needs no other
+  package besides boto3, which the Lambda runtime provides
+- `NDJSONWriter` writes gzipped newline-delimited JSON with the standard library only, to a
+  table of its own read with the JSON SerDe
+
+The Lambda still needs requests for the webhook sinks, which the slim layer of both backends
+holds (`make slim-layer`).
+
+Both write one object per partition with a plain S3 PUT and report the exact bytes written.
+Without partition projection, new partitions are registered with `GluePartitions`, a thin
+BatchCreatePartition client, once per container.
+"""
+import gzip
+import json
+import os
+import uuid
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+
+import monitor_schema as schema
+from commons.aws_clients import get_client
+from commons.lazy_import import lazy_import
+
+pa = lazy_import("pyarrow")
+pq = lazy_import("pyarrow.parquet")
+
+BACKEND_AWSWRANGLER = "awswrangler"
+BACKEND_PYARROW = "pyarrow"
+BACKEND_NDJSON = "ndjson"
+BACKENDS = (BACKEND_AWSWRANGLER, BACKEND_PYARROW, BACKEND_NDJSON)
+
+# BatchCreatePartition accepts at most 100 partitions per call
+MAX_PARTITIONS_PER_CALL = 100
+
+NDJSON_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+class WriteResult(NamedTuple):
+    paths: List[str]
+    bytes_written: int
+    partitions_registered: int = 0
+
+
+def put_object(uri: str, data: bytes, region_name: Optional[str] = None) -> None:
+    """Write `data` to an s3:// URI with a single PUT, or to a local path"""
+    if uri.startswith("s3://"):
+        bucket, _, key = uri[len("s3://"):].partition("/")
+        get_client("s3", region_name).put_object(Bucket=bucket, Key=key, Body=data)
+        return
+    if uri.startswith("file://"):
+        uri = uri[len("file://"):]
+    os.makedirs(os.path.dirname(uri), exist_ok=True)
+    with open(uri, "wb") as file:
+        file.write(data)
+
+
+class GluePartitions:
+    """Registers partitions of a Glue table with BatchCreatePartition. The table's storage
+    descriptor is read once and partitions already registered are remembered, so a warm
+    container only calls Glue for partitions it has not seen."""
+
+    def __init__(self, database: str, table: str, client: Callable[[], object]):
+        self.database = database
+        self.table = table
+        self.client = client
+        self.known: Set[Tuple[str, ...]] = set()
+        self._descriptor: Optional[Dict] = None
+
+    def storage_descriptor(self) -> Dict:
+        if self._descriptor is None:
+            table = self.client().get_table(DatabaseName=self.database, Name=self.table)["Table"]
+            self._descriptor = table["StorageDescriptor"]
+        return self._descriptor
+
+    def register(self, locations: Dict[Tuple[str, ...], str]) -> int:
+        """Create the partitions of `locations` (values -> location) not registered yet;
+        returns the number of partitions created or found to exist"""
+        new = [
+            (values, location)
+            for values, location in locations.items()
+            if values not in self.known
+        ]
+        if not new:
+            return 0
+        descriptor = self.storage_descriptor()
+        for start in range(0, len(new), MAX_PARTITIONS_PER_CALL):
+            chunk = new[start:start + MAX_PARTITIONS_PER_CALL]
+            response = self.client().batch_create_partition(
+                DatabaseName=self.database,
+                TableName=self.table,
+                PartitionInputList=[
+                    {
+                        "Values": list(values),
+                        "StorageDescriptor": {**descriptor, "Location": f"{location}/"},
+                    }
+                    for values, location in chunk
+                ],
+            )
+            errors = [
+                error
+                for error in response.get("Errors", [])
+                if error["ErrorDetail"]["ErrorCode"] != "AlreadyExistsException"
+            ]
+            if errors:
+                raise RuntimeError(f"Could not register partitions of {self.table}: {errors}")
+        self.known.update(values for values, _ in new)
+        return len(new)
+
+
+class PartitionedWriter(ABC):
+    """Writes items as one object per partition under `table_uri`; subclasses encode the rows.
+    `types` are the Glue types of the item columns, partition columns excluded from the files."""
+
+    extension = ""
+
+    def __init__(
+        self,
+        table_uri: str,
+        partitions: Optional[GluePartitions] = None,
+        put: Optional[Callable[[str, bytes], None]] = None,
+        region_name: Optional[str] = None,
+    ):
+        self.table_uri = table_uri.rstrip("/")
+        self.partitions = partitions
+        self.put = put or (lambda uri, data: put_object(uri, data, region_name))
+
+    @abstractmethod
+    def encode(self, rows: List[dict], types: Dict[str, str]) -> bytes:
+        """Object holding `rows` of a partition"""
+
+    def write(self, items: List[dict], types: Dict[str, str], written_at: datetime) -> WriteResult:
+        written_partition = schema.write_partition_values(written_at)
+        groups: Dict[Tuple[str, ...], List[dict]] = {}
+        for item in items:
+            values = {**written_partition, "service_type": item.get("service_type")}
+            key = tuple(str(values[name]) for name in schema.PARTITION_COLUMNS)
+            groups.setdefault(key, []).append(item)
+
+        data_types = {
+            column: type_
+            for column, type_ in types.items()
+            if column not in schema.PARTITION_COLUMNS
+        }
+        paths = []
+        bytes_written = 0
+        locations = {}
+        for values, rows in groups.items():
+            location = "/".join(
+                [self.table_uri]
+                + [f"{name}={value}" for name, value in zip(schema.PARTITION_COLUMNS, values)]
+            )
+            data = self.encode(rows, data_types)
+            path = f"{location}/{uuid.uuid4().hex}{self.extension}"
+            self.put(path, data)
+            paths.append(path)
+            bytes_written += len(data)
+            locations[values] = location
+
+        registered = self.partitions.register(locations) if self.partitions is not None else 0
+        return WriteResult(paths, bytes_written, registered)
+
+
+def _string(value) -> Optional[str]:
+    return value if value is None or isinstance(value, str) else str(value)
+
+
+_ARROW_TYPES = {
+    "string": lambda: pa.string(),
+    "timestamp": lambda: pa.timestamp("ms"),
+    "bigint": lambda: pa.int64(),
+    "int": lambda: pa.int32(),
+    "double": lambda: pa.float64(),
+    "boolean": lambda: pa.bool_(),
+}
+
+
+class ParquetWriter(PartitionedWriter):
+    """Snappy Parquet encoded with pyarrow, dictionary encoding the low cardinality columns"""
+
+    extension = ".snappy.parquet"
+
+    def encode(self, rows: List[dict], types: Dict[str, str]) -> bytes:
+        arrays = []
+        for column, type_ in types.items():
+            values = [row.get(column) for row in rows]
+            if type_ == "string":
+                values = [_string(value) for value in values]
+            arrays.append(pa.array(values, type=_ARROW_TYPES.get(type_, pa.string)()))
+        table = pa.Table.from_arrays(arrays, names=list(types))
+        sink = pa.BufferOutputStream()
+        pq.write_table(
+            table,
+            sink,
+            compression="snappy",
+            use_dictionary=[column for column in schema.DICTIONARY_COLUMNS if column in types],
+            coerce_timestamps="ms",
+            allow_truncated_timestamps=True,
+        )
+        return sink.getvalue().to_pybytes()
+
+
+def _json_value(value):
+    if isinstance(value, datetime):
+        # The JSON SerDe reads timestamps as yyyy-MM-dd HH:mm:ss[.fff]
+        return value.strftime(NDJSON_TIMESTAMP_FORMAT)[:-3]
+    return value
+
+
+class NDJSONWriter(PartitionedWriter):
+    """Gzipped newline-delimited JSON, one object per row, standard library only"""
+
+    extension = ".json.gz"
+
+    def encode(self, rows: List[dict], types: Dict[str, str]) -> bytes:
+        lines = [
+            json.dumps(
+                {column: _json_value(row.get(column)) for column in types},
+                separators=(",", ":"),
+                default=str,
+            )
+            for row in rows
+        ]
+        return gzip.compress("\n".join(lines).encode() + b"\n", compresslevel=6)
+
+
+_WRITERS = {BACKEND_PYARROW: ParquetWriter, BACKEND_NDJSON: NDJSONWriter}
+
+
+def make_writer(backend: str, table_uri: str, **kwargs) -> Optional[PartitionedWriter]:
+    """Writer of `backend`, or None for awswrangler, which the handler calls directly"""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown writer backend {backend!r}, expected one of {BACKENDS}")
+    if backend == BACKEND_AWSWRANGLER:
+        return None
+    return _WRITERS[backend](table_uri, **kwargs)
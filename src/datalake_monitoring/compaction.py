@@ -0,0 +1,369 @@
+""" Compaction of the monitor table: rewrite each partition of a closed day into a few large
+Parquet files sorted by service_type, service_name and timestamp, without the duplicate rows of
+events delivered more than once.
+
+A partition is compacted in steps that can each be retried:
+
+1. the compacted files are written to a staging prefix outside every partition location,
+   <table>/_compaction/exported_on=.../service_type=.../hour=.../<generation>/
+2. a manifest listing the input files and the compacted files is written next to them; from
+   then on the compaction is committed
+3. the compacted files are copied into the partition and the inputs deleted in one batch
+   (DeleteObjects on S3), then the staging prefix is removed
+
+Until step 3 readers only see the input files. Step 3 is not atomic: from the first copy until
+the delete, a reader of the partition (Athena lists its location) sees both the inputs and the
+compacted files, so every row of the partition is counted twice. The window is a server-side
+copy per output plus one delete call, and it only closes once publish completes. A run
+interrupted before step 2 leaves only staging files, which the next run removes; one
+interrupted after it leaves the duplicates visible until the next run finishes it from the
+manifest.
+"""
+
+import argparse
+import json
+import logging
+import time
+import traceback
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, NamedTuple, Optional, Set
+
+import config as cf
+import monitor_schema as schema
+from commons.aws_clients import get_client
+from commons.idempotency import make_key
+from commons.lazy_import import lazy_import
+
+pa = lazy_import("pyarrow")
+pc = lazy_import("pyarrow.compute")
+pq = lazy_import("pyarrow.parquet")
+pafs = lazy_import("pyarrow.fs")
+
+LOGGER = logging.getLogger(__name__)
+
+SORT_KEYS = ("service_type", "service_name", "timestamp")
+# Columns identifying a monitoring event, see commons.idempotency
+KEYS = ("service_request_id", "event_type")
+COMPACTED_PREFIX = "compacted-"
+STAGING_DIR = "_compaction"
+MANIFEST_NAME = "_manifest.json"
+# Staging prefixes without a manifest are removed once this old; younger ones may belong to a
+# compaction still writing
+STALE_STAGING_SECONDS = 3600
+# DeleteObjects takes at most 1000 keys per call
+MAX_KEYS_PER_DELETE = 1000
+
+_ARROW_TYPES = {
+    "string": lambda: pa.string(),
+    "int": lambda: pa.int32(),
+    "bigint": lambda: pa.int64(),
+    "double": lambda: pa.float64(),
+    "boolean": lambda: pa.bool_(),
+    "timestamp": lambda: pa.timestamp("ms"),
+}
+
+
+class CompactionResult(NamedTuple):
+    partition: str
+    input_files: int
+    output_files: int
+    rows: int
+    skipped: bool
+    duplicates: int = 0
+
+
+def handler(event, context):
+    """Compact the partitions of the last COMPACTION_LOOKBACK_DAYS closed days, or the days
+    given as {"days": ["YYYYMMDD", ...]}"""
+    log = logging.getLogger()
+    log.setLevel(logging.INFO)
+    try:
+        days = event.get("days") or closed_days(cf.COMPACTION_LOOKBACK_DAYS)
+        table_uri = schema.table_location(cf.MONITOR_S3, cf.MONITOR_DATABASE, cf.MONITOR_TABLE)
+        results = compact_table(table_uri, days)
+        if not cf.PARTITION_PROJECTION:
+            for result in results:
+                if not result.skipped:
+                    update_partition_stats(result)
+        log.info(f"Compaction results: {[result._asdict() for result in results]}")
+        return {"statusCode": 200, "body": json.dumps([result._asdict() for result in results])}
+    except Exception:
+        log.error(traceback.format_exc())
+        return {"statusCode": 400, "body": json.dumps("FAILURE: Monitor table compaction failed")}
+
+
+def closed_days(lookback_days: int, today: Optional[datetime] = None) -> List[str]:
+    """`exported_on` values of the `lookback_days` days before today (UTC)"""
+    today = today or datetime.now(timezone.utc)
+    return [(today - timedelta(days=n)).strftime("%Y%m%d") for n in range(1, lookback_days + 1)]
+
+
+def compact_table(table_uri: str, days: List[str]) -> List[CompactionResult]:
+    """Compact every partition below `exported_on` of `days` under `table_uri`
+    (s3:// or local path). Partitions of a day are compacted in order and share the keys seen,
+    so a retry written in a later hour is dropped as well."""
+    filesystem, root = pafs.FileSystem.from_uri(table_uri)
+    results = []
+    for day in days:
+        recover_staged(filesystem, f"{root}/{STAGING_DIR}/exported_on={day}")
+        selector = pafs.FileSelector(
+            f"{root}/exported_on={day}", allow_not_found=True, recursive=True
+        )
+        partitions = sorted(
+            {
+                info.path.rsplit("/", 1)[0]
+                for info in filesystem.get_file_info(selector)
+                if info.type == pafs.FileType.File
+            }
+        )
+        if f"{root}/exported_on={day}" in partitions:
+            # Files of the flat exported_on= layout, see migrate_layout.py
+            LOGGER.warning("Skipping files of the legacy layout under exported_on=%s", day)
+            partitions.remove(f"{root}/exported_on={day}")
+        seen_keys: Set[str] = set()
+        results.extend(
+            compact_partition(filesystem, partition, seen_keys=seen_keys)
+            for partition in partitions
+        )
+    return results
+
+
+def compact_partition(
+    filesystem,
+    partition_path: str,
+    max_rows_per_file: int = cf.COMPACTION_MAX_ROWS_PER_FILE,
+    row_group_size: int = cf.COMPACTION_ROW_GROUP_SIZE,
+    seen_keys: Optional[Set[str]] = None,
+) -> CompactionResult:
+    """
+    Rewrite all Parquet files of a partition into sorted files of at most `max_rows_per_file`,
+    keeping one row per (service_request_id, event_type) not already in `seen_keys`, through
+    the staging prefix and manifest described in the module docstring. Files arriving while
+    compaction runs are left untouched for the next run.
+    """
+    seen_keys = set() if seen_keys is None else seen_keys
+    selector = pafs.FileSelector(partition_path, allow_not_found=True)
+    inputs = [
+        info.path
+        for info in filesystem.get_file_info(selector)
+        if info.type == pafs.FileType.File and info.path.endswith(".parquet")
+    ]
+    already_compacted = all(
+        path.rsplit("/", 1)[-1].startswith(COMPACTED_PREFIX) for path in inputs
+    )
+    if not inputs or already_compacted:
+        # Rows of already compacted partitions still count as seen for the rest of the day
+        for path in inputs:
+            keys = pq.read_table(path, filesystem=filesystem, columns=list(KEYS))
+            seen_keys.update(row_keys(keys))
+        return CompactionResult(partition_path, len(inputs), 0, 0, skipped=True)
+
+    table = read_partition(filesystem, inputs)
+    sort_keys = [(key, "ascending") for key in SORT_KEYS if key in table.column_names]
+    if sort_keys:
+        table = table.sort_by(sort_keys)
+    rows = table.num_rows
+    table = drop_duplicate_rows(table, seen_keys)
+
+    generation = uuid.uuid4().hex
+    staging = f"{staging_path(partition_path)}/{generation}"
+    filesystem.create_dir(staging, recursive=True)
+    outputs = []
+    for index, offset in enumerate(range(0, max(table.num_rows, 1), max_rows_per_file)):
+        staged = f"{staging}/part-{index:05d}.snappy.parquet"
+        pq.write_table(
+            table.slice(offset, max_rows_per_file),
+            staged,
+            filesystem=filesystem,
+            compression="snappy",
+            row_group_size=row_group_size,
+        )
+        target = f"{partition_path}/{COMPACTED_PREFIX}{generation}-{index:05d}.snappy.parquet"
+        outputs.append([staged, target])
+
+    commit(filesystem, staging, {"partition": partition_path, "inputs": inputs, "outputs": outputs})
+
+    LOGGER.info(
+        "Compacted %s: %d files into %d (%d rows, %d duplicates dropped)",
+        partition_path, len(inputs), len(outputs), table.num_rows, rows - table.num_rows,
+    )
+    return CompactionResult(
+        partition_path, len(inputs), len(outputs), table.num_rows, False, rows - table.num_rows
+    )
+
+
+def staging_path(partition_path: str) -> str:
+    """Staging prefix of a partition's compactions, outside every partition location"""
+    root, _, relative = partition_path.partition("/exported_on=")
+    return f"{root}/{STAGING_DIR}/exported_on={relative}"
+
+
+def commit(filesystem, staging: str, manifest: dict) -> None:
+    """Commit the files staged under `staging` by writing their manifest, then publish them"""
+    with filesystem.open_output_stream(f"{staging}/{MANIFEST_NAME}") as stream:
+        stream.write(json.dumps(manifest).encode())
+    publish(filesystem, manifest, staging)
+
+
+def publish(filesystem, manifest: dict, staging: str) -> None:
+    """Swap the inputs of a committed compaction for its compacted files; every step can be
+    repeated, so an interrupted publish is finished by running it again. Between the first copy
+    and the delete of the inputs, readers of the partition see every row twice; the
+    duplicates are gone only once publish completes."""
+    for staged, target in manifest["outputs"]:
+        if filesystem.get_file_info(target).type == pafs.FileType.NotFound:
+            if filesystem.type_name != "s3":
+                filesystem.create_dir(target.rsplit("/", 1)[0], recursive=True)
+            filesystem.copy_file(staged, target)
+    delete_files(filesystem, manifest["inputs"])
+    filesystem.delete_dir(staging)
+
+
+def recover_staged(filesystem, staging_day: str, now: Optional[float] = None) -> int:
+    """Finish the committed compactions staged under `staging_day` and remove the stale
+    uncommitted ones; returns the number of compactions finished"""
+    now = time.time() if now is None else now
+    selector = pafs.FileSelector(staging_day, allow_not_found=True, recursive=True)
+    generations: Dict[str, List] = {}
+    for info in filesystem.get_file_info(selector):
+        if info.type == pafs.FileType.File:
+            generations.setdefault(info.path.rsplit("/", 1)[0], []).append(info)
+    finished = 0
+    for staging, files in generations.items():
+        if any(info.path.endswith(f"/{MANIFEST_NAME}") for info in files):
+            with filesystem.open_input_stream(f"{staging}/{MANIFEST_NAME}") as stream:
+                manifest = json.loads(stream.read())
+            LOGGER.warning("Finishing interrupted compaction of %s", manifest["partition"])
+            publish(filesystem, manifest, staging)
+            finished += 1
+        elif all(now - info.mtime.timestamp() > STALE_STAGING_SECONDS for info in files):
+            LOGGER.warning("Removing uncommitted compaction files under %s", staging)
+            filesystem.delete_dir(staging)
+    return finished
+
+
+def delete_files(filesystem, paths: List[str]) -> None:
+    """Delete `paths`, with as few DeleteObjects calls as possible on S3; missing files are
+    ignored"""
+    if filesystem.type_name != "s3":
+        for path in paths:
+            try:
+                filesystem.delete_file(path)
+            except FileNotFoundError:
+                pass
+        return
+    by_bucket: Dict[str, List[str]] = {}
+    for path in paths:
+        bucket, _, key = path.partition("/")
+        by_bucket.setdefault(bucket, []).append(key)
+    s3 = get_client("s3", cf.REGION)
+    for bucket, keys in by_bucket.items():
+        for offset in range(0, len(keys), MAX_KEYS_PER_DELETE):
+            chunk = keys[offset:offset + MAX_KEYS_PER_DELETE]
+            response = s3.delete_objects(
+                Bucket=bucket, Delete={"Objects": [{"Key": key} for key in chunk], "Quiet": True}
+            )
+            if response.get("Errors"):
+                raise IOError(f"Could not delete {response['Errors']}")
+
+
+def row_keys(table) -> List[Optional[str]]:
+    """Idempotency key of every row; None for rows without a request id"""
+    if not all(column in table.column_names for column in KEYS):
+        return [None] * table.num_rows
+    return [
+        make_key(request_id, event_type)
+        for request_id, event_type in zip(
+            table.column(KEYS[0]).to_pylist(), table.column(KEYS[1]).to_pylist()
+        )
+    ]
+
+
+def drop_duplicate_rows(table, seen_keys: Set[str]):
+    """Keep the first row of every key not in `seen_keys`, adding the keys kept to it"""
+    mask = []
+    for key in row_keys(table):
+        if key is None:
+            mask.append(True)
+        elif key in seen_keys:
+            mask.append(False)
+        else:
+            seen_keys.add(key)
+            mask.append(True)
+    if all(mask):
+        return table
+    return table.filter(pa.array(mask, type=pa.bool_()))
+
+
+def read_partition(filesystem, paths: List[str]):
+    """Read Parquet files whose schemas may differ by missing columns or column types (files
+    written before the table was typed), and concatenate them with the schema types"""
+    tables = [to_schema_types(pq.read_table(path, filesystem=filesystem)) for path in paths]
+    try:
+        return pa.concat_tables(tables, promote_options="permissive")
+    except TypeError:
+        # pyarrow < 14
+        return pa.concat_tables(tables, promote=True)
+
+
+def to_schema_types(table):
+    """`table` with the monitor schema's columns cast to their schema types. Values an Arrow
+    cast cannot convert, such as the ISO-8601 string timestamps of older files, go through the
+    schema's converters instead, so they are parsed rather than dropped"""
+    for index, name in enumerate(table.column_names):
+        type_ = schema.COLUMN_TYPES.get(name)
+        if type_ is None:
+            continue
+        target = _ARROW_TYPES[type_]()
+        column = table.column(index)
+        if column.type == target:
+            continue
+        try:
+            column = pc.cast(column, target)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            convert = schema.column_converter(name)
+            column = pa.array([convert(value) for value in column.to_pylist()], type=target)
+        table = table.set_column(index, name, column)
+    return table
+
+
+def update_partition_stats(result: CompactionResult) -> None:
+    """Record file and row counts on the partition in the Glue catalog with one UpdatePartition
+    call. Partitions resolved through partition projection are not in the catalog and are
+    left alone."""
+    glue = get_client("glue", cf.REGION)
+    values = schema.partition_values_from_path(result.partition)
+    try:
+        partition = glue.get_partition(
+            DatabaseName=cf.MONITOR_DATABASE, TableName=cf.MONITOR_TABLE, PartitionValues=values
+        )["Partition"]
+    except glue.exceptions.EntityNotFoundException:
+        return
+    parameters: Dict[str, str] = dict(partition.get("Parameters", {}))
+    parameters.update(
+        {
+            "numFiles": str(result.output_files),
+            "numRows": str(result.rows),
+            "compacted_at": datetime.now(timezone.utc).isoformat(),
+        }
+    )
+    glue.update_partition(
+        DatabaseName=cf.MONITOR_DATABASE,
+        TableName=cf.MONITOR_TABLE,
+        PartitionValueList=values,
+        PartitionInput={
+            "Values": values,
+            "StorageDescriptor": partition["StorageDescriptor"],
+            "Parameters": parameters,
+        },
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compact monitor table partitions")
+    parser.add_argument("--table-uri", required=True, help="s3://bucket/db/table or local path")
+    parser.add_argument("--day", action="append", help="exported_on value, e.g. 20230701")
+    args = parser.parse_args()
+    for compaction in compact_table(args.table_uri, args.day or closed_days(1)):
+        print(compaction)
@@ -1,4 +1,5 @@
 """Config file"""
+import json
 import os
 ACCOUNT = os.environ.get("ACCOUNT", "123")
 REGION = os.environ.get("REGION", "us-west-2")
@@ -7,3 +8,139 @@ MONITOR_DATABASE = os.environ.get("MONITOR_DATABASE", "monitor")
 MONITOR_TABLE = os.environ.get("MONITOR_TABLE", "monitor")
 
 SECRET_MGR = os.environ.get("MONITORING_NOTIFY_SLACK_WEBHOOK", "datalake-monitoring")
+
+# Secret cache: values are reused for SECRET_TTL_SECONDS, then served stale while refreshing.
+# Forced refreshes (a webhook answering 4xx) fetch at most once per SECRET_MIN_REFRESH_SECONDS
+SECRET_TTL_SECONDS = int(os.environ.get("SECRET_TTL_SECONDS", "300"))
+SECRET_STALE_SECONDS = int(os.environ.get("SECRET_STALE_SECONDS", "3600"))
+SECRET_MIN_REFRESH_SECONDS = int(os.environ.get("SECRET_MIN_REFRESH_SECONDS", "30"))
+
+# Notifications are sent concurrently over pooled keep-alive sessions
+NOTIFY_MAX_WORKERS = int(os.environ.get("NOTIFY_MAX_WORKERS", "8"))
+NOTIFY_TIMEOUT_SECONDS = float(os.environ.get("NOTIFY_TIMEOUT_SECONDS", "5"))
+NOTIFY_MAX_RETRIES = int(os.environ.get("NOTIFY_MAX_RETRIES", "3"))
+# An invocation waits for its notifications until NOTIFY_DEADLINE_SECONDS after it started, and
+# no later than NOTIFY_DEADLINE_MARGIN_SECONDS before the Lambda times out; notifications not
+# sent by then are counted as failed (NotificationsTimedOut) and finish in the background
+NOTIFY_DEADLINE_SECONDS = float(os.environ.get("NOTIFY_DEADLINE_SECONDS", "10"))
+NOTIFY_DEADLINE_MARGIN_SECONDS = float(os.environ.get("NOTIFY_DEADLINE_MARGIN_SECONDS", "1"))
+
+# Notification sinks by name (JSON): {"<name>": {"type": "slack" | "teams" | "pagerduty" |
+# "webhook" | "sns", ...}}. Webhook sinks take a literal "url" or read it (PagerDuty: the routing
+# key) from "secret_key" of the SECRET_MGR secret; "sns" publishes to "topic_arn", e.g. with
+# email subscriptions. Each sink has its own pool and may set max_workers, timeout and
+# max_retries, which default to the NOTIFY_* settings above
+NOTIFY_SINKS = json.loads(
+    os.environ.get("NOTIFY_SINKS", '{"slack": {"type": "slack", "secret_key": "slack_webhook"}}')
+)
+# Routing rules (JSON list), e.g. {"service_name": "prod-*", "severity": "critical", "sinks":
+# ["pagerduty"], "stop": true}, see commons/routing.py; unrouted failures go to the default sinks
+NOTIFY_ROUTES = json.loads(os.environ.get("NOTIFY_ROUTES", "[]"))
+NOTIFY_DEFAULT_SINKS = [
+    name for name in os.environ.get("NOTIFY_DEFAULT_SINKS", "slack").split(",") if name
+]
+# Severity of failures (JSON list), first match: [{"service_name": "prod-*", "severity":
+# "critical"}]; other failures have NOTIFY_DEFAULT_SEVERITY
+NOTIFY_SEVERITIES = json.loads(os.environ.get("NOTIFY_SEVERITIES", "[]"))
+NOTIFY_DEFAULT_SEVERITY = os.environ.get("NOTIFY_DEFAULT_SEVERITY", "error")
+
+# Failures are rolled up into digest messages per service, service name and error. With a
+# window, repeats of an already notified failure are held back and rolled into a later digest
+NOTIFY_DIGEST = os.environ.get("NOTIFY_DIGEST", "true").lower() == "true"
+NOTIFY_DIGEST_WINDOW_SECONDS = float(os.environ.get("NOTIFY_DIGEST_WINDOW_SECONDS", "0"))
+# Held failures are counted per invocation (DigestHeld). When the container shuts down they are
+# sent within DIGEST_SHUTDOWN_SECONDS, and those that could not be are counted (DigestDropped)
+DIGEST_SHUTDOWN_SECONDS = float(os.environ.get("DIGEST_SHUTDOWN_SECONDS", "0.4"))
+
+# Alerts for a service failing with the same error fingerprint are suppressed within the window
+ALERT_DEDUP_WINDOW_SECONDS = float(os.environ.get("ALERT_DEDUP_WINDOW_SECONDS", "0"))
+ALERT_DEDUP_MAX_ENTRIES = int(os.environ.get("ALERT_DEDUP_MAX_ENTRIES", "4096"))
+
+# Compaction of closed days of the monitor table
+COMPACTION_LOOKBACK_DAYS = int(os.environ.get("COMPACTION_LOOKBACK_DAYS", "3"))
+COMPACTION_MAX_ROWS_PER_FILE = int(os.environ.get("COMPACTION_MAX_ROWS_PER_FILE", "1000000"))
+COMPACTION_ROW_GROUP_SIZE = int(os.environ.get("COMPACTION_ROW_GROUP_SIZE", "100000"))
+
+# The monitor table resolves partitions through Athena partition projection, so writes do not
+# need to register partitions in the Glue catalog
+PARTITION_PROJECTION = os.environ.get("PARTITION_PROJECTION", "true").lower() == "true"
+
+# Monitor rows are written with awswrangler (the awswrangler layer), with pyarrow directly or as
+# gzipped newline-delimited JSON with the standard library only; both get a slim layer holding
+# requests for the webhook sinks, and pyarrow for the former. NDJSON rows go to a table of their
+# own, which compaction and the rollups do not read
+WRITER_BACKEND = os.environ.get("WRITER_BACKEND", "awswrangler")
+MONITOR_NDJSON_TABLE = os.environ.get("MONITOR_NDJSON_TABLE", f"{MONITOR_TABLE}_ndjson")
+
+# Lambda failure rows keep the error message, request payload and stack trace cut to this many
+# characters; the originals of cut payloads are stored once under PAYLOAD_OFFLOAD_URI (an s3://
+# prefix or local directory, empty to drop them), named by the SHA-256 of their content
+PAYLOAD_MAX_CHARS = int(os.environ.get("PAYLOAD_MAX_CHARS", "4096"))
+PAYLOAD_OFFLOAD_URI = os.environ.get(
+    "PAYLOAD_OFFLOAD_URI", f"s3://{MONITOR_S3}/{MONITOR_DATABASE}/payloads"
+)
+
+# Column types of an existing monitor table are re-read from the catalog after this long
+CATALOG_TYPES_TTL_SECONDS = int(os.environ.get("CATALOG_TYPES_TTL_SECONDS", "900"))
+
+# Records that can never be processed (not JSON, unknown event, missing fields) are written in
+# bulk to this local JSONL file or s3:// prefix instead of being retried; empty to retry them
+DEAD_LETTER_URI = os.environ.get(
+    "DEAD_LETTER_URI", f"s3://{MONITOR_S3}/{MONITOR_DATABASE}/dead_letter"
+)
+
+# Monitor rows are written once per (service_request_id, event_type). Keys already written are
+# remembered per container; with a table, also across containers in DynamoDB, whose keys are
+# claimed with IDEMPOTENCY_MAX_WORKERS concurrent requests
+IDEMPOTENCY_TABLE = os.environ.get("IDEMPOTENCY_TABLE", "")
+IDEMPOTENCY_CACHE_ENTRIES = int(os.environ.get("IDEMPOTENCY_CACHE_ENTRIES", "16384"))
+IDEMPOTENCY_LEASE_SECONDS = int(os.environ.get("IDEMPOTENCY_LEASE_SECONDS", "900"))
+IDEMPOTENCY_MAX_WORKERS = int(os.environ.get("IDEMPOTENCY_MAX_WORKERS", "10"))
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get("IDEMPOTENCY_TTL_SECONDS", str(7 * 24 * 3600)))
+
+# Glue job and crawler runs are correlated from their start to their completion, which gets a
+# duration and, if an SLA in seconds is set for its service name or type (JSON object, e.g.
+# {"glue_job": 3600, "nightly-load": 900}), an SLA breach flag. Open runs are kept per
+# container, or in a DynamoDB table shared by all containers, for RUN_STATE_TTL_SECONDS
+RUN_STATE_TABLE = os.environ.get("RUN_STATE_TABLE", "")
+RUN_STATE_TTL_SECONDS = int(os.environ.get("RUN_STATE_TTL_SECONDS", str(2 * 24 * 3600)))
+RUN_SLA_SECONDS = json.loads(os.environ.get("RUN_SLA_SECONDS", "{}"))
+
+# With GLUE_ENRICHMENT=true, Glue job rows get the run's attempt, execution time, DPU-seconds
+# and worker settings from GetJobRun(s), at most GLUE_API_RATE calls per second per container
+# (bursts of GLUE_API_BURST). Job definitions are cached for GLUE_JOB_DEFINITION_TTL_SECONDS.
+# Rows are written without run metrics rather than waiting longer than
+# GLUE_API_MAX_WAIT_SECONDS for a call, making a call after GLUE_ENRICHMENT_DEADLINE_SECONDS
+# into the enrichment, or waiting longer than GLUE_API_TIMEOUT_SECONDS for a response
+GLUE_ENRICHMENT = os.environ.get("GLUE_ENRICHMENT", "false").lower() == "true"
+GLUE_API_RATE = float(os.environ.get("GLUE_API_RATE", "5"))
+GLUE_API_BURST = float(os.environ.get("GLUE_API_BURST", "10"))
+GLUE_API_MAX_WAIT_SECONDS = float(os.environ.get("GLUE_API_MAX_WAIT_SECONDS", "2"))
+GLUE_API_TIMEOUT_SECONDS = float(os.environ.get("GLUE_API_TIMEOUT_SECONDS", "2"))
+GLUE_ENRICHMENT_DEADLINE_SECONDS = float(os.environ.get("GLUE_ENRICHMENT_DEADLINE_SECONDS", "5"))
+GLUE_JOB_DEFINITION_TTL_SECONDS = int(os.environ.get("GLUE_JOB_DEFINITION_TTL_SECONDS", "900"))
+
+# Hourly and daily rollup tables of the monitor table, refreshed in micro-batches over the
+# hours written in the last ROLLUP_LOOKBACK_HOURS
+MONITOR_HOURLY_TABLE = os.environ.get("MONITOR_HOURLY_TABLE", f"{MONITOR_TABLE}_hourly")
+MONITOR_DAILY_TABLE = os.environ.get("MONITOR_DAILY_TABLE", f"{MONITOR_TABLE}_daily")
+ROLLUP_LOOKBACK_HOURS = int(os.environ.get("ROLLUP_LOOKBACK_HOURS", "2"))
+
+# Monitoring queries (query.py) run in QUERY_WORKGROUP and reuse Athena results of the same
+# query up to QUERY_REUSE_MAX_AGE_MINUTES old. Their windows end on QUERY_BUCKET_SECONDS
+# boundaries, and results are cached per bucket, also under QUERY_CACHE_DIR if set. Rows are
+# looked for in partitions written up to QUERY_MAX_WRITE_LAG_HOURS after the window
+QUERY_WORKGROUP = os.environ.get("QUERY_WORKGROUP", "primary")
+QUERY_OUTPUT_LOCATION = os.environ.get("QUERY_OUTPUT_LOCATION", "")
+QUERY_REUSE_MAX_AGE_MINUTES = int(os.environ.get("QUERY_REUSE_MAX_AGE_MINUTES", "60"))
+QUERY_BUCKET_SECONDS = int(os.environ.get("QUERY_BUCKET_SECONDS", "300"))
+QUERY_CACHE_DIR = os.environ.get("QUERY_CACHE_DIR", "")
+QUERY_MAX_WRITE_LAG_HOURS = int(os.environ.get("QUERY_MAX_WRITE_LAG_HOURS", "24"))
+
+# Stage timings and counters are logged in CloudWatch Embedded Metric Format for this fraction
+# of invocations; composed items are logged for LOG_SAMPLE_RATE of the records
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "DataLakeMonitoring")
+METRICS_SERVICE = os.environ.get("METRICS_SERVICE", "datalake-monitoring")
+METRICS_SAMPLE_RATE = float(os.environ.get("METRICS_SAMPLE_RATE", "1"))
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "0.01"))
+LOG_MAX_FIELD_CHARS = int(os.environ.get("LOG_MAX_FIELD_CHARS", "512"))
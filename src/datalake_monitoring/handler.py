@@ -1,32 +1,45 @@
 """ Subscriber for SNS to monitor data lake ETLs and persist to Athena """
 
 import logging
+import os
+import signal
+import time
 import traceback
-from datetime import datetime
-from json.decoder import JSONDecodeError
-from typing import Dict
-import requests
+from concurrent.futures import wait
+from datetime import datetime, timezone
+from typing import Dict, Iterable
 
-import boto3
-import os
 import json
-import awswrangler as wr
-import pandas as pd
 
 import config as cf
-from commons.ddb_lambda_item import SUCCESS_ITEM as LAMBDA_SUCCESS_TEMPLATE
-from commons.ddb_lambda_item import FAILURE_ITEM as LAMBDA_FAILURE_TEMPLATE
-
-from commons.ddb_glue_job_item import SUCCESS_ITEM as GLUE_JOB_SUCCESS_TEMPLATE
-from commons.ddb_glue_job_item import FAILURE_ITEM as GLUE_JOB_FAILURE_TEMPLATE
-
-from commons.ddb_glue_crawler_item import SUCCESS_ITEM as GLUE_CRAWLER_SUCCESS_TEMPLATE
-from commons.ddb_glue_crawler_item import FAILURE_ITEM as GLUE_CRAWLER_FAILURE_TEMPLATE
-
-from commons.utils import get_lambda_name_from_arn, get_secret
-
-from functools import reduce
-from operator import getitem
+import monitor_schema as schema
+from commons.event_registry import (
+    EVENT_TYPE_FAIL,
+    EVENT_TYPE_STARTED,
+    EVENT_TYPE_SUCCESS,
+    classify_event,
+)
+from commons.envelopes import is_sqs_event, record_id, unwrap_record
+from commons.idempotency import DynamoDBIdempotencyStore, IdempotencyGuard
+from commons.dead_letter import DeadLetter, dead_letter_sink, is_permanent_error, reading_message
+from commons.utils import get_secret
+from commons.aws_clients import get_client, get_session
+from commons.secret_cache import SecretCache
+from commons.notifier import Notifier, gather, make_sink
+from commons.routing import Router
+from commons.digest import DigestCoalescer
+from commons.fingerprint import AlertDedup, error_fingerprint
+from commons.lazy_import import lazy_import
+from commons.json_codec import loads as json_loads
+from commons.metrics import BYTES, MILLISECONDS, InvocationMetrics, SampledLogger
+from commons.writers import BACKEND_NDJSON, GluePartitions, make_writer
+from commons.runs import DynamoDBRunStore, InMemoryRunStore, RunCorrelator, run_event
+from commons.job_runs import JobRunEnricher, TokenBucket
+from commons.payloads import PayloadSlimmer, looks_like_json
+
+# Heavy modules are only imported when first used, keeping cold starts short
+wr = lazy_import("awswrangler")
+pd = lazy_import("pandas")
 
 FAILURE_RESPONSE = {
     "statusCode": 400,
@@ -37,17 +50,188 @@ SUCCESS_RESPONSE = {
     "body": json.dumps("SUCCESS: Data lake event persisted to Athena"),
 }
 
-EVENT_TYPE_SUCCESS = "succeeded"
-EVENT_TYPE_FAIL = "failed"
+# Stage timings and counters of the current invocation, emitted as one EMF log line
+METRICS = InvocationMetrics(
+    cf.METRICS_NAMESPACE, {"Service": cf.METRICS_SERVICE}, sample_rate=cf.METRICS_SAMPLE_RATE
+)
+
+
+def fetch_secret(secret_id: str) -> dict:
+    """Secrets Manager fetch behind the secret cache"""
+    start = METRICS.now()
+    try:
+        return get_secret(secret_id, region_name=cf.REGION)
+    finally:
+        METRICS.add_time("SecretFetch", start)
+        METRICS.add("SecretFetches", 1)
+
+
+# Lives as long as the container, so warm invocations make no Secrets Manager calls
+SECRET_CACHE = SecretCache(
+    fetch=fetch_secret,
+    ttl_seconds=cf.SECRET_TTL_SECONDS,
+    stale_seconds=cf.SECRET_STALE_SECONDS,
+    min_refresh_seconds=cf.SECRET_MIN_REFRESH_SECONDS,
+)
+
+# Sinks keep their HTTP connections and worker threads alive across warm invocations
+NOTIFIER = Notifier(
+    sinks={
+        name: make_sink(
+            name,
+            spec,
+            secret=lambda key, force_refresh: SECRET_CACHE.get(
+                cf.SECRET_MGR, force_refresh=force_refresh
+            )[key],
+            region_name=cf.REGION,
+            defaults={
+                "max_workers": cf.NOTIFY_MAX_WORKERS,
+                "timeout": cf.NOTIFY_TIMEOUT_SECONDS,
+                "max_retries": cf.NOTIFY_MAX_RETRIES,
+            },
+        )
+        for name, spec in cf.NOTIFY_SINKS.items()
+    },
+    router=Router(
+        cf.NOTIFY_ROUTES,
+        default_sinks=cf.NOTIFY_DEFAULT_SINKS,
+        severities=cf.NOTIFY_SEVERITIES,
+        default_severity=cf.NOTIFY_DEFAULT_SEVERITY,
+    ),
+)
+DIGEST = (
+    DigestCoalescer(window_seconds=cf.NOTIFY_DIGEST_WINDOW_SECONDS) if cf.NOTIFY_DIGEST else None
+)
+
+
+def flush_digest_on_shutdown(signum, frame) -> None:
+    """Send the failures the digest still holds when the container shuts down, within
+    DIGEST_SHUTDOWN_SECONDS, and emit the number that could not be sent as DigestDropped.
+    Lambda signals the shutdown with SIGTERM to functions with an extension registered."""
+    METRICS.reset()
+    drained = DIGEST.drain()
+    futures = [(NOTIFIER.submit(message), count) for message, count in drained]
+    wait([future for sent, _ in futures for future in sent], timeout=cf.DIGEST_SHUTDOWN_SECONDS)
+    dropped = sum(
+        count
+        for sent, count in futures
+        if not all(future.done() and future.result().ok for future in sent)
+    )
+    METRICS.add("DigestFlushed", sum(count for _, count in drained) - dropped)
+    METRICS.add("DigestDropped", dropped)
+    METRICS.emit()
+    # Then terminate as the default handler would
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    os.kill(os.getpid(), signal.SIGTERM)
+
+
+if DIGEST is not None and DIGEST.window_seconds > 0:
+    signal.signal(signal.SIGTERM, flush_digest_on_shutdown)
+
+# Recently alerted (service, error fingerprint) pairs; repeats within the window are not sent
+ALERT_DEDUP = (
+    AlertDedup(cf.ALERT_DEDUP_WINDOW_SECONDS, max_entries=cf.ALERT_DEDUP_MAX_ENTRIES)
+    if cf.ALERT_DEDUP_WINDOW_SECONDS > 0
+    else None
+)
+# Records that can never be processed are written here in bulk instead of being retried
+DEAD_LETTER_SINK = dead_letter_sink(cf.DEAD_LETTER_URI, region_name=cf.REGION)
+
+# Drops rows of events that were already written, e.g. by a retried invocation
+IDEMPOTENCY = IdempotencyGuard(
+    store=DynamoDBIdempotencyStore(
+        cf.IDEMPOTENCY_TABLE,
+        lease_seconds=cf.IDEMPOTENCY_LEASE_SECONDS,
+        ttl_seconds=cf.IDEMPOTENCY_TTL_SECONDS,
+        region_name=cf.REGION,
+        max_workers=cf.IDEMPOTENCY_MAX_WORKERS,
+    )
+    if cf.IDEMPOTENCY_TABLE
+    else None,
+    max_entries=cf.IDEMPOTENCY_CACHE_ENTRIES,
+)
+
+# Writes the monitor rows with pyarrow or as NDJSON; None when awswrangler writes them
+WRITER_TABLE = (
+    cf.MONITOR_NDJSON_TABLE if cf.WRITER_BACKEND == BACKEND_NDJSON else cf.MONITOR_TABLE
+)
+WRITER = make_writer(
+    cf.WRITER_BACKEND,
+    schema.table_location(cf.MONITOR_S3, cf.MONITOR_DATABASE, WRITER_TABLE),
+    partitions=None
+    if cf.PARTITION_PROJECTION
+    else GluePartitions(
+        cf.MONITOR_DATABASE, WRITER_TABLE, client=lambda: get_client("glue", cf.REGION)
+    ),
+    region_name=cf.REGION,
+)
+
+# Open Glue job and crawler runs, closed by their completion with a duration
+RUNS = RunCorrelator(
+    store=DynamoDBRunStore(
+        cf.RUN_STATE_TABLE, ttl_seconds=cf.RUN_STATE_TTL_SECONDS, region_name=cf.REGION
+    )
+    if cf.RUN_STATE_TABLE
+    else InMemoryRunStore(ttl_seconds=cf.RUN_STATE_TTL_SECONDS),
+    sla_seconds=cf.RUN_SLA_SECONDS,
+)
+
+# Bounds the payload columns of Lambda failure rows; cut originals are offloaded by content hash
+PAYLOADS = PayloadSlimmer(
+    cf.PAYLOAD_MAX_CHARS, offload_uri=cf.PAYLOAD_OFFLOAD_URI or None, region_name=cf.REGION
+)
+
+# Run metrics of Glue job rows, off unless enabled; cached job definitions and the Glue API
+# rate limit are shared by warm invocations
+JOB_RUNS = (
+    JobRunEnricher(
+        client=lambda: get_client("glue", cf.REGION, cf.GLUE_API_TIMEOUT_SECONDS),
+        rate_limiter=TokenBucket(cf.GLUE_API_RATE, cf.GLUE_API_BURST),
+        definition_ttl_seconds=cf.GLUE_JOB_DEFINITION_TTL_SECONDS,
+        max_wait_seconds=cf.GLUE_API_MAX_WAIT_SECONDS,
+        deadline_seconds=cf.GLUE_ENRICHMENT_DEADLINE_SECONDS,
+    )
+    if cf.GLUE_ENRICHMENT
+    else None
+)
+
+RECORD_PERSISTED = "persisted"
+RECORD_DUPLICATE = "duplicate"
+RECORD_DEAD_LETTERED = "dead_lettered"
+RECORD_FAILED = "failed"
+RECORD_RUN_STARTED = "run_started"
+
+
+_CATALOG_TYPES = {"fetched_at": 0.0, "types": {}}
+
+
+def catalog_column_types() -> Dict[str, str]:
+    """Column types of the monitor table in the Glue catalog, re-read every
+    CATALOG_TYPES_TTL_SECONDS; empty when the table cannot be read"""
+    now = time.monotonic()
+    fetched_at = _CATALOG_TYPES["fetched_at"]
+    if not fetched_at or now - fetched_at > cf.CATALOG_TYPES_TTL_SECONDS:
+        try:
+            table = get_client("glue", cf.REGION).get_table(
+                DatabaseName=cf.MONITOR_DATABASE, Name=WRITER_TABLE
+            )["Table"]
+            columns = table["StorageDescriptor"]["Columns"] + table.get("PartitionKeys", [])
+            _CATALOG_TYPES["types"] = {column["Name"]: column["Type"] for column in columns}
+        except Exception:
+            logging.getLogger().warning(f"Could not read catalog types: {traceback.format_exc()}")
+            _CATALOG_TYPES["types"] = {}
+        _CATALOG_TYPES["fetched_at"] = now
+    return _CATALOG_TYPES["types"]
 
 
 def handler(event, context):
     """Handler that takes data from SNS,
     computes the item based on the event message and persists to Athena"""
+    METRICS.reset()
+    start = METRICS.now()
     try:
         log = logging.getLogger()
         log.setLevel(logging.INFO)
-        log.info(event)
         ps = ProcessEvent(event=event, context=context, cf=cf, log=log)
         return ps.execute()
 
@@ -55,6 +239,10 @@ def handler(event, context):
         print(traceback.format_exc())
         return FAILURE_RESPONSE
 
+    finally:
+        METRICS.add_time("Invocation", start)
+        METRICS.emit()
+
 class ProcessEvent(object):
     def __init__(self, event, context, cf, log):
         self.log = log
@@ -62,146 +250,375 @@ class ProcessEvent(object):
         self.context = context
         self.cf = cf
         self.item = {}
+        self.items = []
         self.region = cf.REGION
-        self.item_template = ""
+        self.item_template = {}
+        self.event_class = None
         self.body = {}
-
-        self.message = {
-            "service": "",
-            "service_name": "",
-            "service_id": "",
-            "exception_details": "",
-            "time_stamp": "",
-        }
-        self.slack_webhook = get_secret(cf.SECRET_MGR)["slack_webhook"]
+        self.notifications = []
+        self.notification_outcomes = []
+        self.started_at = time.monotonic()
+        self.is_sqs = is_sqs_event(event)
+        self.record_ids = []
+        self.failed_record_ids = []
+        self.duplicate_record_ids = []
+        self.dead_letters = []
+        self.run_starts = []
+        self.run_start_ids = []
+        self.offloads = {}
+        self.item_log = SampledLogger(log, cf.LOG_SAMPLE_RATE, cf.LOG_MAX_FIELD_CHARS)
 
     def execute(self) -> dict:
         """The driver program that orchestrates processing and storing events"""
         try:
             self.log.info(
-                f"Processing event messages from SNS with batch size of {len(self.event['Records'])}"
+                f"Processing event messages from {'SQS' if self.is_sqs else 'SNS'} "
+                f"with batch size of {len(self.event['Records'])}"
             )
-            boto3.setup_default_session(profile_name=os.getenv("AWS_PROFILE"))
-
-            for record in self.event["Records"]:
-                self.body = json.loads(record["Sns"]["Message"])
-                self.identify_event_source()
-                self.get_item_template()
-                self.generic_compose_item()
-
-                if self.item["event_type"] not in ("success", "succeeded"):
-                    self.add_remedy_details()
-
-                from pprint import pprint as pp
-                pp(self.item)
-                self.put_item_athena()
 
-                # Notify
-                if self.item["event_type"].lower() == "failed":
-                    self.notify()
+            # A failing record never aborts the batch: records that can never succeed are
+            # dead-lettered, the others are retried on their own
+            for index, record in enumerate(self.event["Records"]):
+                message_id = record_id(record, index)
+                try:
+                    self.process_record(record, message_id)
+                except Exception as exc:
+                    self.item = {}
+                    if is_permanent_error(exc):
+                        self.log.warning(f"Dead-lettering record {message_id}: {exc!r}")
+                        self.dead_letters.append(DeadLetter.from_exception(message_id, record, exc))
+                    else:
+                        self.log.error(traceback.format_exc())
+                        self.failed_record_ids.append(message_id)
+
+            # Persist the whole batch at once; if that fails every record is retried
+            try:
+                self.persist_items()
+            except Exception:
+                self.log.error(traceback.format_exc())
+                self.failed_record_ids.extend(self.record_ids)
+
+            start = METRICS.now()
+            self.flush_notifications()
+            METRICS.add_time("Notify", start)
+
+            start = METRICS.now()
+            self.put_dead_letters()
+            METRICS.add_time("DeadLetter", start)
+
+            start = METRICS.now()
+            self.notification_outcomes = gather(
+                self.notifications, timeout=self.notification_wait_seconds()
+            )
+            METRICS.add_time("NotifyWait", start)
+            self.record_notification_metrics()
+            failed = [outcome for outcome in self.notification_outcomes if not outcome.ok]
+            if failed:
+                self.log.warning(
+                    f"{len(failed)} of {len(self.notification_outcomes)} notifications failed, "
+                    f"sinks {sorted({outcome.sink for outcome in failed})}: {failed}"
+                )
+            self.log.info(f"Secret cache stats: {SECRET_CACHE.stats()}")
+
+            response = self.response()
+            self.record_batch_metrics(response["records"])
+            return response
 
-                self.item.clear()
+        except Exception:
+            self.log.error(traceback.format_exc())
+            if self.is_sqs:
+                return self.batch_response(
+                    record_id(record, index) for index, record in enumerate(self.event["Records"])
+                )
+            return FAILURE_RESPONSE
 
-            return SUCCESS_RESPONSE
+    def process_record(self, record: dict, message_id: str) -> None:
+        """Compose the item of a single record"""
+        start = METRICS.now()
+        with reading_message("Decode"):
+            _, self.body = unwrap_record(record)
+        METRICS.add_time("Decode", start)
+
+        start = METRICS.now()
+        with reading_message("Classify"):
+            self.identify_event_source()
+        self.get_item_template()
+        METRICS.add_time("Classify", start)
+
+        start = METRICS.now()
+        with reading_message("Extract"):
+            self.generic_compose_item()
+        if self.item["event_type"] not in (EVENT_TYPE_SUCCESS, EVENT_TYPE_STARTED):
+            self.add_remedy_details()
+        schema.coerce_item(self.item)
+        METRICS.add_time("Compose", start)
+
+        # A run start only opens the run; its completion is what gets a monitor row
+        if self.item["event_type"] == EVENT_TYPE_STARTED:
+            event = run_event(self.item)
+            if event is not None:
+                self.run_starts.append(event)
+            self.run_start_ids.append(message_id)
+            self.item = {}
+            return
+
+        self.item_log.info("Composed item", record_id=message_id, **self.item)
+        self.items.append(self.item)
+        self.record_ids.append(message_id)
+        self.item = {}
 
+    def correlate_runs(self) -> None:
+        """Record the run starts of the batch and add durations and SLA breaches to the items
+        completing a run"""
+        stats = RUNS.annotate(self.items, self.run_starts)
+        for name, metric in (
+            ("timed", "RunsTimed"),
+            ("sla_breaches", "RunSlaBreaches"),
+            ("late_starts", "RunLateStarts"),
+            ("unmatched", "RunsUnmatched"),
+        ):
+            METRICS.add(metric, stats[name])
+
+    def enrich_job_runs(self) -> None:
+        """Add the run metrics of their job runs to the Glue job items"""
+        stats = JOB_RUNS.enrich(self.items)
+        for name, metric in (
+            ("enriched", "JobRunsEnriched"),
+            ("not_found", "JobRunsNotFound"),
+            ("rate_limited", "JobRunsRateLimited"),
+            ("deadline_exceeded", "JobRunsDeadlineExceeded"),
+            ("errors", "JobRunLookupErrors"),
+            ("api_calls", "GlueApiCalls"),
+            ("definition_hits", "JobDefinitionCacheHits"),
+        ):
+            METRICS.add(metric, stats[name])
+        if stats["throttle_ms"]:
+            METRICS.add("GlueRateLimitWait", stats["throttle_ms"], MILLISECONDS)
+
+    def persist_items(self) -> None:
+        """Write the rows of events not written before and alert their failures; their
+        idempotency keys are committed once the write succeeded and released if it failed,
+        so the retry writes them"""
+        start = METRICS.now()
+        keep, keys, in_flight = IDEMPOTENCY.admit(self.items)
+        METRICS.add_time("Dedup", start)
+        kept = set(keep)
+        # Another invocation holds the keys of these records; retry them in case it fails
+        in_flight_ids = [self.record_ids[index] for index in in_flight]
+        if in_flight_ids:
+            self.log.info(f"Retrying records being persisted by another invocation {in_flight_ids}")
+            self.failed_record_ids.extend(in_flight_ids)
+        skipped = kept.union(in_flight)
+        self.duplicate_record_ids = [
+            message_id
+            for index, message_id in enumerate(self.record_ids)
+            if index not in skipped
+        ]
+        if self.duplicate_record_ids:
+            self.log.info(f"Skipping already persisted records {self.duplicate_record_ids}")
+        self.items = [self.items[index] for index in keep]
+
+        # Only the failures admitted above are alerted, so a redelivered record does not alert
+        # again. The alerts go out in the background while the batch is written; if the write
+        # fails the retry alerts again, so alerts are at least once.
+        start = METRICS.now()
+        for item in self.items:
+            if item["event_type"] == EVENT_TYPE_FAIL:
+                self.notify(item)
+        METRICS.add_time("Notify", start)
+
+        # Durations of the runs completed in this batch; without them the rows are still
+        # written, but the starts are retried so that later completions find them
+        start = METRICS.now()
+        try:
+            self.correlate_runs()
         except Exception:
             self.log.error(traceback.format_exc())
-            return FAILURE_RESPONSE
+            self.failed_record_ids.extend(self.run_start_ids)
+        finally:
+            METRICS.add_time("Correlate", start)
+
+        # Run metrics are best effort: rows are written without them if Glue cannot be read
+        if JOB_RUNS is not None:
+            start = METRICS.now()
+            try:
+                self.enrich_job_runs()
+            except Exception:
+                self.log.warning(f"Could not enrich Glue job rows: {traceback.format_exc()}")
+            finally:
+                METRICS.add_time("Enrich", start)
+
+        start = METRICS.now()
+        try:
+            self.store_payloads()
+            self.put_items_athena()
+        except Exception:
+            IDEMPOTENCY.release(keys)
+            raise
+        finally:
+            METRICS.add_time("Write", start)
+        IDEMPOTENCY.commit(keys)
+
+    def store_payloads(self) -> None:
+        """Offload the original payloads the rows to be written refer to, before the rows"""
+        refs = {item["payload_ref"] for item in self.items if item.get("payload_ref")}
+        if not refs:
+            return
+        offloads = [self.offloads[ref] for ref in refs]
+        start = METRICS.now()
+        written = PAYLOADS.store(offloads)
+        METRICS.add_time("Offload", start)
+        METRICS.add("PayloadsOffloaded", written)
+        METRICS.add("PayloadOffloadBytes", sum(len(offload.data) for offload in offloads), BYTES)
+
+    def notification_wait_seconds(self) -> float:
+        """Seconds left until the notification deadline of this invocation"""
+        wait_seconds = self.cf.NOTIFY_DEADLINE_SECONDS - (time.monotonic() - self.started_at)
+        remaining_ms = getattr(self.context, "get_remaining_time_in_millis", None)
+        if remaining_ms is not None:
+            lambda_seconds = remaining_ms() / 1000 - self.cf.NOTIFY_DEADLINE_MARGIN_SECONDS
+            wait_seconds = min(wait_seconds, lambda_seconds)
+        return max(0.0, wait_seconds)
+
+    def record_notification_metrics(self) -> None:
+        """Count the notifications sent, failed and timed out, and keep the latency of those
+        that completed"""
+        METRICS.add("Notifications", len(self.notification_outcomes))
+        METRICS.add(
+            "NotificationsFailed", sum(not outcome.ok for outcome in self.notification_outcomes)
+        )
+        METRICS.add(
+            "NotificationsTimedOut",
+            sum(outcome.timed_out for outcome in self.notification_outcomes),
+        )
+        for outcome in self.notification_outcomes:
+            if not outcome.timed_out:
+                METRICS.observe(
+                    "NotificationLatency", outcome.elapsed_seconds * 1000, MILLISECONDS
+                )
+
+    @staticmethod
+    def record_batch_metrics(statuses: list) -> None:
+        """Count the records of the batch by outcome"""
+        METRICS.add("Records", len(statuses))
+        for status, metric in (
+            (RECORD_FAILED, "RecordsFailed"),
+            (RECORD_DEAD_LETTERED, "RecordsDeadLettered"),
+            (RECORD_DUPLICATE, "RecordsDuplicate"),
+        ):
+            METRICS.add(metric, sum(record["status"] == status for record in statuses))
+
+    def put_dead_letters(self) -> None:
+        """Write this invocation's dead letters in one go. Without a sink, or if the write
+        fails, the records are retried instead so they still reach the queue's DLQ"""
+        if not self.dead_letters:
+            return
+        dead_letter_ids = [letter.record_id for letter in self.dead_letters]
+        if DEAD_LETTER_SINK is None:
+            self.log.error(f"No dead-letter sink configured, retrying records {dead_letter_ids}")
+            self.failed_record_ids.extend(dead_letter_ids)
+            return
+        try:
+            location = DEAD_LETTER_SINK.write(self.dead_letters)
+            self.log.warning(f"Dead-lettered {len(self.dead_letters)} records to {location}")
+        except Exception:
+            self.log.error(traceback.format_exc())
+            self.failed_record_ids.extend(dead_letter_ids)
+
+    def record_statuses(self) -> list:
+        """Outcome of every record of the batch, in order"""
+        failed = set(self.failed_record_ids)
+        dead_lettered = {letter.record_id for letter in self.dead_letters}
+        duplicates = set(self.duplicate_record_ids)
+        run_started = set(self.run_start_ids)
+        statuses = []
+        for index, record in enumerate(self.event["Records"]):
+            message_id = record_id(record, index)
+            if message_id in failed:
+                status = RECORD_FAILED
+            elif message_id in dead_lettered:
+                status = RECORD_DEAD_LETTERED
+            elif message_id in duplicates:
+                status = RECORD_DUPLICATE
+            elif message_id in run_started:
+                status = RECORD_RUN_STARTED
+            else:
+                status = RECORD_PERSISTED
+            statuses.append({"id": message_id, "status": status})
+        return statuses
+
+    def response(self) -> dict:
+        """SQS batches report only the failed records for retry; SNS invocations report
+        failure if any record failed. Both carry the status of every record."""
+        if self.is_sqs:
+            response = self.batch_response(self.failed_record_ids)
+        else:
+            response = FAILURE_RESPONSE if self.failed_record_ids else SUCCESS_RESPONSE
+        return {**response, "records": self.record_statuses()}
+
+    @staticmethod
+    def batch_response(failed_ids) -> dict:
+        """Partial batch response for the SQS event source mapping"""
+        failures = [{"itemIdentifier": message_id} for message_id in dict.fromkeys(failed_ids)]
+        response = FAILURE_RESPONSE if failures else SUCCESS_RESPONSE
+        return {**response, "batchItemFailures": failures}
 
-    def compose_message(self):
+    def compose_message(self, item: dict) -> dict:
         """Compose the message"""
-        self.message["service"] = self.item["service_type"]
-        self.message["service_name"] = self.item["service_name"]
-        self.message["time_stamp"] = self.item["timestamp"]
-        self.message["service_id"] = self.item["service_request_id"]
+        if "exception_details" in item:
+            exception_details = item["exception_details"]
+        else:
+            exception_details = item["error_message"]
+        timestamp = item["timestamp"]
+        if isinstance(timestamp, datetime):
+            timestamp = f"{timestamp.isoformat()}Z"
+        return {
+            "service": item["service_type"],
+            "service_name": item["service_name"],
+            "service_id": item["service_request_id"],
+            "exception_details": exception_details,
+            "time_stamp": timestamp,
+            "severity": NOTIFIER.router.severity(item["service_type"], item["service_name"]),
+        }
 
-        if "exception_details" in self.item:
-            exception_details = self.item["exception_details"]
+    def send_notification(self, message: dict) -> list:
+        """Send message to its sinks and wait for them"""
+        return NOTIFIER.send(message)
+
+    def notify(self, item: dict):
+        """Queue the notifications of a failed item, or add it to the digest"""
+        if ALERT_DEDUP is not None:
+            key = f"{item['service_type']}:{item['service_name']}:{item.get('error_fingerprint')}"
+            if not ALERT_DEDUP.should_alert(key):
+                return
+        message = self.compose_message(item)
+        if DIGEST is None:
+            self.notifications.extend(NOTIFIER.submit(message))
         else:
-            exception_details = self.item["error_message"]
-        self.message["exception_details"] = exception_details
-
-    def notify_slack(self) -> int:
-        """Send message to Slack channel"""
-        r = requests.post(
-            url=self.slack_webhook,
-            data=json.dumps(self.message),
-            headers={"Content-Type": "application/json"},
-            timeout=5
-        )
-        return r.status_code
+            DIGEST.add(message)
 
-    def notify(self):
-        self.compose_message()
-        self.notify_slack()
+    def flush_notifications(self):
+        """Send the digest messages that are due. Failures still held for a later digest are
+        counted, as they are lost if the container is recycled before then"""
+        if DIGEST is not None:
+            for message in DIGEST.flush():
+                self.notifications.extend(NOTIFIER.submit(message))
+            if DIGEST.window_seconds > 0:
+                METRICS.add("DigestHeld", DIGEST.held())
 
     def identify_event_source(self) -> None:
         """Identify source (lambda, glue_job, etc.) and event type (failure, success, etc.)"""
-        # Lambda
-        try:
-            if self.body["requestContext"]["functionArn"].find("lambda") != -1:
-                self.item["service_type"] = "lambda"
-                if self.body["requestContext"]["condition"].lower() == "success":
-                    self.item["event_type"] = EVENT_TYPE_SUCCESS
-                else:
-                    self.item["event_type"] = EVENT_TYPE_FAIL
-        except KeyError:
-            pass
-
-        # Glue Job
-        try:
-            if self.body["detail-type"].lower().find("glue job") != -1:
-                self.item["service_type"] = "glue_job"
-                self.item["event_type"] = self.body["detail"]["state"].lower()
-        except KeyError:
-            pass
-
-        # Glue Crawler Job
-        try:
-            if self.body["detail-type"].lower().find("glue crawler") != -1:
-                self.item["service_type"] = "glue_crawler"
-                self.item["event_type"] = self.body["detail"]["state"].lower()
-        except KeyError:
-            pass
-
-        try:
-            if self.item["service_type"] == "" or self.item["event_type"] == "":
-                raise Exception(f"Invalid SNS Event message : {self.body}")
-        except KeyError:
-            raise Exception(f"Invalid SNS Event message : {self.body}")
+        self.event_class = classify_event(self.body)
+        self.item["service_type"] = self.event_class.service_type
+        self.item["event_type"] = self.event_class.event_type
 
     def get_item_template(self) -> None:
         """Get the item template based on service_type and event_type"""
-        job_succeeded = self.item["event_type"].lower() == EVENT_TYPE_SUCCESS
-        is_lambda = self.item["service_type"].lower() == "lambda"
-        is_glue_job = self.item["service_type"].lower() == "glue_job"
-        is_glue_crawler_job = self.item["service_type"].lower() == "glue_crawler"
-
-        if is_lambda and job_succeeded:
-            self.item_template = LAMBDA_SUCCESS_TEMPLATE
-        elif is_lambda and not job_succeeded:
-            self.item_template = LAMBDA_FAILURE_TEMPLATE
-        elif is_glue_job and not job_succeeded:
-            self.item_template = GLUE_JOB_FAILURE_TEMPLATE
-        elif is_glue_job and job_succeeded:
-            self.item_template = GLUE_JOB_SUCCESS_TEMPLATE
-        elif is_glue_crawler_job and not job_succeeded:
-            self.item_template = GLUE_CRAWLER_SUCCESS_TEMPLATE
-        elif is_glue_crawler_job and job_succeeded:
-            self.item_template = GLUE_CRAWLER_FAILURE_TEMPLATE
+        self.item_template = self.event_class.template
 
     def generic_compose_item(self) -> None:
         """Compose the common 5 attributes generic to any item"""
-        for kk in self.item_template:
-            if len(self.item_template[kk]) > 0:
-                if self.item["service_type"] in ("glue_job", "glue_crawler"):
-                    self.item[kk] = reduce(getitem, self.item_template[kk], self.body)
-                elif self.item["service_type"] == "lambda":
-                    if kk.lower() == "service_name":
-                        self.item[kk] = get_lambda_name_from_arn(
-                            self.body["requestContext"]["functionArn"]
-                        )
-                    self.item[kk] = reduce(getitem, self.item_template[kk], self.body)
+        self.event_class.extract(self.body, self.item)
 
     def add_remedy_details(self) -> None:
         """Add Remedy details for event_type that has not executed"""
@@ -211,50 +628,96 @@ class ProcessEvent(object):
             self.compose_item_glue_job_failure()
         if self.item["service_type"] == "glue_crawler":
             self.compose_item_glue_crawler_failure()
+        self.item["error_fingerprint"] = error_fingerprint(
+            str(self.item.get("exception_details", self.item.get("error_message", "")))
+        )
 
     def compose_item_lambda_failure(self) -> None:
-        """Add remedy attributes to the item for Lambda failure event"""
-        self.item["error_message"] = self.body["responsePayload"]["errorMessage"]
-        try:
-            self.item["exception_details"] = json.loads(
-                self.body["responsePayload"]["errorMessage"]
-            )["Exception"]["error_message"]
-        except JSONDecodeError:
-            self.item["exception_details"] = self.body["responsePayload"]["stackTrace"][0]
+        """Add remedy attributes to the item for Lambda failure event. The error message is
+        parsed only when it looks like JSON; the error message, request payload and stack
+        trace are kept as bounded columns"""
+        with reading_message("Extract"):
+            response = self.body["responsePayload"]
+            error_message = response["errorMessage"]
+            stack_trace = response.get("stackTrace")
+        exception_details = None
+        if looks_like_json(error_message):
+            try:
+                exception_details = json_loads(error_message)["Exception"]["error_message"]
+            except (ValueError, KeyError, TypeError):
+                pass
+        if exception_details is None:
+            exception_details = stack_trace[0] if stack_trace else error_message
+
+        slim = PAYLOADS.slim(error_message, self.body.get("requestPayload"), stack_trace)
+        self.item.update(slim.columns())
+        self.item["exception_details"] = PAYLOADS.truncate(exception_details)
+        if slim.offload is not None:
+            self.offloads[slim.offload.uri] = slim.offload
 
     def compose_item_glue_job_failure(self) -> None:
         """Add remedy attributes to the item for Glue Job failure"""
-        self.item["error_message"] = self.body["detail"]["message"]
-        self.item["service_run_id"] = self.body["detail"]["jobRunId"]
+        with reading_message("Extract"):
+            self.item["error_message"] = self.body["detail"]["message"]
 
     def compose_item_glue_crawler_failure(self) -> None:
         """Add crawler error message reported"""
-        self.item["error_message"] = self.body["detail"]["errorMessage"]
-
-    def get_athena_types(self, df: pd.DataFrame) -> Dict[str, str]:
-        """Assigns Glue data types for data from panda dataframe """
-        return {
-            col.lower(): "string"
-            for col, _ in df.dtypes.items()
-        }
-
-    def put_item_athena(self) -> None:
-        """put_item to s3 and create Athena table"""
-        export_date = datetime.today().strftime("%Y%m%d")
-        table_s3_path = f"s3://{self.cf.MONITOR_S3}/{self.cf.MONITOR_DATABASE}/{self.cf.MONITOR_TABLE}"
-        item_df = pd.DataFrame(self.item, index=[0])
-        item_df["exported_on"] = export_date
-        table_partition = ["exported_on"]
-        column_types = self.get_athena_types(item_df)
-        wr.s3.to_parquet(
-            df=item_df,
+        with reading_message("Extract"):
+            self.item["error_message"] = self.body["detail"]["errorMessage"]
+
+    def get_athena_types(self, columns: Iterable[str]) -> Dict[str, str]:
+        """Assigns Glue data types to the item columns, keeping the types of an existing
+        catalog table that has not been migrated to the schema yet"""
+        return schema.reconcile_types(schema.column_types(columns), catalog_column_types())
+
+    def put_items_athena(self) -> None:
+        """Persist all items composed in this invocation with a single dataset write: one file
+        per partition. With partition projection no catalog calls are needed at all."""
+        if not self.items:
+            return
+        if WRITER is None:
+            self.put_items_wrangler()
+            return
+        columns = list(dict.fromkeys(column for item in self.items for column in item))
+        METRICS.add("RowsWritten", len(self.items))
+        result = WRITER.write(
+            self.items, self.get_athena_types(columns), datetime.now(timezone.utc)
+        )
+        METRICS.add("BytesWritten", result.bytes_written, BYTES)
+        METRICS.add("FilesWritten", len(result.paths))
+        if result.partitions_registered:
+            METRICS.add("PartitionsRegistered", result.partitions_registered)
+
+    def put_items_wrangler(self) -> None:
+        """Dataset write with awswrangler, from a pandas DataFrame of the items"""
+        table_s3_path = schema.table_location(
+            self.cf.MONITOR_S3, self.cf.MONITOR_DATABASE, self.cf.MONITOR_TABLE
+        )
+        items_df = pd.DataFrame.from_records(self.items)
+        for partition, value in schema.write_partition_values(datetime.now(timezone.utc)).items():
+            items_df[partition] = value
+        catalog = (
+            {}
+            if self.cf.PARTITION_PROJECTION
+            else {"table": self.cf.MONITOR_TABLE, "database": self.cf.MONITOR_DATABASE}
+        )
+        METRICS.add("RowsWritten", len(items_df))
+        # In-memory size of the rows handed to the writer; the Parquet files are smaller
+        METRICS.add("RowBytes", int(items_df.memory_usage(deep=True).sum()), BYTES)
+        result = wr.s3.to_parquet(
+            df=items_df,
             path=table_s3_path,
             dataset=True,
-            table=self.cf.MONITOR_TABLE,
-            database=self.cf.MONITOR_DATABASE,
-            partition_cols=table_partition,
-            dtype=column_types,
+            partition_cols=list(schema.PARTITION_COLUMNS),
+            dtype=self.get_athena_types(items_df.columns),
             compression="snappy",
             mode="append",
+            boto3_session=get_session(),
+            pyarrow_additional_kwargs={
+                "use_dictionary": [c for c in schema.DICTIONARY_COLUMNS if c in items_df.columns],
+                "coerce_timestamps": "ms",
+                "allow_truncated_timestamps": True,
+            },
+            **catalog,
         )
-
+        METRICS.add("FilesWritten", len(result.get("paths", [])))
@@ -1,16 +1,329 @@
-from handler import handler
+"""Replay monitoring events through `handler()` locally and report its throughput.
+
+Events are synthetic SNS batches over the service/outcome kinds of benchmarks.events, in
+a configurable mix, or recorded events replayed from a JSONL file. S3, Glue, Secrets Manager
+and Slack are replaced by local stand-ins (benchmarks.stubs) unless --live is given, in which
+case the handler talks to AWS with the ambient credentials (e.g. AWS_PROFILE).
+
+    python local_exec.py --batch-size 100 --batches 50
+    python local_exec.py --mix lambda_failure=3,glue_job_success=1 --batch-size 10
+    python local_exec.py --replay events.jsonl --json > report.json
+    python local_exec.py --baseline report.json --tolerance 0.15   # exit 1 on regression
+    python local_exec.py --kind glue_crawler_failure --batches 1 --batch-size 1 --print-response
+    python local_exec.py --tune --tune-batch-sizes 1,10,100 --peak-rate 50 --write-tuning
+
+--tune replays every batch size in a fresh interpreter and derives the Lambda memory size,
+architecture and concurrency the CDK stack deploys with, see benchmarks/tuning.py.
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import time
+from collections import Counter
+from types import SimpleNamespace
+from typing import Dict, Iterable, List
+from unittest import mock
+
+import handler
+from benchmarks import tuning
+from benchmarks.events import (
+    SAMPLE_BUILDERS,
+    mixed_batches,
+    parse_mix,
+    replay_batches,
+    sns_batch,
+)
+from benchmarks.stubs import (
+    LocalGlueClient,
+    LocalObjectStore,
+    LocalParquetDataset,
+    LocalSecretStore,
+    WebhookStubServer,
+)
+from commons.dead_letter import LocalFileSink
+from commons.payloads import PayloadSlimmer
+from commons.writers import BACKENDS as WRITER_BACKENDS
+from commons.writers import BACKEND_NDJSON, GluePartitions, make_writer
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile of `values`"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered))) - 1))]
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process (ru_maxrss is in KB on Linux, bytes on macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+@contextlib.contextmanager
+def local_services(args, root: str):
+    """Patch the handler's AWS and Slack dependencies with local stand-ins"""
+    dataset = LocalParquetDataset(root, args.put_latency, args.catalog_latency)
+    objects = LocalObjectStore(root, args.put_latency)
+    glue = LocalGlueClient(args.catalog_latency)
+    cf = handler.cf
+    writer_table = cf.MONITOR_NDJSON_TABLE if args.writer == BACKEND_NDJSON else cf.MONITOR_TABLE
+    writer = make_writer(
+        args.writer,
+        handler.schema.table_location(cf.MONITOR_S3, cf.MONITOR_DATABASE, writer_table),
+        partitions=None
+        if cf.PARTITION_PROJECTION
+        else GluePartitions(cf.MONITOR_DATABASE, writer_table, client=lambda: glue),
+        put=objects.put,
+    )
+    payload_uri = f"s3://{cf.MONITOR_S3}/{cf.MONITOR_DATABASE}/payloads"
+    with WebhookStubServer(delay=args.webhook_delay) as webhook:
+        secrets = LocalSecretStore({"slack_webhook": webhook.url}, args.secret_latency)
+        clients = {"glue": glue}
+        handler.SECRET_CACHE.invalidate(handler.cf.SECRET_MGR)
+        handler._CATALOG_TYPES["fetched_at"] = 0.0
+        with mock.patch.object(
+            handler, "wr", SimpleNamespace(s3=SimpleNamespace(to_parquet=dataset.to_parquet))
+        ), mock.patch.object(handler, "get_secret", secrets.get_secret), mock.patch.object(
+            handler, "get_client", lambda service_name, *args, **kwargs: clients[service_name]
+        ), mock.patch.object(handler, "get_session", lambda: None), mock.patch.object(
+            handler, "DEAD_LETTER_SINK", LocalFileSink(os.path.join(root, "dead_letter.jsonl"))
+        ), mock.patch.object(handler, "WRITER", writer), mock.patch.object(
+            handler, "WRITER_TABLE", writer_table
+        ), mock.patch.object(
+            handler, "PAYLOADS", PayloadSlimmer(cf.PAYLOAD_MAX_CHARS, payload_uri, put=objects.put)
+        ):
+            yield SimpleNamespace(
+                dataset=dataset, objects=objects, glue=glue, secrets=secrets, webhook=webhook
+            )
+        handler.SECRET_CACHE.invalidate(handler.cf.SECRET_MGR)
+
+
+def replay(batches: Iterable[Dict], print_response: bool = False, warmup: bool = True) -> Dict:
+    """Run every batch through handler() and measure it. The warm-up invocation, one record of
+    each kind, takes the lazy imports and first connections out of the measurements."""
+    if warmup:
+        with contextlib.redirect_stdout(io.StringIO()):
+            handler.handler(sns_batch(len(SAMPLE_BUILDERS), list(SAMPLE_BUILDERS)), {})
+    record_seconds: List[float] = []
+    invocation_seconds: List[float] = []
+    statuses: Counter = Counter()
+    stage_ms: Counter = Counter()
+    process_record = handler.ProcessEvent.process_record
+
+    def timed_process_record(self, record, message_id):
+        start = time.perf_counter()
+        try:
+            return process_record(self, record, message_id)
+        finally:
+            record_seconds.append(time.perf_counter() - start)
+
+    records = 0
+    cpu_start = time.process_time()
+    with mock.patch.object(handler.ProcessEvent, "process_record", timed_process_record):
+        for event in batches:
+            # The handler prints its EMF metrics line; keep that out of the output
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                response = handler.handler(event, {})
+                invocation_seconds.append(time.perf_counter() - start)
+            for name, value in handler.METRICS.values().items():
+                if name.endswith("Time") and name != "InvocationTime":
+                    stage_ms[name[: -len("Time")]] += value
+            records += len(event["Records"])
+            statuses.update(record["status"] for record in response.get("records", []))
+            if print_response:
+                print(json.dumps(response, indent=2))
+
+    cpu_seconds = time.process_time() - cpu_start
+    elapsed = sum(invocation_seconds)
+    return {
+        "records": records,
+        "invocations": len(invocation_seconds),
+        "elapsed_seconds": elapsed,
+        # CPU time of all threads, including the harness and the local stand-ins
+        "cpu_seconds": cpu_seconds,
+        "records_per_second": records / elapsed if elapsed else 0.0,
+        # Per record, decode, classification and composition only: the write, notifications and
+        # dead letters happen once per invocation and are in the invocation latency
+        "compose_p50_ms": percentile(record_seconds, 50) * 1000,
+        "compose_p99_ms": percentile(record_seconds, 99) * 1000,
+        "invocation_p50_ms": percentile(invocation_seconds, 50) * 1000,
+        "invocation_p99_ms": percentile(invocation_seconds, 99) * 1000,
+        "peak_rss_mb": peak_rss_mb(),
+        "statuses": dict(statuses),
+        # Time per stage, summed over the invocations, from the handler's EMF metrics
+        "stage_ms": {stage: round(ms, 3) for stage, ms in stage_ms.most_common()},
+    }
+
+
+def regressions(report: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Metrics of `report` worse than `baseline` by more than `tolerance`"""
+    found = []
+    if report["records_per_second"] < baseline["records_per_second"] * (1 - tolerance):
+        found.append("records_per_second")
+    for metric in ("compose_p99_ms", "invocation_p99_ms", "peak_rss_mb"):
+        # Baselines written before a metric existed do not gate it
+        if metric in baseline and report[metric] > baseline[metric] * (1 + tolerance):
+            found.append(metric)
+    return found
+
+
+def replay_argv(args) -> List[str]:
+    """Command line of the replay source and stand-in latencies, for the tuning runs"""
+    argv = ["--batches", str(args.batches), "--seed", str(args.seed)]
+    for flag in ("mix", "kind", "replay"):
+        if getattr(args, flag):
+            argv += [f"--{flag}", getattr(args, flag)]
+    for flag in ("writer", "put_latency", "catalog_latency", "secret_latency", "webhook_delay"):
+        argv += [f"--{flag.replace('_', '-')}", str(getattr(args, flag))]
+    return argv
+
+
+def tune(args) -> Dict:
+    """Measure every batch size of --tune-batch-sizes and recommend the Lambda settings"""
+    argv = replay_argv(args)
+    batch_sizes = sorted({int(size) for size in args.tune_batch_sizes.split(",")})
+    measurements = [tuning.measure(argv, batch_size) for batch_size in batch_sizes]
+    return tuning.recommend(
+        measurements,
+        cold_start=tuning.cold_start_ms(argv),
+        peak_rate=args.peak_rate,
+        steady_rate=args.steady_rate,
+        cold_start_budget_ms=args.cold_start_budget_ms,
+        memory_overhead_mb=args.memory_overhead_mb,
+        max_duration_seconds=args.max_duration_seconds,
+        arm64_cpu_factor=args.arm64_cpu_factor,
+    )
+
+
+def print_report(report: Dict, services) -> None:
+    print(f"records        : {report['records']:,} in {report['invocations']:,} invocations")
+    print(f"throughput     : {report['records_per_second']:,.0f} records/s")
+    print(
+        f"invocation     : p50 {report['invocation_p50_ms']:.1f} ms  "
+        f"p99 {report['invocation_p99_ms']:.1f} ms  (whole batch, including the write)"
+    )
+    print(
+        f"record compose : p50 {report['compose_p50_ms']:.3f} ms  "
+        f"p99 {report['compose_p99_ms']:.3f} ms  (decode, classify and compose only, no write)"
+    )
+    print(f"peak RSS       : {report['peak_rss_mb']:.1f} MB")
+    print(f"record status  : {report['statuses']}")
+    print(
+        "stages (ms)    : "
+        + ", ".join(f"{stage} {ms:,.1f}" for stage, ms in report["stage_ms"].items())
+    )
+    if services is not None:
+        print(
+            "local services : "
+            f"{services.dataset.files_written + services.objects.files_written} files, "
+            f"{services.glue.calls} Glue calls, {services.secrets.calls} secret fetches, "
+            f"{len(services.webhook.received)} Slack messages"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--mix", help="kind=weight,... over " + ", ".join(SAMPLE_BUILDERS))
+    source.add_argument("--kind", choices=list(SAMPLE_BUILDERS), help="a single kind")
+    source.add_argument("--replay", help="JSONL file of recorded events, records or messages")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--batches", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--put-latency", type=float, default=0.03, help="seconds per S3 PUT")
+    parser.add_argument("--catalog-latency", type=float, default=0.05, help="per Glue call")
+    parser.add_argument("--secret-latency", type=float, default=0.05, help="per secret fetch")
+    parser.add_argument("--webhook-delay", type=float, default=0.1, help="per Slack POST")
+    parser.add_argument(
+        "--writer",
+        choices=WRITER_BACKENDS,
+        default=handler.cf.WRITER_BACKEND,
+        help="monitor row writer backend of the local stand-ins",
+    )
+    parser.add_argument("--output-dir", help="where the local dataset is written (default: tmp)")
+    parser.add_argument("--live", action="store_true", help="use AWS and Slack instead of stubs")
+    parser.add_argument("--print-response", action="store_true")
+    parser.add_argument("--no-warmup", action="store_true", help="measure the cold start too")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--baseline", help="report JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    tune_group = parser.add_argument_group("tuning")
+    tune_group.add_argument("--tune", action="store_true", help="recommend Lambda settings")
+    tune_group.add_argument("--tune-batch-sizes", default="1,10,50,100,250")
+    tune_group.add_argument(
+        "--peak-rate", type=float, default=20, help="peak monitoring events per second"
+    )
+    tune_group.add_argument(
+        "--steady-rate", type=float, default=0.5, help="steady monitoring events per second"
+    )
+    tune_group.add_argument("--cold-start-budget-ms", type=float, default=3000)
+    tune_group.add_argument(
+        "--memory-overhead-mb",
+        type=float,
+        default=96,
+        help="Lambda runtime plus awswrangler and boto3, which the stand-ins do not import",
+    )
+    tune_group.add_argument("--max-duration-seconds", type=float, default=30)
+    tune_group.add_argument(
+        "--arm64-cpu-factor",
+        type=float,
+        help="arm64 CPU time relative to this host, measured on arm64; without it arm64 is not "
+        "recommended",
+    )
+    tune_group.add_argument(
+        "--write-tuning", action="store_true", help=f"write the report to {tuning.TUNING_FILE}"
+    )
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    if args.tune:
+        report = tune(args)
+        if args.json:
+            print(json.dumps(report, indent=2))
+        else:
+            tuning.print_tuning(report)
+        if args.write_tuning:
+            with open(tuning.TUNING_FILE, "w") as tuning_file:
+                json.dump(report, tuning_file, indent=2)
+                tuning_file.write("\n")
+        return
+
+    if args.replay:
+        batches = replay_batches(args.replay, args.batch_size)
+    else:
+        mix = {args.kind: 1.0} if args.kind else parse_mix(args.mix)
+        batches = mixed_batches(mix, args.batch_size, args.batches, args.seed)
+
+    services = None
+    with contextlib.ExitStack() as stack:
+        if not args.live:
+            root = args.output_dir or stack.enter_context(tempfile.TemporaryDirectory())
+            services = stack.enter_context(local_services(args, root))
+            batches = services.glue.track_runs(batches)
+        report = replay(batches, args.print_response, warmup=not args.no_warmup)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report, services)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            failed = regressions(report, json.load(baseline_file), args.tolerance)
+        if failed:
+            print(f"REGRESSION beyond {args.tolerance:.0%}: {', '.join(failed)}", file=sys.stderr)
+            sys.exit(1)
+
 
 if __name__ == "__main__":
-    from ast import literal_eval
-    # AWS_PROFILE=smblog
-    SAMPLE_DATA = "None"
-    # Choose one of the SAMPLE_DATA below for local development
-    # from sample_input.glue_job_success import SAMPLE_DATA
-    # from sample_input.glue_job_failure import SAMPLE_DATA
-    # from sample_input.lambda_success import SAMPLE_DATA
-    # from sample_input.lambda_failure import SAMPLE_DATA
-    # from sample_input.glue_crawler_success import SAMPLE_DATA
-    from sample_input.glue_crawler_failure import SAMPLE_DATA
-
-    event_package = literal_eval(SAMPLE_DATA)
-    print(handler(event_package, {}))
\ No newline at end of file
+    main()
@@ -0,0 +1,144 @@
+"""One-off rewrite of monitor table files written in the flat exported_on= layout into the
+exported_on=/service_type=/hour= layout the table's partition projection resolves. Until they
+are rewritten, rows written before the layout change are not visible to queries.
+
+Rows of a day are split by their service_type column and by the hour of their timestamp (the
+flat layout did not record the hour they were written, which is at most minutes later), cast to
+the schema types, sorted and deduplicated like compaction does. The rewrite goes through
+compaction's staging prefix and manifest, so an interrupted run is finished by the next run of
+either script and running it twice is harmless.
+
+    python migrate_layout.py --table-uri s3://<bucket>/<database>/<table>
+    python migrate_layout.py --table-uri /tmp/monitor --day 20230701
+"""
+import argparse
+import logging
+import uuid
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+import compaction
+import config as cf
+import monitor_schema as schema
+from commons.lazy_import import lazy_import
+
+pq = lazy_import("pyarrow.parquet")
+pafs = lazy_import("pyarrow.fs")
+
+LOGGER = logging.getLogger(__name__)
+
+# Hour of rows without a timestamp
+DEFAULT_HOUR = "00"
+
+
+class MigrationResult(NamedTuple):
+    day: str
+    input_files: int
+    output_files: int
+    rows: int
+
+
+def legacy_days(filesystem, root: str) -> List[str]:
+    """`exported_on` values with files directly under their exported_on= prefix"""
+    days = []
+    for info in filesystem.get_file_info(pafs.FileSelector(root, allow_not_found=True)):
+        name = info.path.rsplit("/", 1)[-1]
+        if info.type == pafs.FileType.Directory and name.startswith("exported_on="):
+            if legacy_files(filesystem, info.path):
+                days.append(name[len("exported_on="):])
+    return sorted(days)
+
+
+def legacy_files(filesystem, day_path: str) -> List[str]:
+    return [
+        info.path
+        for info in filesystem.get_file_info(pafs.FileSelector(day_path, allow_not_found=True))
+        if info.type == pafs.FileType.File and info.path.endswith(".parquet")
+    ]
+
+
+def migrate_table(table_uri: str, days: Optional[List[str]] = None) -> List[MigrationResult]:
+    """Rewrite the legacy files of `days`, by default of every day that has some"""
+    filesystem, root = pafs.FileSystem.from_uri(table_uri)
+    results = []
+    for day in days or legacy_days(filesystem, root):
+        compaction.recover_staged(filesystem, f"{root}/{compaction.STAGING_DIR}/exported_on={day}")
+        results.append(migrate_day(filesystem, root, day))
+    return results
+
+
+def migrate_day(
+    filesystem,
+    root: str,
+    day: str,
+    row_group_size: int = cf.COMPACTION_ROW_GROUP_SIZE,
+) -> MigrationResult:
+    """Rewrite the files directly under exported_on=`day` into its leaf partitions"""
+    day_path = f"{root}/exported_on={day}"
+    inputs = legacy_files(filesystem, day_path)
+    if not inputs:
+        return MigrationResult(day, 0, 0, 0)
+
+    table = compaction.read_partition(filesystem, inputs)
+    sort_keys = [(key, "ascending") for key in compaction.SORT_KEYS if key in table.column_names]
+    if sort_keys:
+        table = table.sort_by(sort_keys)
+    seen_keys: Set[str] = set()
+    table = compaction.drop_duplicate_rows(table, seen_keys)
+
+    generation = uuid.uuid4().hex
+    staging = f"{root}/{compaction.STAGING_DIR}/exported_on={day}/legacy/{generation}"
+    filesystem.create_dir(staging, recursive=True)
+    data_columns = [name for name in table.column_names if name not in schema.PARTITION_COLUMNS]
+    outputs = []
+    for index, ((service_type, hour), rows) in enumerate(sorted(partition_rows(table).items())):
+        staged = f"{staging}/part-{index:05d}.snappy.parquet"
+        pq.write_table(
+            table.take(rows).select(data_columns),
+            staged,
+            filesystem=filesystem,
+            compression="snappy",
+            row_group_size=row_group_size,
+        )
+        partition = f"{day_path}/service_type={service_type}/hour={hour}"
+        name = f"{compaction.COMPACTED_PREFIX}{generation}-{index:05d}.snappy.parquet"
+        outputs.append([staged, f"{partition}/{name}"])
+        if service_type not in schema.SERVICE_TYPES:
+            LOGGER.warning("Rows of %s are outside the projected service types", partition)
+
+    manifest = {"partition": day_path, "inputs": inputs, "outputs": outputs}
+    compaction.commit(filesystem, staging, manifest)
+    LOGGER.info(
+        "Migrated exported_on=%s: %d files into %d partitions (%d rows)",
+        day, len(inputs), len(outputs), table.num_rows,
+    )
+    return MigrationResult(day, len(inputs), len(outputs), table.num_rows)
+
+
+def partition_rows(table) -> Dict[Tuple[str, str], List[int]]:
+    """Row indices of `table` by (service_type, hour) partition"""
+    count = table.num_rows
+    service_types = (
+        table.column("service_type").to_pylist()
+        if "service_type" in table.column_names
+        else [None] * count
+    )
+    timestamps = (
+        table.column("timestamp").to_pylist()
+        if "timestamp" in table.column_names
+        else [None] * count
+    )
+    groups: Dict[Tuple[str, str], List[int]] = {}
+    for row, (service_type, timestamp) in enumerate(zip(service_types, timestamps)):
+        hour = timestamp.strftime(schema.HOUR_FORMAT) if timestamp else DEFAULT_HOUR
+        groups.setdefault((str(service_type), hour), []).append(row)
+    return groups
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Rewrite monitor files of the flat layout")
+    parser.add_argument("--table-uri", required=True, help="s3://bucket/db/table or local path")
+    parser.add_argument("--day", action="append", help="exported_on value, e.g. 20230701")
+    args = parser.parse_args()
+    for migration in migrate_table(args.table_uri, args.day):
+        print(migration)
@@ -0,0 +1,228 @@
+"""Monitor table schema, shared by the monitoring Lambda's writer and the CDK table definition
+so the two cannot drift. Pure Python: the CDK app loads this file directly."""
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+# (name, Glue/Athena type)
+COLUMNS = (
+    ("service_request_id", "string"),
+    ("service_name", "string"),
+    ("event_type", "string"),
+    ("timestamp", "timestamp"),
+    ("event_epoch_ms", "bigint"),
+    ("retry_attempts", "int"),
+    ("error_message", "string"),
+    ("exception_details", "string"),
+    ("error_fingerprint", "string"),
+    ("service_run_id", "string"),
+    # Lambda failures: the request payload and stack trace, cut to PAYLOAD_MAX_CHARS, and the
+    # S3 URI of the original when it was cut
+    ("request_payload", "string"),
+    ("stack_trace", "string"),
+    ("payload_bytes", "bigint"),
+    ("payload_ref", "string"),
+    ("duration_ms", "bigint"),
+    ("sla_breached", "boolean"),
+    # Glue job run metrics, from GetJobRun and the job definition
+    ("job_attempt", "int"),
+    ("job_execution_seconds", "int"),
+    ("job_dpu_seconds", "double"),
+    ("job_worker_type", "string"),
+    ("job_number_of_workers", "int"),
+    ("job_max_capacity", "double"),
+    ("job_glue_version", "string"),
+)
+
+# Low cardinality columns written with Parquet dictionary encoding; other columns are plain
+DICTIONARY_COLUMNS = (
+    "service_name",
+    "event_type",
+    "error_fingerprint",
+    "job_worker_type",
+    "job_glue_version",
+)
+
+# Partition keys in path order: exported_on=YYYYMMDD/service_type=.../hour=HH
+PARTITION_KEYS = (
+    ("exported_on", "string"),
+    ("service_type", "string"),
+    ("hour", "string"),
+)
+PARTITION_COLUMNS = tuple(name for name, _ in PARTITION_KEYS)
+
+# Values of the service_type partition; services added to the event registry must be added here
+SERVICE_TYPES = ("lambda", "glue_job", "glue_crawler")
+
+EXPORTED_ON_FORMAT = "%Y%m%d"
+EXPORTED_ON_PROJECTION_FORMAT = "yyyyMMdd"
+EXPORTED_ON_PROJECTION_START = "20210701"
+HOUR_FORMAT = "%H"
+
+PARQUET_INPUT_FORMAT = "org.apache.hadoop.hive.ql.io.parquet.MapredParquetInputFormat"
+PARQUET_OUTPUT_FORMAT = "org.apache.hadoop.hive.ql.io.parquet.MapredParquetOutputFormat"
+PARQUET_SERDE = "org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe"
+# Gzipped newline-delimited JSON, written by the ndjson writer backend
+JSON_SERDE = "org.openx.data.jsonserde.JsonSerDe"
+TEXT_INPUT_FORMAT = "org.apache.hadoop.mapred.TextInputFormat"
+TEXT_OUTPUT_FORMAT = "org.apache.hadoop.hive.ql.io.HiveIgnoreKeyTextOutputFormat"
+
+COLUMN_TYPES: Dict[str, str] = dict(COLUMNS + PARTITION_KEYS)
+
+# Rollup tables: one row per service and hour (or day) of arrival, i.e. per `hour` partition of
+# the monitor table, so an hour's aggregates only change while that hour is being written
+ROLLUP_GROUP_COLUMNS = (
+    ("service_type", "string"),
+    ("service_name", "string"),
+)
+ROLLUP_AGGREGATE_COLUMNS = (
+    ("success_count", "bigint"),
+    ("failure_count", "bigint"),
+    ("retry_attempts_total", "bigint"),
+    ("first_failure_at", "timestamp"),
+    ("last_failure_at", "timestamp"),
+    ("distinct_fingerprints", "int"),
+    ("error_fingerprints", "array<string>"),
+)
+HOURLY_ROLLUP_COLUMNS = ROLLUP_GROUP_COLUMNS + (("hour", "string"),) + ROLLUP_AGGREGATE_COLUMNS
+DAILY_ROLLUP_COLUMNS = ROLLUP_GROUP_COLUMNS + ROLLUP_AGGREGATE_COLUMNS
+# Rollup tables hold a single file per day: exported_on=YYYYMMDD/rollup.parquet
+ROLLUP_PARTITION_KEYS = (("exported_on", "string"),)
+ROLLUP_FILE_NAME = "rollup.parquet"
+
+
+def table_location(bucket: str, database: str, table: str) -> str:
+    """S3 location of the table"""
+    return f"s3://{bucket}/{database}/{table}"
+
+
+def write_partition_values(written_at: datetime) -> Dict[str, str]:
+    """Partition values derived from the write time; service_type comes from each item"""
+    return {
+        "exported_on": written_at.strftime(EXPORTED_ON_FORMAT),
+        "hour": written_at.strftime(HOUR_FORMAT),
+    }
+
+
+def column_types(columns: Iterable[str]) -> Dict[str, str]:
+    """Glue types for `columns`; columns not in the schema are stored as string"""
+    return {column.lower(): COLUMN_TYPES.get(column.lower(), "string") for column in columns}
+
+
+def reconcile_types(types: Dict[str, str], catalog_types: Dict[str, str]) -> Dict[str, str]:
+    """
+    Types to write with when the catalog table already exists. A column whose type in the
+    catalog differs from the schema (the table has not been migrated yet) keeps the catalog
+    type so new files stay readable with the live table; columns the catalog does not know
+    yet are written with the schema type.
+    """
+    return {column: catalog_types.get(column, type_) for column, type_ in types.items()}
+
+
+def parse_timestamp(value: Any) -> Optional[datetime]:
+    """Naive UTC datetime from an ISO-8601 event time such as 2023-07-19T13:33:31.880Z"""
+    if value is None or isinstance(value, datetime):
+        return value
+    try:
+        parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def _to_int(value: Any) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_float(value: Any) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_bool(value: Any) -> Optional[bool]:
+    if value is None or isinstance(value, bool):
+        return value
+    return str(value).lower() == "true"
+
+
+def _to_str(value: Any) -> Optional[str]:
+    return value if value is None or isinstance(value, str) else str(value)
+
+
+_CONVERTERS: Dict[str, Callable[[Any], Any]] = {
+    "timestamp": parse_timestamp,
+    "int": _to_int,
+    "bigint": _to_int,
+    "double": _to_float,
+    "string": _to_str,
+    "boolean": _to_bool,
+}
+_COLUMN_CONVERTERS = {name: _CONVERTERS[type_] for name, type_ in COLUMNS}
+_EPOCH = datetime(1970, 1, 1)
+_ONE_MS = timedelta(milliseconds=1)
+
+
+def column_converter(column: str) -> Callable[[Any], Any]:
+    """Converter of values of `column` to its schema type"""
+    return _COLUMN_CONVERTERS.get(column, _to_str)
+
+
+def coerce_item(item: dict) -> dict:
+    """Convert the values of a composed item to the schema types, in place, and add the
+    derived event_epoch_ms column"""
+    for column, value in item.items():
+        converter = _COLUMN_CONVERTERS.get(column)
+        if converter is not None:
+            item[column] = converter(value)
+    timestamp = item.get("timestamp")
+    item["event_epoch_ms"] = (
+        (timestamp - _EPOCH) // _ONE_MS if isinstance(timestamp, datetime) else None
+    )
+    return item
+
+
+def glue_columns(columns=COLUMNS) -> List[Dict[str, str]]:
+    """Data columns in the shape of Glue's Column structure"""
+    return [{"name": name, "type": type_, "comment": ""} for name, type_ in columns]
+
+
+def glue_partition_keys(keys=PARTITION_KEYS) -> List[Dict[str, str]]:
+    """Partition keys in the shape of Glue's Column structure"""
+    return [{"name": name, "type": type_, "comment": ""} for name, type_ in keys]
+
+
+_PROJECTIONS = {
+    "exported_on": {
+        "type": "date",
+        "format": EXPORTED_ON_PROJECTION_FORMAT,
+        "range": f"{EXPORTED_ON_PROJECTION_START},NOW",
+        "interval": "1",
+        "interval.unit": "DAYS",
+    },
+    "service_type": {"type": "enum", "values": ",".join(SERVICE_TYPES)},
+    "hour": {"type": "integer", "range": "0,23", "digits": "2"},
+}
+
+
+def projection_parameters(location: str, keys=PARTITION_KEYS) -> Dict[str, str]:
+    """Athena partition projection for the table at `location` partitioned by `keys`; the date
+    range is open-ended"""
+    template = "/".join(f"{name}=${{{name}}}" for name, _ in keys)
+    parameters = {"projection.enabled": "true"}
+    for name, _ in keys:
+        for option, value in _PROJECTIONS[name].items():
+            parameters[f"projection.{name}.{option}"] = value
+    parameters["storage.location.template"] = f"{location.rstrip('/')}/{template}"
+    return parameters
+
+
+def partition_values_from_path(path: str) -> List[str]:
+    """Partition values, in key order, of a path containing key=value segments"""
+    segments = dict(segment.split("=", 1) for segment in path.split("/") if "=" in segment)
+    return [segments[name] for name in PARTITION_COLUMNS]
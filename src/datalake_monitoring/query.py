@@ -0,0 +1,494 @@
+""" Read side of the monitor table: the common monitoring questions as parameterized Athena
+queries that only scan the partitions their time window can be in, with their results cached
+
+- recent failures per service, failure rate over a window, top error fingerprints and mean
+  time to recovery (MTTR), as Arrow tables or pandas DataFrames
+- windows end on a time bucket (QUERY_BUCKET_SECONDS), so repeated questions within a bucket
+  produce the same SQL: Athena answers them from its result reuse, and `ResultCache` from
+  memory or a local directory, keyed on the normalized SQL and the bucket
+- `DuckDBExecutor` runs the same SQL over a local copy of the table (hive-partitioned Parquet
+  files), the offline stand-in for Athena
+
+    python query.py failure-rate --hours 24
+    python query.py mttr --hours 168 --duckdb /tmp/monitor/monitor --pandas
+"""
+
+import argparse
+import hashlib
+import os
+import re
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+import config as cf
+import monitor_schema as schema
+from commons.aws_clients import get_client
+from commons.event_registry import EVENT_TYPE_SUCCESS
+from commons.lazy_import import lazy_import
+
+pa = lazy_import("pyarrow")
+pq = lazy_import("pyarrow.parquet")
+duckdb = lazy_import("duckdb")
+
+ATHENA_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+_QUOTED = re.compile(r"('(?:[^']|'')*')")
+_WHITESPACE = re.compile(r"\s+")
+_IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+# Every event type but success is a failure (failed, timeout, stopped, ...), as in the rollups
+FAILURE = f"event_type IS DISTINCT FROM '{EVENT_TYPE_SUCCESS}'"
+
+
+def literal(value) -> str:
+    """SQL literal of a query parameter, the same in Athena and DuckDB"""
+    if isinstance(value, datetime):
+        return f"TIMESTAMP '{value.strftime(ATHENA_TIMESTAMP_FORMAT)[:-3]}'"
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def quote_identifier(name: str) -> str:
+    if not _IDENTIFIER.match(name):
+        raise ValueError(f"Invalid identifier {name!r}")
+    return f'"{name}"'
+
+
+def normalize_sql(sql: str) -> str:
+    """`sql` with runs of whitespace outside string literals collapsed and no trailing
+    semicolon, so formatting differences do not change the cache key"""
+    parts = _QUOTED.split(sql)
+    parts[::2] = [_WHITESPACE.sub(" ", part) for part in parts[::2]]
+    return "".join(parts).strip().rstrip(";").strip()
+
+
+def time_bucket(now: float, bucket_seconds: int) -> datetime:
+    """Start of the bucket `now` (epoch seconds) is in, as a naive UTC datetime"""
+    start = int(now // bucket_seconds * bucket_seconds)
+    return datetime.fromtimestamp(start, timezone.utc).replace(tzinfo=None)
+
+
+def partition_filter(start: datetime, end: datetime, max_write_lag_hours: int = 24) -> str:
+    """Predicate on the exported_on and hour partitions of the rows of events between `start`
+    and `end`. Rows are written after their event, so none of them is in a partition before
+    `start`'s, and all of them are within `max_write_lag_hours` after `end`."""
+    first = schema.write_partition_values(start)
+    last = schema.write_partition_values(end + timedelta(hours=max_write_lag_hours))
+    return (
+        f"(exported_on > {literal(first['exported_on'])} OR (exported_on = "
+        f"{literal(first['exported_on'])} AND hour >= {literal(first['hour'])})) "
+        f"AND exported_on <= {literal(last['exported_on'])}"
+    )
+
+
+def where(
+    start: datetime,
+    end: datetime,
+    service_type: Optional[str] = None,
+    service_name: Optional[str] = None,
+    failures_only: bool = False,
+    max_write_lag_hours: int = 24,
+) -> str:
+    """WHERE clause of the rows of events in [start, end), partition predicates first"""
+    conditions = [
+        partition_filter(start, end, max_write_lag_hours),
+        f'"timestamp" >= {literal(start)}',
+        f'"timestamp" < {literal(end)}',
+    ]
+    if service_type is not None:
+        conditions.append(f"service_type = {literal(service_type)}")
+    if service_name is not None:
+        conditions.append(f"service_name = {literal(service_name)}")
+    if failures_only:
+        conditions.append(FAILURE)
+    return "WHERE " + "\n  AND ".join(conditions)
+
+
+def recent_failures_sql(source: str, start: datetime, end: datetime, limit: int = 100, **filters):
+    return f"""
+SELECT "timestamp", service_type, service_name, service_request_id, retry_attempts,
+       error_fingerprint, error_message
+FROM {source}
+{where(start, end, failures_only=True, **filters)}
+ORDER BY "timestamp" DESC
+LIMIT {int(limit)}
+"""
+
+
+def failure_rate_sql(source: str, start: datetime, end: datetime, **filters):
+    return f"""
+SELECT service_type, service_name,
+       CAST(SUM(CASE WHEN {FAILURE} THEN 1 ELSE 0 END) AS BIGINT) AS failures,
+       COUNT(*) AS events,
+       CAST(SUM(CASE WHEN {FAILURE} THEN 1 ELSE 0 END) AS DOUBLE) / COUNT(*) AS failure_rate
+FROM {source}
+{where(start, end, **filters)}
+GROUP BY service_type, service_name
+ORDER BY failure_rate DESC, failures DESC, service_type, service_name
+"""
+
+
+def top_fingerprints_sql(source: str, start: datetime, end: datetime, limit: int = 10, **filters):
+    return f"""
+SELECT error_fingerprint, COUNT(*) AS failures, COUNT(DISTINCT service_name) AS services,
+       MIN("timestamp") AS first_seen, MAX("timestamp") AS last_seen,
+       MAX(error_message) AS example_error_message
+FROM {source}
+{where(start, end, failures_only=True, **filters)}
+  AND error_fingerprint IS NOT NULL
+GROUP BY error_fingerprint
+ORDER BY failures DESC, error_fingerprint
+LIMIT {int(limit)}
+"""
+
+
+def mttr_sql(source: str, start: datetime, end: datetime, **filters):
+    """An incident is a service's first failure after a success (or the window start); it is
+    recovered by the service's next success. Incidents still open at the window end are not
+    counted."""
+    return f"""
+WITH events AS (
+  SELECT service_type, service_name, {FAILURE} AS failed, "timestamp" AS event_at,
+         LAG({FAILURE}) OVER (
+           PARTITION BY service_type, service_name ORDER BY "timestamp"
+         ) AS previous_failed
+  FROM {source}
+  {where(start, end, **filters)}
+),
+transitions AS (
+  SELECT service_type, service_name, failed, event_at,
+         LEAD(failed) OVER (
+           PARTITION BY service_type, service_name ORDER BY event_at
+         ) AS next_failed,
+         LEAD(event_at) OVER (
+           PARTITION BY service_type, service_name ORDER BY event_at
+         ) AS next_event_at
+  FROM events
+  WHERE (failed AND (previous_failed IS NULL OR NOT previous_failed))
+     OR (NOT failed AND previous_failed)
+)
+SELECT service_type, service_name, COUNT(*) AS incidents,
+       AVG(date_diff('millisecond', event_at, next_event_at)) / 1000.0 AS mttr_seconds,
+       MAX(date_diff('millisecond', event_at, next_event_at)) / 1000.0 AS max_recovery_seconds
+FROM transitions
+WHERE failed AND NOT next_failed
+GROUP BY service_type, service_name
+ORDER BY mttr_seconds DESC, service_type, service_name
+"""
+
+
+class ResultCache:
+    """
+    Query results as Arrow tables, keyed on the normalized SQL and its time bucket. The last
+    `max_entries` results are kept in memory; with a `directory`, results are also written
+    there as Parquet files, shared by processes, and read back while younger than
+    `ttl_seconds`.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: float = 300,
+        directory: Optional[str] = None,
+        max_entries: int = 128,
+        clock=time.time,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.directory = directory
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    @staticmethod
+    def key(sql: str, bucket: datetime) -> str:
+        return hashlib.sha256(f"{bucket.isoformat()}\n{normalize_sql(sql)}".encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.parquet")
+
+    def get(self, key: str):
+        now = self.clock()
+        entry = self._entries.get(key)
+        if entry is not None and now - entry[1] < self.ttl_seconds:
+            self._entries.move_to_end(key)
+            return entry[0]
+        if self.directory:
+            path = self._path(key)
+            if os.path.exists(path) and now - os.path.getmtime(path) < self.ttl_seconds:
+                table = pq.read_table(path)
+                self._remember(key, table, os.path.getmtime(path))
+                return table
+        return None
+
+    def put(self, key: str, table) -> None:
+        self._remember(key, table, self.clock())
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            # Written aside and renamed, so concurrent readers never see a partial file
+            partial = f"{self._path(key)}.{os.getpid()}.tmp"
+            pq.write_table(table, partial)
+            os.replace(partial, self._path(key))
+
+    def _remember(self, key: str, table, stored_at: float) -> None:
+        self._entries[key] = (table, stored_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+_ATHENA_TYPES = {
+    "varchar": (lambda: pa.string(), str),
+    "char": (lambda: pa.string(), str),
+    "boolean": (lambda: pa.bool_(), lambda value: value == "true"),
+    "tinyint": (lambda: pa.int64(), int),
+    "smallint": (lambda: pa.int64(), int),
+    "integer": (lambda: pa.int64(), int),
+    "bigint": (lambda: pa.int64(), int),
+    "double": (lambda: pa.float64(), float),
+    "float": (lambda: pa.float64(), float),
+    "real": (lambda: pa.float64(), float),
+    "timestamp": (
+        lambda: pa.timestamp("ms"),
+        lambda value: datetime.strptime(value, ATHENA_TIMESTAMP_FORMAT)
+        if "." in value
+        else datetime.strptime(value, "%Y-%m-%d %H:%M:%S"),
+    ),
+}
+
+
+class AthenaQueryError(RuntimeError):
+    pass
+
+
+class AthenaExecutor:
+    """
+    Runs queries in an Athena workgroup. Results of an identical query run in the last
+    `reuse_max_age_minutes` are reused by Athena without scanning the table again. Results
+    are read with GetQueryResults, which suits the small aggregates these queries return, and
+    typed from the result metadata.
+    """
+
+    def __init__(
+        self,
+        workgroup: str = "primary",
+        output_location: Optional[str] = None,
+        reuse_max_age_minutes: int = 60,
+        region_name: Optional[str] = None,
+        poll_seconds: float = 0.2,
+        timeout_seconds: float = 300,
+    ):
+        self.workgroup = workgroup
+        self.output_location = output_location
+        self.reuse_max_age_minutes = reuse_max_age_minutes
+        self.region_name = region_name
+        self.poll_seconds = poll_seconds
+        self.timeout_seconds = timeout_seconds
+        self.stats: Counter = Counter()
+
+    @property
+    def client(self):
+        return get_client("athena", self.region_name)
+
+    def source(self, database: str, table: str) -> str:
+        return f"{quote_identifier(database)}.{quote_identifier(table)}"
+
+    def execute(self, sql: str, database: str):
+        request = {
+            "QueryString": sql,
+            "QueryExecutionContext": {"Database": database},
+            "WorkGroup": self.workgroup,
+        }
+        if self.output_location:
+            request["ResultConfiguration"] = {"OutputLocation": self.output_location}
+        if self.reuse_max_age_minutes > 0:
+            request["ResultReuseConfiguration"] = {
+                "ResultReuseByAgeConfiguration": {
+                    "Enabled": True,
+                    "MaxAgeInMinutes": self.reuse_max_age_minutes,
+                }
+            }
+        query_id = self.client.start_query_execution(**request)["QueryExecutionId"]
+        execution = self.wait(query_id)
+        statistics = execution.get("Statistics", {})
+        self.stats["queries"] += 1
+        self.stats["reused"] += bool(
+            statistics.get("ResultReuseInformation", {}).get("ReusedPreviousResult")
+        )
+        self.stats["bytes_scanned"] += statistics.get("DataScannedInBytes", 0)
+        return self.results(query_id)
+
+    def wait(self, query_id: str) -> Dict:
+        deadline = time.monotonic() + self.timeout_seconds
+        attempt = 0
+        while True:
+            execution = self.client.get_query_execution(QueryExecutionId=query_id)[
+                "QueryExecution"
+            ]
+            state = execution["Status"]["State"]
+            if state == "SUCCEEDED":
+                return execution
+            if state in ("FAILED", "CANCELLED"):
+                reason = execution["Status"].get("StateChangeReason", state)
+                raise AthenaQueryError(f"Query {query_id} {state.lower()}: {reason}")
+            if time.monotonic() > deadline:
+                self.client.stop_query_execution(QueryExecutionId=query_id)
+                raise AthenaQueryError(f"Query {query_id} timed out")
+            time.sleep(min(self.poll_seconds * 2 ** attempt, 2))
+            attempt += 1
+
+    def results(self, query_id: str):
+        columns, rows = None, []
+        paginator = self.client.get_paginator("get_query_results")
+        for page in paginator.paginate(QueryExecutionId=query_id):
+            result_set = page["ResultSet"]
+            page_rows = [
+                [datum.get("VarCharValue") for datum in row["Data"]] for row in result_set["Rows"]
+            ]
+            if columns is None:
+                columns = result_set["ResultSetMetadata"]["ColumnInfo"]
+                # The first row of the first page holds the column names
+                page_rows = page_rows[1:]
+            rows.extend(page_rows)
+        columns = columns or []
+        arrays = []
+        for index, column in enumerate(columns):
+            arrow_type, convert = _ATHENA_TYPES.get(column["Type"], _ATHENA_TYPES["varchar"])
+            values = [None if row[index] is None else convert(row[index]) for row in rows]
+            arrays.append(pa.array(values, type=arrow_type()))
+        return pa.Table.from_arrays(arrays, names=[column["Name"] for column in columns])
+
+
+class DuckDBExecutor:
+    """
+    Local stand-in for Athena: runs the same SQL with DuckDB over the monitor table's
+    hive-partitioned Parquet files under `table_uri`, e.g. a copy of the table or the output
+    of `local_exec.py --output-dir`
+    """
+
+    def __init__(self, table_uri: str, connection=None):
+        self.table_uri = table_uri.rstrip("/")
+        self.connection = connection if connection is not None else duckdb.connect()
+        self.stats: Counter = Counter()
+
+    def source(self, database: str, table: str) -> str:
+        partition_types = ", ".join(f"'{name}': 'VARCHAR'" for name in schema.PARTITION_COLUMNS)
+        return (
+            f"read_parquet('{self.table_uri}/**/*.parquet', hive_partitioning = true, "
+            f"union_by_name = true, hive_types = {{{partition_types}}})"
+        )
+
+    def execute(self, sql: str, database: str):
+        self.stats["queries"] += 1
+        result = self.connection.execute(sql)
+        # to_arrow_table replaces fetch_arrow_table in recent DuckDB releases
+        fetch = getattr(result, "to_arrow_table", None) or result.fetch_arrow_table
+        return fetch()
+
+
+class MonitorQueries:
+    """The monitoring questions over the monitor table, through `executor` (AthenaExecutor
+    or DuckDBExecutor) and `cache`. Every question takes a window of `hours` ending on the
+    current time bucket, and optional service_type / service_name filters."""
+
+    def __init__(
+        self,
+        executor,
+        database: str = cf.MONITOR_DATABASE,
+        table: str = cf.MONITOR_TABLE,
+        cache: Optional[ResultCache] = None,
+        bucket_seconds: int = cf.QUERY_BUCKET_SECONDS,
+        max_write_lag_hours: int = cf.QUERY_MAX_WRITE_LAG_HOURS,
+        clock=time.time,
+    ):
+        self.executor = executor
+        self.database = database
+        self.table = table
+        self.cache = cache
+        self.bucket_seconds = bucket_seconds
+        self.max_write_lag_hours = max_write_lag_hours
+        self.clock = clock
+        self.stats: Counter = Counter()
+
+    def window(self, hours: float):
+        """The last `hours` up to the end of the current time bucket"""
+        end = time_bucket(self.clock(), self.bucket_seconds) + timedelta(
+            seconds=self.bucket_seconds
+        )
+        return end - timedelta(hours=hours), end
+
+    def run(self, build, hours: float, as_pandas: bool = False, **kwargs):
+        """Build the SQL of a question over the window and run it, or serve it from the cache"""
+        start, end = self.window(hours)
+        sql = build(
+            self.executor.source(self.database, self.table),
+            start,
+            end,
+            max_write_lag_hours=self.max_write_lag_hours,
+            **kwargs,
+        )
+        key = ResultCache.key(sql, end) if self.cache is not None else None
+        table = self.cache.get(key) if key is not None else None
+        if table is None:
+            self.stats["cache_misses"] += key is not None
+            table = self.executor.execute(normalize_sql(sql), self.database)
+            if key is not None:
+                self.cache.put(key, table)
+        else:
+            self.stats["cache_hits"] += 1
+        return table.to_pandas() if as_pandas else table
+
+    def recent_failures(self, hours: float = 24, limit: int = 100, **kwargs):
+        return self.run(recent_failures_sql, hours, limit=limit, **kwargs)
+
+    def failure_rate(self, hours: float = 24, **kwargs):
+        return self.run(failure_rate_sql, hours, **kwargs)
+
+    def top_fingerprints(self, hours: float = 24, limit: int = 10, **kwargs):
+        return self.run(top_fingerprints_sql, hours, limit=limit, **kwargs)
+
+    def mttr(self, hours: float = 168, **kwargs):
+        return self.run(mttr_sql, hours, **kwargs)
+
+
+def monitor_queries(duckdb_table_uri: Optional[str] = None) -> MonitorQueries:
+    """MonitorQueries over Athena, or DuckDB on a local table, with the configured cache"""
+    if duckdb_table_uri:
+        executor = DuckDBExecutor(duckdb_table_uri)
+    else:
+        executor = AthenaExecutor(
+            workgroup=cf.QUERY_WORKGROUP,
+            output_location=cf.QUERY_OUTPUT_LOCATION or None,
+            reuse_max_age_minutes=cf.QUERY_REUSE_MAX_AGE_MINUTES,
+            region_name=cf.REGION,
+        )
+    cache = ResultCache(cf.QUERY_BUCKET_SECONDS, directory=cf.QUERY_CACHE_DIR or None)
+    return MonitorQueries(executor, cache=cache)
+
+
+QUESTIONS = {
+    "recent-failures": "recent_failures",
+    "failure-rate": "failure_rate",
+    "top-fingerprints": "top_fingerprints",
+    "mttr": "mttr",
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Common monitoring questions over Athena")
+    parser.add_argument("question", choices=list(QUESTIONS))
+    parser.add_argument("--hours", type=float, default=24)
+    parser.add_argument("--service-type", choices=schema.SERVICE_TYPES)
+    parser.add_argument("--service-name")
+    parser.add_argument("--duckdb", help="run over this local table directory with DuckDB")
+    parser.add_argument("--pandas", action="store_true", help="print as a pandas DataFrame")
+    args = parser.parse_args()
+    queries = monitor_queries(args.duckdb)
+    result = getattr(queries, QUESTIONS[args.question])(
+        hours=args.hours,
+        service_type=args.service_type,
+        service_name=args.service_name,
+        as_pandas=args.pandas,
+    )
+    print(result.to_string() if args.pandas else result)
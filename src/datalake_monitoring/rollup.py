@@ -0,0 +1,308 @@
+""" Rollups of the monitor table: hourly and daily aggregates per service, refreshed in
+micro-batches from the monitor table partitions written in the last hours, so dashboards read a
+file per day instead of every raw row """
+
+import argparse
+import json
+import logging
+import traceback
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, NamedTuple, Optional
+
+import config as cf
+import monitor_schema as schema
+from commons.event_registry import EVENT_TYPE_SUCCESS
+from commons.lazy_import import lazy_import
+from compaction import closed_days
+
+pa = lazy_import("pyarrow")
+pc = lazy_import("pyarrow.compute")
+pq = lazy_import("pyarrow.parquet")
+pafs = lazy_import("pyarrow.fs")
+
+LOGGER = logging.getLogger(__name__)
+
+GROUP_KEYS = tuple(name for name, _ in schema.ROLLUP_GROUP_COLUMNS)
+HOURLY_KEYS = GROUP_KEYS + ("hour",)
+# Monitor table columns the rollups are computed from
+EVENT_COLUMNS = (
+    ("service_name", "string"),
+    ("event_type", "string"),
+    ("retry_attempts", "bigint"),
+    ("timestamp", "timestamp"),
+    ("error_fingerprint", "string"),
+)
+
+
+class RollupResult(NamedTuple):
+    day: str
+    hours: Optional[List[str]]
+    events: int
+    hourly_rows: int
+    daily_rows: int
+
+
+def handler(event, context):
+    """Refresh the rollups of the hours written in the last ROLLUP_LOOKBACK_HOURS, or of whole
+    days given as {"days": ["YYYYMMDD", ...]} or {"closed_days": N}, e.g. after compaction
+    dropped duplicate rows"""
+    log = logging.getLogger()
+    log.setLevel(logging.INFO)
+    try:
+        if event.get("days"):
+            hours_by_day = {day: None for day in event["days"]}
+        elif event.get("closed_days"):
+            hours_by_day = {day: None for day in closed_days(int(event["closed_days"]))}
+        else:
+            hours_by_day = recent_hours(cf.ROLLUP_LOOKBACK_HOURS)
+        results = [refresh_day(day, hours) for day, hours in hours_by_day.items()]
+        log.info(f"Rollup results: {[result._asdict() for result in results]}")
+        return {"statusCode": 200, "body": json.dumps([result._asdict() for result in results])}
+    except Exception:
+        log.error(traceback.format_exc())
+        return {"statusCode": 400, "body": json.dumps("FAILURE: Monitor rollup refresh failed")}
+
+
+def recent_hours(lookback_hours: int, now: Optional[datetime] = None) -> Dict[str, List[str]]:
+    """`hour` partitions written in the last `lookback_hours` and the current one, by
+    `exported_on`"""
+    now = now or datetime.now(timezone.utc)
+    hours: Dict[str, List[str]] = defaultdict(list)
+    for n in range(lookback_hours, -1, -1):
+        values = schema.write_partition_values(now - timedelta(hours=n))
+        hours[values["exported_on"]].append(values["hour"])
+    return dict(hours)
+
+
+def refresh_day(
+    day: str,
+    hours: Optional[List[str]] = None,
+    table_uri: Optional[str] = None,
+    hourly_uri: Optional[str] = None,
+    daily_uri: Optional[str] = None,
+) -> RollupResult:
+    """Recompute the hourly rollup of `hours` of `day` (all hours when None), merge it into the
+    day's hourly rollup file and derive the daily rollup from that file"""
+    table_uri = table_uri or schema.table_location(
+        cf.MONITOR_S3, cf.MONITOR_DATABASE, cf.MONITOR_TABLE
+    )
+    hourly_uri = hourly_uri or schema.table_location(
+        cf.MONITOR_S3, cf.MONITOR_DATABASE, cf.MONITOR_HOURLY_TABLE
+    )
+    daily_uri = daily_uri or schema.table_location(
+        cf.MONITOR_S3, cf.MONITOR_DATABASE, cf.MONITOR_DAILY_TABLE
+    )
+
+    filesystem, root = pafs.FileSystem.from_uri(table_uri)
+    events = read_events(filesystem, f"{root}/exported_on={day}", hours)
+    hourly = aggregate_hourly(events)
+
+    hourly_filesystem, hourly_root = pafs.FileSystem.from_uri(hourly_uri)
+    hourly_path = rollup_path(hourly_root, day)
+    if hours is not None:
+        previous = read_rollup(hourly_filesystem, hourly_path, hourly_schema())
+        if previous is not None:
+            recomputed = pc.is_in(previous["hour"], value_set=pa.array(hours, pa.string()))
+            hourly = pa.concat_tables([previous.filter(pc.invert(recomputed)), hourly])
+    hourly = hourly.sort_by([(key, "ascending") for key in HOURLY_KEYS])
+    write_rollup(hourly_filesystem, hourly_path, hourly)
+
+    daily = aggregate_daily(hourly)
+    daily_filesystem, daily_root = pafs.FileSystem.from_uri(daily_uri)
+    write_rollup(daily_filesystem, rollup_path(daily_root, day), daily)
+
+    LOGGER.info(
+        "Refreshed rollups of %s (hours %s): %d events, %d hourly rows, %d daily rows",
+        day, hours or "all", events.num_rows, hourly.num_rows, daily.num_rows,
+    )
+    return RollupResult(day, hours, events.num_rows, hourly.num_rows, daily.num_rows)
+
+
+_ARROW_TYPES = {
+    "string": lambda: pa.string(),
+    "int": lambda: pa.int32(),
+    "bigint": lambda: pa.int64(),
+    "timestamp": lambda: pa.timestamp("ms"),
+    "array<string>": lambda: pa.list_(pa.string()),
+}
+
+
+def arrow_schema(columns):
+    """Arrow schema of (name, Glue type) columns"""
+    return pa.schema([(name, _ARROW_TYPES[type_]()) for name, type_ in columns])
+
+
+def hourly_schema():
+    return arrow_schema(schema.HOURLY_ROLLUP_COLUMNS)
+
+
+def daily_schema():
+    return arrow_schema(schema.DAILY_ROLLUP_COLUMNS)
+
+
+def rollup_path(root: str, day: str) -> str:
+    return f"{root}/exported_on={day}/{schema.ROLLUP_FILE_NAME}"
+
+
+def read_events(filesystem, day_path: str, hours: Optional[List[str]] = None):
+    """The rollup input columns of the monitor table files below `day_path`, restricted to
+    `hours`, with the service_type and hour partition values as columns. Files of the flat
+    exported_on= layout are skipped until migrate_layout.py rewrites them, as compaction does."""
+    selector = pafs.FileSelector(day_path, allow_not_found=True, recursive=True)
+    event_schema = arrow_schema(EVENT_COLUMNS)
+    tables = []
+    legacy_files = 0
+    for info in filesystem.get_file_info(selector):
+        if info.type != pafs.FileType.File or not info.path.endswith(".parquet"):
+            continue
+        if info.path.rsplit("/", 1)[0] == day_path:
+            legacy_files += 1
+            continue
+        partition = dict(
+            zip(schema.PARTITION_COLUMNS, schema.partition_values_from_path(info.path))
+        )
+        if hours is not None and partition["hour"] not in hours:
+            continue
+        with filesystem.open_input_file(info.path) as source:
+            parquet_file = pq.ParquetFile(source)
+            names = set(parquet_file.schema_arrow.names)
+            table = parquet_file.read(columns=[n for n in event_schema.names if n in names])
+        columns = {
+            "service_type": pa.array([partition["service_type"]] * table.num_rows, pa.string()),
+            "hour": pa.array([partition["hour"]] * table.num_rows, pa.string()),
+        }
+        for field in event_schema:
+            columns[field.name] = to_type(table, field)
+        tables.append(pa.table(columns))
+    if legacy_files:
+        LOGGER.warning("Skipping %d files of the legacy layout under %s", legacy_files, day_path)
+    if not tables:
+        return pa.table(
+            {
+                "service_type": pa.array([], pa.string()),
+                "hour": pa.array([], pa.string()),
+                **{field.name: pa.array([], field.type) for field in event_schema},
+            }
+        )
+    return pa.concat_tables(tables)
+
+
+def to_type(table, field):
+    """Column `field` of `table` cast to the field's type; nulls when the column is missing or
+    was written with an incompatible type by an older writer"""
+    if field.name not in table.column_names:
+        return pa.nulls(table.num_rows, field.type)
+    try:
+        return pc.cast(table[field.name], field.type)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        return pa.nulls(table.num_rows, field.type)
+
+
+def aggregate_hourly(events):
+    """Hourly rollup rows of monitor table events"""
+    if events.num_rows == 0:
+        return hourly_schema().empty_table()
+    success = pc.fill_null(pc.equal(events["event_type"], EVENT_TYPE_SUCCESS), False)
+    failure = pc.invert(success)
+    flags = pa.table(
+        {
+            **{key: events[key] for key in HOURLY_KEYS},
+            "success": pc.cast(success, pa.int64()),
+            "failure": pc.cast(failure, pa.int64()),
+            "retry_attempts": events["retry_attempts"],
+            "failure_at": pc.if_else(
+                failure, events["timestamp"], pa.nulls(events.num_rows, pa.timestamp("ms"))
+            ),
+            "fingerprint": pc.if_else(
+                failure, events["error_fingerprint"], pa.nulls(events.num_rows, pa.string())
+            ),
+        }
+    )
+    grouped = flags.group_by(list(HOURLY_KEYS)).aggregate(
+        [
+            ("success", "sum"),
+            ("failure", "sum"),
+            ("retry_attempts", "sum"),
+            ("failure_at", "min"),
+            ("failure_at", "max"),
+            ("fingerprint", "distinct", pc.CountOptions(mode="only_valid")),
+        ]
+    )
+    fingerprints = grouped["fingerprint_distinct"]
+    return pa.table(
+        {
+            **{key: grouped[key] for key in HOURLY_KEYS},
+            "success_count": grouped["success_sum"],
+            "failure_count": grouped["failure_sum"],
+            "retry_attempts_total": pc.fill_null(grouped["retry_attempts_sum"], 0),
+            "first_failure_at": grouped["failure_at_min"],
+            "last_failure_at": grouped["failure_at_max"],
+            "distinct_fingerprints": pc.cast(pc.list_value_length(fingerprints), pa.int32()),
+            "error_fingerprints": fingerprints,
+        }
+    ).cast(hourly_schema())
+
+
+def aggregate_daily(hourly):
+    """Daily rollup rows from the hourly rollup rows of a day; a day has at most a few
+    thousand of them, so this runs on Python rows"""
+    days: Dict[tuple, dict] = {}
+    for row in hourly.to_pylist():
+        key = tuple(row[name] for name in GROUP_KEYS)
+        day = days.get(key)
+        if day is None:
+            day = days[key] = {
+                **dict(zip(GROUP_KEYS, key)),
+                "success_count": 0,
+                "failure_count": 0,
+                "retry_attempts_total": 0,
+                "first_failure_at": None,
+                "last_failure_at": None,
+                "error_fingerprints": set(),
+            }
+        day["success_count"] += row["success_count"] or 0
+        day["failure_count"] += row["failure_count"] or 0
+        day["retry_attempts_total"] += row["retry_attempts_total"] or 0
+        first, last = row["first_failure_at"], row["last_failure_at"]
+        if first is not None:
+            day["first_failure_at"] = min(day["first_failure_at"] or first, first)
+        if last is not None:
+            day["last_failure_at"] = max(day["last_failure_at"] or last, last)
+        day["error_fingerprints"].update(row["error_fingerprints"] or ())
+    rows = []
+    for day in days.values():
+        fingerprints = sorted(day["error_fingerprints"])
+        rows.append(
+            {**day, "distinct_fingerprints": len(fingerprints), "error_fingerprints": fingerprints}
+        )
+    return pa.Table.from_pylist(rows, schema=daily_schema())
+
+
+def read_rollup(filesystem, path: str, rollup_schema):
+    """The rollup file at `path`, or None if it does not exist yet"""
+    if filesystem.get_file_info(path).type == pafs.FileType.NotFound:
+        return None
+    table = pq.read_table(path, filesystem=filesystem)
+    return pa.table(
+        {field.name: to_type(table, field) for field in rollup_schema}
+    ).cast(rollup_schema)
+
+
+def write_rollup(filesystem, path: str, table) -> None:
+    """Replace the rollup file at `path`; a single object PUT, so readers see either the old or
+    the new file"""
+    if isinstance(filesystem, pafs.LocalFileSystem):
+        filesystem.create_dir(path.rsplit("/", 1)[0], recursive=True)
+    pq.write_table(table, path, filesystem=filesystem, compression="snappy")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Refresh the monitor rollup tables")
+    parser.add_argument("--table-uri", required=True, help="s3://bucket/db/table or local path")
+    parser.add_argument("--hourly-uri", required=True, help="location of the hourly rollup")
+    parser.add_argument("--daily-uri", required=True, help="location of the daily rollup")
+    parser.add_argument("--day", action="append", help="exported_on value, e.g. 20230701")
+    args = parser.parse_args()
+    for rollup_day in args.day or closed_days(1):
+        print(refresh_day(rollup_day, None, args.table_uri, args.hourly_uri, args.daily_uri))
@@ -0,0 +1,2 @@
+"""Tests of the monitoring Lambda's modules. Run from `src/datalake_monitoring` with
+`python -m pytest tests`; AWS services are stubbed, nothing is called."""
@@ -0,0 +1,8 @@
+"""The Lambda's modules import each other from the top level (`import config`, `commons.*`),
+as they do in the deployed package, so their directory goes on sys.path"""
+import os
+import sys
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if HERE not in sys.path:
+    sys.path.insert(0, HERE)
@@ -0,0 +1,31 @@
+from types import SimpleNamespace
+
+import pytest
+
+from benchmarks import batch_write
+from benchmarks.events import RARE_KINDS, sns_batch
+from commons.writers import BACKEND_AWSWRANGLER
+from local_exec import local_services
+
+
+def test_default_batches_leave_out_the_rare_kinds():
+    messages = [record["Sns"]["Message"] for record in sns_batch(20)["Records"]]
+    assert not [message for message in messages if "lambda-fail-large" in message]
+    assert RARE_KINDS == ("lambda_failure_large",)
+
+
+@pytest.mark.parametrize("batched", [False, True])
+def test_invocations_write_to_the_local_dataset(tmp_path, batched):
+    pytest.importorskip("pandas")
+    args = SimpleNamespace(
+        put_latency=0.0,
+        catalog_latency=0.0,
+        secret_latency=0.0,
+        webhook_delay=0.0,
+        writer=BACKEND_AWSWRANGLER,
+    )
+    with local_services(args, str(tmp_path)) as services:
+        batch_write.run_invocation(sns_batch(10), batched)
+
+    # One file per record, or one per service type
+    assert services.dataset.files_written == (3 if batched else 10)
@@ -0,0 +1,129 @@
+import json
+import os
+from datetime import datetime
+
+import pyarrow as pa
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
+import pytest
+
+import compaction
+
+DAY = "20230719"
+
+
+def write_file(partition: str, name: str, rows: list, timestamp_type=pa.timestamp("ms")):
+    os.makedirs(partition, exist_ok=True)
+    table = pa.table(
+        {
+            "service_request_id": [row[0] for row in rows],
+            "event_type": ["Glue Job State Change"] * len(rows),
+            "service_name": ["nightly-load"] * len(rows),
+            "timestamp": pa.array([row[1] for row in rows], type=timestamp_type),
+        }
+    )
+    pq.write_table(table, os.path.join(partition, name))
+
+
+def staged_files(table_dir: str) -> list:
+    return [
+        name
+        for _, _, names in os.walk(f"{table_dir}/{compaction.STAGING_DIR}")
+        for name in names
+    ]
+
+
+def partition_files(partition: str) -> list:
+    return sorted(name for name in os.listdir(partition) if name.endswith(".parquet"))
+
+
+@pytest.fixture
+def table_dir(tmp_path):
+    return str(tmp_path / "monitor")
+
+
+def partition_of(table_dir: str, hour: str = "10") -> str:
+    return f"{table_dir}/exported_on={DAY}/service_type=glue_job/hour={hour}"
+
+
+def test_mixed_timestamp_types_are_kept(table_dir):
+    partition = partition_of(table_dir)
+    write_file(partition, "a.parquet", [("r-1", datetime(2023, 7, 19, 10, 0))])
+    # Written before the table was typed: timestamps as ISO-8601 strings
+    write_file(partition, "b.parquet", [("r-2", "2023-07-19T10:05:00.000Z")], pa.string())
+
+    [result] = compaction.compact_table(table_dir, [DAY])
+
+    assert (result.input_files, result.rows, result.skipped) == (2, 2, False)
+    [name] = partition_files(partition)
+    table = pq.read_table(os.path.join(partition, name))
+    assert table.schema.field("timestamp").type == pa.timestamp("ms")
+    assert table.column("timestamp").to_pylist() == [
+        datetime(2023, 7, 19, 10, 0),
+        datetime(2023, 7, 19, 10, 5),
+    ]
+    assert staged_files(table_dir) == []
+
+
+def test_retry_after_commit_finishes_the_swap(table_dir, monkeypatch):
+    partition = partition_of(table_dir)
+    write_file(partition, "a.parquet", [("r-1", datetime(2023, 7, 19, 10, 0))])
+    write_file(partition, "b.parquet", [("r-1", datetime(2023, 7, 19, 10, 0))])
+
+    def crash(*args):
+        raise RuntimeError("interrupted")
+
+    monkeypatch.setattr(compaction, "publish", crash)
+    with pytest.raises(RuntimeError):
+        compaction.compact_table(table_dir, [DAY])
+    # Nothing visible changed: the compacted file only exists under the staging prefix
+    assert partition_files(partition) == ["a.parquet", "b.parquet"]
+    monkeypatch.undo()
+
+    [result] = compaction.compact_table(table_dir, [DAY])
+
+    assert result.skipped
+    [name] = partition_files(partition)
+    assert name.startswith(compaction.COMPACTED_PREFIX)
+    assert pq.read_table(os.path.join(partition, name)).num_rows == 1
+    assert staged_files(table_dir) == []
+
+
+def test_publish_is_idempotent(table_dir):
+    partition = partition_of(table_dir)
+    write_file(partition, "a.parquet", [("r-1", datetime(2023, 7, 19, 10, 0))])
+    filesystem, _ = pafs.FileSystem.from_uri(table_dir)
+    staging = f"{compaction.staging_path(partition)}/g1"
+    os.makedirs(staging)
+    pq.write_table(pq.read_table(f"{partition}/a.parquet"), f"{staging}/part-00000.parquet")
+    manifest = {
+        "partition": partition,
+        "inputs": [f"{partition}/a.parquet"],
+        "outputs": [[f"{staging}/part-00000.parquet", f"{partition}/compacted-g1-00000.parquet"]],
+    }
+    with open(f"{staging}/{compaction.MANIFEST_NAME}", "w") as file:
+        json.dump(manifest, file)
+    # The first publish got as far as the copy
+    filesystem.copy_file(*manifest["outputs"][0])
+
+    assert compaction.recover_staged(
+        filesystem, f"{table_dir}/{compaction.STAGING_DIR}/exported_on={DAY}"
+    ) == 1
+
+    assert partition_files(partition) == ["compacted-g1-00000.parquet"]
+    assert not os.path.exists(staging)
+
+
+def test_uncommitted_staging_is_removed_once_stale(table_dir):
+    staging_day = f"{table_dir}/{compaction.STAGING_DIR}/exported_on={DAY}"
+    staging = f"{staging_day}/service_type=glue_job/hour=10/g1"
+    os.makedirs(staging)
+    write_file(staging, "part-00000.parquet", [("r-1", datetime(2023, 7, 19, 10, 0))])
+    filesystem, _ = pafs.FileSystem.from_uri(table_dir)
+
+    compaction.recover_staged(filesystem, staging_day)
+    assert os.path.exists(staging)
+
+    later = os.path.getmtime(f"{staging}/part-00000.parquet") + compaction.STALE_STAGING_SECONDS
+    compaction.recover_staged(filesystem, staging_day, now=later + 1)
+    assert not os.path.exists(staging)
@@ -0,0 +1,69 @@
+import json
+import logging
+
+import pytest
+
+import handler
+from benchmarks.events import glue_job_event, sns_record
+from commons.dead_letter import LocalFileSink
+
+
+@pytest.fixture
+def dead_letters(tmp_path, monkeypatch):
+    path = tmp_path / "dead_letter.jsonl"
+    monkeypatch.setattr(handler, "DEAD_LETTER_SINK", LocalFileSink(str(path)))
+    monkeypatch.setattr(handler.ProcessEvent, "persist_items", lambda self: None)
+    return path
+
+
+def run(records: list) -> dict:
+    event = {"Records": records}
+    return handler.ProcessEvent(event, {}, handler.cf, logging.getLogger()).execute()
+
+
+def statuses(response: dict) -> list:
+    return [(record["id"], record["status"]) for record in response["records"]]
+
+
+def test_malformed_records_are_dead_lettered(dead_letters):
+    not_json = sns_record(glue_job_event(state="SUCCEEDED"))
+    not_json["Sns"]["Message"] = "{not json"
+    missing_field = glue_job_event(state="FAILED")
+    del missing_field["detail"]["message"]
+    unknown = {"source": "aws.s3", "detail-type": "Object Created", "detail": {}}
+
+    response = run([not_json, sns_record(missing_field), sns_record(unknown)])
+
+    assert [status for _, status in statuses(response)] == [handler.RECORD_DEAD_LETTERED] * 3
+    errors = [json.loads(line)["error"] for line in dead_letters.read_text().splitlines()]
+    assert [error.split(":")[:2] for error in errors[:2]] == [
+        ["PermanentEventError", " Decode"],
+        ["PermanentEventError", " Extract"],
+    ]
+    assert errors[2].startswith("InvalidEventError")
+
+
+def test_errors_outside_message_reading_are_retried(dead_letters, monkeypatch):
+    def broken(item):
+        raise TypeError("bug in the converters")
+
+    monkeypatch.setattr(handler.schema, "coerce_item", broken)
+
+    response = run([sns_record(glue_job_event(state="SUCCEEDED"))])
+
+    assert [status for _, status in statuses(response)] == [handler.RECORD_FAILED]
+    assert not dead_letters.exists()
+
+
+def test_records_without_message_id_are_identified_by_index(dead_letters):
+    records = [sns_record(glue_job_event(state="SUCCEEDED")) for _ in range(2)]
+    for record in records:
+        del record["Sns"]["MessageId"]
+    records[1]["Sns"]["Message"] = "{not json"
+
+    response = run(records)
+
+    assert statuses(response) == [
+        ("0", handler.RECORD_PERSISTED),
+        ("1", handler.RECORD_DEAD_LETTERED),
+    ]
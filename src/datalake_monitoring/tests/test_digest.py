@@ -0,0 +1,93 @@
+import json
+import os
+import subprocess
+import sys
+import textwrap
+
+from benchmarks.stubs import WebhookStubServer
+from commons.digest import DigestCoalescer
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def failure(time_stamp, service_id: str = "r-1") -> dict:
+    return {
+        "service": "glue_job",
+        "service_name": "nightly-load",
+        "service_id": service_id,
+        "exception_details": "Table not found",
+        "time_stamp": time_stamp,
+    }
+
+
+def test_repeats_are_rolled_into_one_digest():
+    digest = DigestCoalescer()
+    for index, time_stamp in enumerate(["2026-10-17T10:02", "2026-10-17T10:01", None]):
+        digest.add(failure(time_stamp, f"r-{index}"))
+
+    (message,) = digest.flush()
+    assert message["service_id"] == "r-0 (+2 more)"
+    assert message["exception_details"].startswith(
+        "3 failures between 2026-10-17T10:01 and 2026-10-17T10:02"
+    )
+
+
+def test_failures_without_timestamps_are_counted():
+    digest = DigestCoalescer()
+    digest.add(failure(None))
+    digest.add(failure(None, "r-2"))
+
+    (message,) = digest.flush()
+    assert message["exception_details"] == "2 failures: Table not found"
+
+
+def test_held_failures_are_counted_and_drained():
+    clock = FakeClock()
+    digest = DigestCoalescer(window_seconds=60, clock=clock)
+    digest.add(failure("2026-10-17T10:00"))
+    assert len(digest.flush()) == 1
+
+    digest.add(failure("2026-10-17T10:01", "r-2"))
+    digest.add(failure("2026-10-17T10:02", "r-3"))
+    assert digest.flush() == []
+    assert digest.held() == 2
+
+    ((message, count),) = digest.drain()
+    assert count == 2
+    assert message["service_id"] == "r-2 (+1 more)"
+    assert digest.held() == 0
+
+
+def test_held_failures_are_sent_on_shutdown():
+    script = textwrap.dedent(
+        """
+        import os, signal
+        import handler
+        handler.DIGEST.add({"service": "lambda", "service_name": "f", "service_id": "r-1",
+                            "exception_details": "boom", "time_stamp": "2026-10-17T10:00"})
+        os.kill(os.getpid(), signal.SIGTERM)
+        """
+    )
+    with WebhookStubServer() as stub:
+        env = {
+            **os.environ,
+            "NOTIFY_DIGEST_WINDOW_SECONDS": "60",
+            "NOTIFY_SINKS": json.dumps({"slack": {"type": "webhook", "url": stub.url}}),
+        }
+        result = subprocess.run(
+            [sys.executable, "-c", script], cwd=HERE, env=env, capture_output=True, text=True
+        )
+
+    assert result.returncode == -15
+    assert [message["service_id"] for message in stub.received] == ["r-1"]
+    emf = json.loads(result.stdout.strip().splitlines()[-1])
+    assert emf["DigestFlushed"] == 1
+    assert emf["DigestDropped"] == 0
@@ -0,0 +1,118 @@
+import json
+import logging
+import uuid
+
+import pytest
+
+import handler
+from benchmarks.events import glue_job_event, sns_record
+from commons.envelopes import is_sqs_event, record_id, unwrap_record
+
+QUEUE_ARN = "arn:aws:sqs:eu-west-1:123456789012:datalake-monitoring"
+
+
+def sqs_record(message: dict, raw: bool = True) -> dict:
+    """Wrap a message the way SQS delivers it from a queue subscribed to the topic, with or
+    without raw message delivery"""
+    body = message if raw else sns_record(message)["Sns"]
+    return {
+        "messageId": str(uuid.uuid4()),
+        "receiptHandle": "handle",
+        "body": json.dumps(body),
+        "attributes": {"ApproximateReceiveCount": "1"},
+        "messageAttributes": {},
+        "eventSource": "aws:sqs",
+        "eventSourceARN": QUEUE_ARN,
+        "awsRegion": "eu-west-1",
+    }
+
+
+@pytest.fixture
+def written(monkeypatch):
+    items = []
+    monkeypatch.setattr(
+        handler.ProcessEvent, "persist_items", lambda self: items.extend(self.items)
+    )
+    # Records of the job named "broken" hit a bug after their message was read
+    coerce_item = handler.schema.coerce_item
+
+    def broken(item):
+        if item["service_name"] == "broken":
+            raise TypeError("bug in the converters")
+        coerce_item(item)
+
+    monkeypatch.setattr(handler.schema, "coerce_item", broken)
+    return items
+
+
+def run(records: list) -> dict:
+    event = {"Records": records}
+    return handler.ProcessEvent(event, {}, handler.cf, logging.getLogger()).execute()
+
+
+def statuses(response: dict) -> list:
+    return [(record["id"], record["status"]) for record in response["records"]]
+
+
+@pytest.mark.parametrize("wrap", [sns_record, sqs_record, lambda m: sqs_record(m, raw=False)])
+def test_every_envelope_unwraps_to_the_message(wrap):
+    message = glue_job_event("load", state="SUCCEEDED")
+    record = wrap(message)
+
+    message_id, body = unwrap_record(record)
+
+    assert dict(body) == message
+    assert message_id == record_id(record, 0) != ""
+    assert is_sqs_event({"Records": [record]}) == (wrap is not sns_record)
+
+
+def test_sqs_batches_report_only_the_failed_records(written):
+    records = [
+        sqs_record(glue_job_event("load", state="SUCCEEDED")),
+        sqs_record(glue_job_event("broken", state="SUCCEEDED"), raw=False),
+        sqs_record(glue_job_event("export", state="SUCCEEDED"), raw=False),
+    ]
+    ids = [record["messageId"] for record in records]
+
+    response = run(records)
+
+    assert response["statusCode"] == handler.FAILURE_RESPONSE["statusCode"]
+    assert response["batchItemFailures"] == [{"itemIdentifier": ids[1]}]
+    assert statuses(response) == [
+        (ids[0], handler.RECORD_PERSISTED),
+        (ids[1], handler.RECORD_FAILED),
+        (ids[2], handler.RECORD_PERSISTED),
+    ]
+    # Raw and SNS-wrapped records are both written
+    assert [item["service_name"] for item in written] == ["load", "export"]
+
+
+def test_sqs_batches_without_failures_have_no_items_to_retry(written):
+    records = [
+        sqs_record(glue_job_event("load", state="SUCCEEDED")),
+        sqs_record(glue_job_event("export", state="SUCCEEDED"), raw=False),
+    ]
+
+    response = run(records)
+
+    assert response["statusCode"] == handler.SUCCESS_RESPONSE["statusCode"]
+    assert response["batchItemFailures"] == []
+    assert len(written) == 2
+
+
+def test_sns_invocations_fail_as_a_whole(written):
+    records = [
+        sns_record(glue_job_event("load", state="SUCCEEDED")),
+        sns_record(glue_job_event("broken", state="SUCCEEDED")),
+    ]
+    ids = [record["Sns"]["MessageId"] for record in records]
+
+    response = run(records)
+
+    assert response["statusCode"] == handler.FAILURE_RESPONSE["statusCode"]
+    assert "batchItemFailures" not in response
+    assert statuses(response) == [
+        (ids[0], handler.RECORD_PERSISTED),
+        (ids[1], handler.RECORD_FAILED),
+    ]
+    assert [item["service_name"] for item in written] == ["load"]
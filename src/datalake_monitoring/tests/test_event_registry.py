@@ -0,0 +1,67 @@
+import pytest
+
+from commons import event_registry as registry
+from commons.event_registry import EVENT_TYPE_SUCCESS, classify_event, register_event_source
+
+SOURCE, DETAIL_TYPE = "test.source", "Test State Change"
+
+
+@pytest.fixture(autouse=True)
+def isolated_registry(monkeypatch):
+    """Register the test source in copies of the registry, restored after each test"""
+    monkeypatch.setattr(registry, "_SERVICES", dict(registry._SERVICES))
+    monkeypatch.setattr(registry, "_CLASSES", dict(registry._CLASSES))
+
+
+def message(state: str, name: str = "job-a") -> dict:
+    return {"source": SOURCE, "detail-type": DETAIL_TYPE, "detail": {"state": state, "name": name}}
+
+
+def register(template: dict) -> None:
+    register_event_source(
+        source=SOURCE,
+        detail_type=DETAIL_TYPE,
+        service_type="test",
+        success_template=template,
+        failure_template=template,
+        success_states=("DONE",),
+    )
+
+
+def compose(body: dict) -> dict:
+    event_class = classify_event(body)
+    item = {}
+    event_class.extract(body, item)
+    return item
+
+
+def test_registering_again_replaces_the_extractor():
+    register({"service_name": ["detail", "name"]})
+    assert compose(message("DONE")) == {"service_name": "job-a"}
+    assert classify_event(message("DONE")).event_type == EVENT_TYPE_SUCCESS
+
+    register({"job_name": ["detail", "name"]})
+    assert compose(message("DONE")) == {"job_name": "job-a"}
+    assert compose(message("BROKEN")) == {"job_name": "job-a"}
+
+
+def test_classes_of_unseen_states_are_bounded(monkeypatch):
+    register({"service_name": ["detail", "name"]})
+    monkeypatch.setattr(registry, "MAX_CLASSES", len(registry._CLASSES) + 10)
+
+    for index in range(100):
+        assert classify_event(message(f"STATE_{index}")).event_type == f"state_{index}"
+    assert len(registry._CLASSES) == registry.MAX_CLASSES
+
+
+def test_registering_again_drops_cached_classes():
+    register({"service_name": ["detail", "name"]})
+    classify_event(message("BROKEN"))
+    register({"job_name": ["detail", "name"]})
+
+    assert (SOURCE, DETAIL_TYPE, "BROKEN") not in registry._CLASSES
+    assert compose(message("BROKEN")) == {"job_name": "job-a"}
+
+
+def test_registrations_do_not_outlive_their_test():
+    assert registry.registered_service(SOURCE, DETAIL_TYPE) is None
@@ -0,0 +1,24 @@
+import pytest
+
+from benchmarks.fingerprint import TEMPLATES, synthetic_messages
+from commons.fingerprint import error_fingerprint, normalize_error_text
+
+
+@pytest.mark.parametrize(
+    "text, normalized",
+    [
+        ("request ddbbaced-1234-4abc-8def-0123456789ab failed", "request # failed"),
+        ("request abcdefab-cdef-abcd-efab-cdefabcdefab failed", "request # failed"),
+        ("Job run jr_abcdefabcdefabcdef failed", "job run jr_# failed"),
+        ("Object at 0xdeadbeefcafe", "object at #"),
+        ("Took 12.5 ms at 2026-10-17T10:14:03Z", "took #.# ms at #t#:#:#z"),
+        ("Table 'facade' not found", "table 'facade' not found"),
+    ],
+)
+def test_volatile_tokens_are_masked(text, normalized):
+    assert normalize_error_text(text) == normalized
+
+
+def test_one_fingerprint_per_template():
+    messages = synthetic_messages(20000)
+    assert len({error_fingerprint(message) for message in messages}) == len(TEMPLATES)
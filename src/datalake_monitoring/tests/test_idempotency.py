@@ -0,0 +1,217 @@
+import logging
+import threading
+import time
+
+import pytest
+
+import handler
+from benchmarks.events import glue_job_event, sns_record
+from commons import idempotency
+from commons.idempotency import (
+    DynamoDBIdempotencyStore,
+    IdempotencyGuard,
+    InMemoryIdempotencyStore,
+    idempotency_key,
+)
+from commons.routing import Router
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class ConditionalCheckFailedException(Exception):
+    def __init__(self, item: dict):
+        super().__init__("The conditional request failed")
+        self.response = {"Item": item}
+
+
+class FakeDynamoDB:
+    """Conditional PutItem and BatchWriteItem of the idempotency table, answering after
+    `latency` seconds and tracking the requests in flight at once"""
+
+    class exceptions:
+        ConditionalCheckFailedException = ConditionalCheckFailedException
+
+    def __init__(self, latency: float = 0.05, fail_on: str = None):
+        self.latency = latency
+        self.fail_on = fail_on
+        self.items = {}
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def put_item(self, TableName, Item, ConditionExpression, ExpressionAttributeValues, **kwargs):
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(self.latency)
+            key = Item["idempotency_key"]["S"]
+            if key == self.fail_on:
+                raise RuntimeError("throttled")
+            now = int(ExpressionAttributeValues[":now"]["N"])
+            with self._lock:
+                existing = self.items.get(key)
+                if existing is not None and int(existing["expires_at"]["N"]) > now:
+                    raise ConditionalCheckFailedException(existing)
+                self.items[key] = Item
+            return {}
+        finally:
+            with self._lock:
+                self.active -= 1
+
+    def batch_write_item(self, RequestItems):
+        for requests in RequestItems.values():
+            for request in requests:
+                if "PutRequest" in request:
+                    item = request["PutRequest"]["Item"]
+                    self.items[item["idempotency_key"]["S"]] = item
+                else:
+                    self.items.pop(request["DeleteRequest"]["Key"]["idempotency_key"]["S"], None)
+        return {}
+
+
+@pytest.fixture
+def dynamodb(monkeypatch):
+    client = FakeDynamoDB()
+    monkeypatch.setattr(idempotency, "get_client", lambda service_name, region_name=None: client)
+    return client
+
+
+def items(*request_ids) -> list:
+    return [
+        {"service_request_id": request_id, "event_type": "failed"} for request_id in request_ids
+    ]
+
+
+def test_pending_claims_of_other_invocations_are_in_flight():
+    clock = FakeClock()
+    store = InMemoryIdempotencyStore(lease_seconds=900, clock=clock)
+    first, second = IdempotencyGuard(store), IdempotencyGuard(store)
+
+    assert first.admit(items("r-1", "r-2")).keep == [0, 1]
+    first.commit([idempotency_key(item) for item in items("r-1")])
+
+    admission = second.admit(items("r-1", "r-2", "r-3"))
+    assert (admission.keep, admission.in_flight) == ([2], [1])
+    assert second.duplicates == 1
+
+    # The lease of an invocation that crashed expires
+    clock.now += 901
+    assert second.admit(items("r-2")).keep == [0]
+
+
+def test_dynamodb_claims_run_concurrently(dynamodb):
+    store = DynamoDBIdempotencyStore("idempotency", max_workers=10)
+    keys = [f"r-{index}:failed" for index in range(10)]
+
+    start = time.perf_counter()
+    claim = store.claim(keys)
+    elapsed = time.perf_counter() - start
+
+    assert claim.claimed == set(keys)
+    assert dynamodb.max_active > 1
+    assert elapsed < 10 * dynamodb.latency / 2
+
+
+def test_dynamodb_tells_in_flight_from_committed_keys(dynamodb):
+    store = DynamoDBIdempotencyStore("idempotency")
+    store.claim(["pending:failed", "committed:failed"])
+    store.commit(["committed:failed"])
+
+    claim = store.claim(["pending:failed", "committed:failed", "new:failed"])
+
+    assert claim.claimed == {"new:failed"}
+    assert claim.in_flight == {"pending:failed"}
+
+
+def test_dynamodb_claim_errors_release_the_keys_claimed(dynamodb):
+    dynamodb.fail_on = "r-2:failed"
+    store = DynamoDBIdempotencyStore("idempotency")
+
+    with pytest.raises(RuntimeError):
+        store.claim(["r-1:failed", "r-2:failed"])
+    assert dynamodb.items == {}
+
+
+def test_handler_retries_records_in_flight_elsewhere(monkeypatch):
+    store = InMemoryIdempotencyStore()
+    monkeypatch.setattr(handler, "IDEMPOTENCY", IdempotencyGuard(store))
+    monkeypatch.setattr(handler.ProcessEvent, "put_items_athena", lambda self: None)
+    monkeypatch.setattr(handler, "JOB_RUNS", None)
+    # Another invocation is persisting the first event
+    pending, new = (glue_job_event(state="SUCCEEDED") for _ in range(2))
+    store.claim([f"{pending['id']}:succeeded"])
+
+    event = {"Records": [sns_record(pending), sns_record(new)]}
+    response = handler.ProcessEvent(event, {}, handler.cf, logging.getLogger()).execute()
+
+    assert [record["status"] for record in response["records"]] == [
+        handler.RECORD_FAILED,
+        handler.RECORD_PERSISTED,
+    ]
+
+
+class RecordingNotifier:
+    router = Router()
+
+    def __init__(self):
+        self.messages = []
+
+    def submit(self, message: dict) -> list:
+        self.messages.append(message)
+        return []
+
+
+def test_redelivered_failures_are_alerted_once(monkeypatch):
+    notifier = RecordingNotifier()
+    monkeypatch.setattr(handler, "NOTIFIER", notifier)
+    monkeypatch.setattr(handler, "DIGEST", None)
+    monkeypatch.setattr(handler, "ALERT_DEDUP", None)
+    monkeypatch.setattr(handler, "JOB_RUNS", None)
+    monkeypatch.setattr(handler.ProcessEvent, "put_items_athena", lambda self: None)
+    store = InMemoryIdempotencyStore()
+    failure, success = glue_job_event(state="FAILED"), glue_job_event(state="SUCCEEDED")
+    event = {"Records": [sns_record(failure), sns_record(success)]}
+
+    # The same batch reaches one container, then another one with an empty cache
+    statuses = []
+    for _ in range(2):
+        monkeypatch.setattr(handler, "IDEMPOTENCY", IdempotencyGuard(store))
+        response = handler.ProcessEvent(event, {}, handler.cf, logging.getLogger()).execute()
+        statuses.append([record["status"] for record in response["records"]])
+
+    assert statuses == [
+        [handler.RECORD_PERSISTED] * 2,
+        [handler.RECORD_DUPLICATE] * 2,
+    ]
+    assert [message["service_id"] for message in notifier.messages] == [failure["id"]]
+
+
+def test_failures_are_alerted_again_when_their_write_is_retried(monkeypatch):
+    notifier = RecordingNotifier()
+    monkeypatch.setattr(handler, "NOTIFIER", notifier)
+    monkeypatch.setattr(handler, "DIGEST", None)
+    monkeypatch.setattr(handler, "ALERT_DEDUP", None)
+    monkeypatch.setattr(handler, "JOB_RUNS", None)
+    monkeypatch.setattr(handler, "IDEMPOTENCY", IdempotencyGuard(InMemoryIdempotencyStore()))
+    writes = []
+
+    def put_items_athena(self):
+        writes.append(len(self.items))
+        if len(writes) == 1:
+            raise RuntimeError("Athena is down")
+
+    monkeypatch.setattr(handler.ProcessEvent, "put_items_athena", put_items_athena)
+    event = {"Records": [sns_record(glue_job_event(state="FAILED"))]}
+
+    for _ in range(2):
+        handler.ProcessEvent(event, {}, handler.cf, logging.getLogger()).execute()
+
+    assert writes == [1, 1]
+    assert len(notifier.messages) == 2
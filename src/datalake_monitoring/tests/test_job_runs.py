@@ -0,0 +1,130 @@
+import logging
+import os
+
+import pytest
+
+import handler
+from benchmarks.events import glue_job_event, sns_record
+from benchmarks.stubs import LocalGlueClient
+from commons.job_runs import JobRunEnricher, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+
+class SlowGlue(LocalGlueClient):
+    """Glue stub whose job and run lookups each take `latency` seconds of `clock` time"""
+
+    def __init__(self, clock: FakeClock, latency: float):
+        super().__init__(latency=0)
+        self.clock = clock
+        self.lookup_latency = latency
+
+    def get_job_run(self, **kwargs):
+        self.clock.sleep(self.lookup_latency)
+        return super().get_job_run(**kwargs)
+
+    def get_job_runs(self, **kwargs):
+        self.clock.sleep(self.lookup_latency)
+        return super().get_job_runs(**kwargs)
+
+    def batch_get_jobs(self, **kwargs):
+        self.clock.sleep(self.lookup_latency)
+        return super().batch_get_jobs(**kwargs)
+
+
+def items(*runs) -> list:
+    return [
+        {"service_type": "glue_job", "service_name": job_name, "service_run_id": run_id}
+        for job_name, run_id in runs
+    ]
+
+
+def test_enrichment_is_opt_in():
+    if "GLUE_ENRICHMENT" in os.environ:
+        pytest.skip("GLUE_ENRICHMENT is set in the environment")
+    assert handler.cf.GLUE_ENRICHMENT is False
+    assert handler.JOB_RUNS is None
+
+
+def test_rows_get_the_metrics_of_their_runs():
+    glue = LocalGlueClient(latency=0)
+    rows = items(("load", "jr_1"), ("load", "jr_1"), ("export", "jr_2"))
+
+    stats = JobRunEnricher(lambda: glue).enrich(rows)
+
+    assert stats["enriched"] == 3
+    # BatchGetJobs for both jobs, and one GetJobRun per run
+    assert stats["api_calls"] == glue.calls == 3
+    expected = LocalGlueClient.job_run("load", "jr_1")
+    assert rows[0]["job_execution_seconds"] == rows[1]["job_execution_seconds"] == (
+        expected["ExecutionTime"]
+    )
+    assert rows[2]["job_worker_type"] == "G.1X"
+
+
+def test_no_glue_call_is_made_after_the_deadline():
+    clock = FakeClock()
+    glue = SlowGlue(clock, latency=2)
+    enricher = JobRunEnricher(lambda: glue, deadline_seconds=5, clock=clock)
+    rows = items(("a", "jr_1"), ("b", "jr_2"), ("c", "jr_3"), ("d", "jr_4"))
+
+    stats = enricher.enrich(rows)
+
+    # BatchGetJobs at 0s, GetJobRun of a at 2s and of b at 4s; c would start at 6s
+    assert glue.calls == 3
+    assert stats["enriched"] == 2
+    assert stats["deadline_exceeded"] == 2
+    assert clock.now - 1000 == 6
+    assert "job_attempt" not in rows[2] and "job_attempt" not in rows[3]
+
+
+def test_rate_limit_waits_are_cut_short_by_the_deadline():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=0.1, burst=1, clock=clock, sleep=clock.sleep)
+    enricher = JobRunEnricher(
+        lambda: LocalGlueClient(latency=0),
+        rate_limiter=bucket,
+        max_wait_seconds=30,
+        deadline_seconds=5,
+        clock=clock,
+    )
+
+    stats = enricher.enrich(items(("a", "jr_1")))
+
+    # The only token goes to BatchGetJobs; the next one is 10s away
+    assert stats["api_calls"] == 1
+    assert stats["deadline_exceeded"] == 1
+    assert stats["rate_limited"] == 0
+    assert clock.now == 1000
+
+
+def test_handler_writes_rows_without_metrics_past_the_deadline(monkeypatch):
+    clock = FakeClock()
+    glue = SlowGlue(clock, latency=10)
+    monkeypatch.setattr(
+        handler, "JOB_RUNS", JobRunEnricher(lambda: glue, deadline_seconds=5, clock=clock)
+    )
+    written = []
+    monkeypatch.setattr(
+        handler.ProcessEvent, "put_items_athena", lambda self: written.extend(self.items)
+    )
+    events = [glue_job_event("load", state="FAILED"), glue_job_event("export", state="FAILED")]
+
+    event = {"Records": [sns_record(message) for message in events]}
+    response = handler.ProcessEvent(event, {}, handler.cf, logging.getLogger()).execute()
+
+    assert [record["status"] for record in response["records"]] == [
+        handler.RECORD_PERSISTED
+    ] * 2
+    # Only BatchGetJobs was made before the deadline
+    assert glue.calls == 1
+    assert [item.get("job_attempt") for item in written] == [None, None]
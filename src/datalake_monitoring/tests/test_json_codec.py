@@ -0,0 +1,101 @@
+import json
+import sys
+
+import pytest
+
+from benchmarks.events import SAMPLE_BUILDERS
+from commons.json_codec import (
+    BACKENDS,
+    JSONCodec,
+    LazyArray,
+    LazyObject,
+    available,
+    materialize,
+    select_backend,
+)
+
+MESSAGE = json.dumps(
+    {
+        "source": "aws.glue",
+        "detail": {"jobName": "load", "attempts": [1, 2, {"state": "FAILED"}], "retry": None},
+        "resources": [],
+    }
+)
+
+
+@pytest.fixture
+def without_optional_backends(monkeypatch):
+    # A None entry in sys.modules makes the import raise ImportError
+    monkeypatch.delenv("JSON_BACKEND", raising=False)
+    monkeypatch.setitem(sys.modules, "orjson", None)
+    monkeypatch.setitem(sys.modules, "simdjson", None)
+
+
+def test_the_standard_library_is_used_without_the_optional_backends(without_optional_backends):
+    assert not available("orjson") and not available("simdjson")
+    assert select_backend() == "json"
+    # A requested backend that is not installed falls back too
+    assert select_backend("orjson") == "json"
+
+    codec = JSONCodec(lazy_min_bytes=0)
+
+    assert (codec.backend, codec.lazy_min_bytes) == ("json", -1)
+    assert codec.lazy(MESSAGE) == codec.loads(MESSAGE) == json.loads(MESSAGE)
+
+
+def test_unknown_backends_are_rejected():
+    with pytest.raises(ValueError):
+        select_backend("ujson")
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_every_backend_decodes_the_same(backend):
+    if not available(backend):
+        pytest.skip(f"{backend} is not installed")
+    codec = JSONCodec(backend, lazy_min_bytes=-1)
+
+    assert codec.backend == backend
+    assert codec.loads(MESSAGE) == json.loads(MESSAGE)
+    assert codec.loads(MESSAGE.encode()) == json.loads(MESSAGE)
+    with pytest.raises(ValueError):
+        codec.loads("{not json")
+
+
+def test_only_messages_past_the_threshold_are_decoded_lazily():
+    pytest.importorskip("simdjson")
+    codec = JSONCodec("json", lazy_min_bytes=len(MESSAGE))
+
+    assert isinstance(codec.lazy(MESSAGE), LazyObject)
+    assert type(codec.lazy(json.dumps({"a": 1}))) is dict
+    assert type(JSONCodec("json", lazy_min_bytes=len(MESSAGE) + 1).lazy(MESSAGE)) is dict
+    assert type(JSONCodec("json", lazy_min_bytes=-1).lazy(MESSAGE)) is dict
+
+
+def test_lazy_objects_read_like_the_eager_decoding():
+    pytest.importorskip("simdjson")
+    codec = JSONCodec("json", lazy_min_bytes=0)
+    eager = json.loads(MESSAGE)
+
+    lazy = codec.lazy(MESSAGE)
+
+    assert list(lazy) == list(eager) and len(lazy) == len(eager)
+    assert "detail" in lazy and "missing" not in lazy
+    assert lazy.get("missing") is None
+    detail = lazy["detail"]
+    assert isinstance(detail, LazyObject)
+    assert detail["jobName"] == "load" and detail["retry"] is None
+    attempts = detail["attempts"]
+    assert isinstance(attempts, LazyArray)
+    assert attempts[:2] == [1, 2] and attempts[-1]["state"] == "FAILED"
+    assert materialize(lazy) == eager
+    assert json.loads(repr(lazy)) == eager
+
+
+@pytest.mark.parametrize("kind", sorted(SAMPLE_BUILDERS))
+def test_sample_messages_decode_lazily_to_the_same_values(kind):
+    pytest.importorskip("simdjson")
+    message = json.dumps(SAMPLE_BUILDERS[kind]())
+
+    lazy = JSONCodec("json", lazy_min_bytes=0).lazy(message)
+
+    assert materialize(lazy) == json.loads(message)
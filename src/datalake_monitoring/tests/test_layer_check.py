@@ -0,0 +1,33 @@
+import os
+import shutil
+
+import pytest
+
+from benchmarks import layer_check
+
+# requests and the packages it needs beyond the Lambda runtime, as the slim layers install them
+REQUESTS_MODULES = ("requests", "charset_normalizer", "idna", "certifi")
+
+
+def build_layer(path, modules) -> str:
+    """Layer directory of the locally installed `modules`"""
+    layer = path / "python"
+    layer.mkdir()
+    for name in modules:
+        module = pytest.importorskip(name)
+        shutil.copytree(os.path.dirname(module.__file__), layer / name)
+    return str(layer)
+
+
+def test_notifications_are_sent_with_the_slim_layer_only(tmp_path):
+    report = layer_check.check(build_layer(tmp_path, REQUESTS_MODULES), writer="ndjson")
+
+    assert report["ok"], report["stderr"]
+    assert sorted(sink for sink, _, _ in report["outcomes"]) == sorted(layer_check.SINK_TYPES)
+
+
+def test_a_layer_without_requests_fails_the_check(tmp_path):
+    report = layer_check.check(build_layer(tmp_path, ()), writer="ndjson")
+
+    assert not report["ok"]
+    assert "requests" in report["stderr"] + str(report["outcomes"])
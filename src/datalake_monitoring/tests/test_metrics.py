@@ -0,0 +1,129 @@
+import json
+import logging
+
+import pytest
+
+from commons import metrics
+from commons.metrics import BYTES, COUNT, MAX_VALUES, MILLISECONDS, InvocationMetrics, SampledLogger
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 10.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def invocation_metrics(**kwargs) -> InvocationMetrics:
+    return InvocationMetrics(
+        "DataLake/Monitoring", {"FunctionName": "monitor", "Stage": "dev"}, **kwargs
+    )
+
+
+def test_the_emf_document_declares_every_metric_with_its_unit():
+    clock = FakeClock()
+    recorder = invocation_metrics(clock=clock)
+    recorder.add("Records", 3)
+    recorder.add("Records", 2)
+    recorder.add("PayloadOffloadBytes", 512, BYTES)
+    recorder.observe("NotificationLatency", 12.5)
+    recorder.observe("NotificationLatency", 40.0)
+    start = recorder.now()
+    clock.now += 0.25
+    recorder.add_time("Write", start)
+
+    document = recorder.to_emf(timestamp_ms=1_700_000_000_000)
+
+    assert document["_aws"] == {
+        "Timestamp": 1_700_000_000_000,
+        "CloudWatchMetrics": [
+            {
+                "Namespace": "DataLake/Monitoring",
+                "Dimensions": [["FunctionName", "Stage"]],
+                "Metrics": [
+                    {"Name": "Records", "Unit": COUNT},
+                    {"Name": "PayloadOffloadBytes", "Unit": BYTES},
+                    {"Name": "NotificationLatency", "Unit": MILLISECONDS},
+                    {"Name": "WriteTime", "Unit": MILLISECONDS},
+                ],
+            }
+        ],
+    }
+    # The dimensions and the values are top-level members
+    assert {key: value for key, value in document.items() if key != "_aws"} == {
+        "FunctionName": "monitor",
+        "Stage": "dev",
+        "Records": 5,
+        "PayloadOffloadBytes": 512,
+        "NotificationLatency": [12.5, 40.0],
+        "WriteTime": 250.0,
+    }
+
+
+def test_observations_are_capped_at_the_emf_limit():
+    recorder = invocation_metrics()
+    for value in range(MAX_VALUES + 10):
+        recorder.observe("NotificationLatency", value)
+    assert len(recorder.value("NotificationLatency")) == MAX_VALUES
+
+
+def test_emit_writes_one_line_and_reset_starts_the_next_invocation():
+    recorder = invocation_metrics()
+    lines = []
+    assert recorder.emit(lines.append) is None
+
+    recorder.add("Records", 1)
+    line = recorder.emit(lines.append)
+
+    assert lines == [line]
+    assert "\n" not in line
+    assert json.loads(line)["Records"] == 1
+    recorder.reset()
+    assert recorder.values() == {}
+    assert recorder.emit(lines.append) is None
+    assert len(lines) == 1
+
+
+def test_only_sampled_invocations_are_emitted(monkeypatch):
+    monkeypatch.setattr(metrics.random, "random", lambda: 0.5)
+    lines = []
+
+    recorder = invocation_metrics(sample_rate=0.1)
+    recorder.add("Records", 1)
+    assert not recorder.sampled
+    assert recorder.emit(lines.append) is None
+
+    recorder = invocation_metrics(sample_rate=0.9)
+    recorder.add("Records", 1)
+    assert recorder.emit(lines.append) is not None
+    assert len(lines) == 1
+
+
+@pytest.fixture
+def log(caplog):
+    caplog.set_level(logging.INFO, logger="sampled")
+    return logging.getLogger("sampled")
+
+
+def test_sampled_logger_drops_unsampled_info_but_never_errors(log, caplog, monkeypatch):
+    monkeypatch.setattr(metrics.random, "random", lambda: 0.5)
+    sampled_log = SampledLogger(log, sample_rate=0.1)
+
+    sampled_log.info("Composed item", record_id="r-1")
+    sampled_log.error("Could not compose item", record_id="r-2")
+
+    assert [(record.levelno, json.loads(record.getMessage())) for record in caplog.records] == [
+        (logging.ERROR, {"message": "Could not compose item", "record_id": "r-2"})
+    ]
+
+
+def test_sampled_logger_cuts_long_fields(log, caplog):
+    SampledLogger(log, sample_rate=1, max_chars=4).info("Composed item", payload="x" * 10, size=10)
+
+    [record] = caplog.records
+    assert json.loads(record.getMessage()) == {
+        "message": "Composed item",
+        "payload": "xxxx...(+6 chars)",
+        "size": 10,
+    }
@@ -0,0 +1,59 @@
+import os
+from datetime import datetime
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import compaction
+import migrate_layout
+
+DAY = "20230719"
+
+
+def write_legacy_file(table_dir: str, name: str, rows: list):
+    """A file as the handler wrote it before the layout change: every column a string"""
+    day_dir = f"{table_dir}/exported_on={DAY}"
+    os.makedirs(day_dir, exist_ok=True)
+    table = pa.table(
+        {
+            "service_type": [row[0] for row in rows],
+            "service_request_id": [row[1] for row in rows],
+            "event_type": ["State Change"] * len(rows),
+            "timestamp": [row[2] for row in rows],
+        }
+    )
+    pq.write_table(table, f"{day_dir}/{name}")
+
+
+def test_legacy_files_are_moved_into_leaf_partitions(tmp_path):
+    table_dir = str(tmp_path / "monitor")
+    write_legacy_file(
+        table_dir,
+        "a.snappy.parquet",
+        [
+            ("glue_job", "r-1", "2023-07-19T10:05:00.000Z"),
+            ("lambda", "r-2", "2023-07-19T11:00:00.000Z"),
+        ],
+    )
+    write_legacy_file(
+        table_dir, "b.snappy.parquet", [("glue_job", "r-1", "2023-07-19T10:05:00.000Z")]
+    )
+
+    # Compaction leaves the legacy files alone
+    assert compaction.compact_table(table_dir, [DAY]) == []
+    [result] = migrate_layout.migrate_table(table_dir)
+
+    assert result == migrate_layout.MigrationResult(DAY, 2, 2, 2)
+    day_dir = f"{table_dir}/exported_on={DAY}"
+    assert not [name for name in os.listdir(day_dir) if name.endswith(".parquet")]
+    glue_job = pq.read_table(f"{day_dir}/service_type=glue_job/hour=10")
+    assert glue_job.column("timestamp").to_pylist() == [datetime(2023, 7, 19, 10, 5)]
+    assert "service_type" not in pq.read_schema(
+        next(
+            os.path.join(root, name)
+            for root, _, names in os.walk(f"{day_dir}/service_type=lambda/hour=11")
+            for name in names
+        )
+    ).names
+    # Nothing left to migrate
+    assert migrate_layout.migrate_table(table_dir) == []
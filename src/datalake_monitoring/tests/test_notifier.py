@@ -0,0 +1,140 @@
+import logging
+import time
+
+import pytest
+
+import handler
+from benchmarks.events import glue_job_event, sns_record
+from benchmarks.stubs import WebhookStubServer
+from commons.notifier import Notifier, PagerDutySink, Sink, SlackNotifier, gather
+from commons.routing import Router
+
+
+def failure_message(index: int = 0) -> dict:
+    return {
+        "service": "lambda",
+        "service_name": f"lambda-fail-{index}",
+        "exception_details": "boom",
+        "time_stamp": "2026-10-17 12:00:00",
+    }
+
+
+def test_sends_run_concurrently_over_the_pool():
+    with WebhookStubServer(delay=0.2) as stub:
+        notifier = SlackNotifier(lambda _: stub.url, max_workers=8)
+        # Warm up the session and thread pool
+        notifier.send_all([failure_message(index) for index in range(8)])
+        start = time.perf_counter()
+        outcomes = notifier.send_all([failure_message(index) for index in range(16)])
+        elapsed = time.perf_counter() - start
+
+    assert all(outcome.ok for outcome in outcomes)
+    assert len(stub.received) == 24
+    # Sequentially 16 x 0.2 s = 3.2 s; 8 at a time takes two rounds, 0.4 s
+    assert elapsed < 1.6
+
+
+def test_rate_limited_sends_are_retried():
+    with WebhookStubServer(status=429, headers={"Retry-After": "0"}) as stub:
+        notifier = SlackNotifier(lambda _: stub.url, max_retries=2)
+        outcome = notifier.send(failure_message())
+
+    assert outcome.status_code == 429
+    assert not outcome.ok
+    assert len(stub.received) == 3
+
+
+def test_client_error_re_reads_the_webhook_once():
+    with WebhookStubServer(status=404) as old, WebhookStubServer() as new:
+        reads = []
+
+        def webhook(force_refresh: bool) -> str:
+            reads.append(force_refresh)
+            return new.url if force_refresh else old.url
+
+        outcome = SlackNotifier(webhook).send(failure_message())
+
+    assert outcome.ok
+    assert reads == [False, True]
+    assert len(old.received) == len(new.received) == 1
+
+
+def test_sink_without_deliver_cannot_be_created():
+    class Incomplete(Sink):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete("incomplete")
+
+
+def test_pagerduty_client_error_re_reads_the_routing_key_once():
+    with WebhookStubServer(status=400) as stub:
+        reads = []
+
+        def routing_key(force_refresh: bool) -> str:
+            reads.append(force_refresh)
+            return "rotated" if force_refresh else "revoked"
+
+        sink = PagerDutySink("pagerduty", routing_key, webhook_provider=lambda _: stub.url)
+        outcome = sink.send({**failure_message(), "severity": "critical"})
+
+    assert outcome.status_code == 400
+    assert reads == [False, True]
+    assert [body["routing_key"] for body in stub.received] == ["revoked", "rotated"]
+
+
+def test_gather_reports_sends_past_the_deadline_as_timed_out():
+    with WebhookStubServer(delay=0.5) as slow, WebhookStubServer() as fast:
+        sinks = {
+            "slow": SlackNotifier(lambda _: slow.url, name="slow", max_workers=1),
+            "fast": SlackNotifier(lambda _: fast.url, name="fast"),
+        }
+        notifier = Notifier(sinks, Router([], default_sinks=["slow", "fast"]))
+        futures = notifier.submit(failure_message(0)) + notifier.submit(failure_message(1))
+
+        start = time.perf_counter()
+        outcomes = gather(futures, timeout=0.2)
+        elapsed = time.perf_counter() - start
+
+        assert elapsed < 0.4
+        assert [(outcome.sink, outcome.ok, outcome.timed_out) for outcome in outcomes] == [
+            ("slow", False, True),
+            ("fast", True, False),
+            ("slow", False, True),
+            ("fast", True, False),
+        ]
+        assert [outcome.error.split(", still ")[1] for outcome in outcomes[::2]] == [
+            "in flight",
+            "queued",
+        ]
+        # Late notifications are still sent in the background
+        assert all(future.result().ok for future in futures)
+    assert len(slow.received) == 2
+
+
+def test_invocations_do_not_wait_past_the_notification_deadline(monkeypatch):
+    with WebhookStubServer(delay=1) as stub:
+        notifier = Notifier(
+            {"slack": SlackNotifier(lambda _: stub.url)}, Router([], default_sinks=["slack"])
+        )
+        monkeypatch.setattr(handler, "NOTIFIER", notifier)
+        monkeypatch.setattr(handler, "DIGEST", None)
+        monkeypatch.setattr(handler, "ALERT_DEDUP", None)
+        monkeypatch.setattr(handler, "JOB_RUNS", None)
+        monkeypatch.setattr(handler.ProcessEvent, "put_items_athena", lambda self: None)
+        monkeypatch.setattr(handler.cf, "NOTIFY_DEADLINE_SECONDS", 0.3)
+        event = {"Records": [sns_record(glue_job_event(state="FAILED"))]}
+
+        start = time.perf_counter()
+        process = handler.ProcessEvent(event, {}, handler.cf, logging.getLogger())
+        response = process.execute()
+        elapsed = time.perf_counter() - start
+
+        assert elapsed < 0.9
+        assert [record["status"] for record in response["records"]] == [
+            handler.RECORD_PERSISTED
+        ]
+        [outcome] = process.notification_outcomes
+        assert outcome.timed_out and not outcome.ok
+        gather(process.notifications)
+    assert len(stub.received) == 1
@@ -0,0 +1,119 @@
+import gzip
+import hashlib
+import json
+import os
+
+import pytest
+
+from commons import payloads
+from commons.payloads import PayloadSlimmer, put_once
+
+
+class ClientError(Exception):
+    def __init__(self, code: str):
+        super().__init__(code)
+        self.response = {"Error": {"Code": code}}
+
+
+class FakeS3:
+    """HeadObject and PutObject of a bucket; HeadObject answers `head_error` if set"""
+
+    def __init__(self, head_error: str = None):
+        self.head_error = head_error
+        self.objects = {}
+        self.puts = 0
+
+    def head_object(self, Bucket, Key):
+        if self.head_error:
+            raise ClientError(self.head_error)
+        if (Bucket, Key) not in self.objects:
+            raise ClientError("404")
+        return {}
+
+    def put_object(self, Bucket, Key, Body):
+        self.puts += 1
+        self.objects[(Bucket, Key)] = Body
+        return {}
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    client = FakeS3()
+    monkeypatch.setattr(payloads, "get_client", lambda service_name, region_name=None: client)
+    return client
+
+
+def test_payloads_within_the_limit_are_kept_whole():
+    slim = PayloadSlimmer(max_chars=100, offload_uri="s3://bucket/payloads").slim(
+        "boom", {"key": "value"}, ["frame 1\n", "frame 2\n"]
+    )
+
+    assert slim.columns() == {
+        "error_message": "boom",
+        "request_payload": '{"key":"value"}',
+        "stack_trace": "frame 1\nframe 2\n",
+        "payload_bytes": 15,
+        "payload_ref": None,
+    }
+
+
+def test_oversized_payloads_are_cut_and_offloaded_by_content_hash():
+    slimmer = PayloadSlimmer(max_chars=10, offload_uri="s3://bucket/payloads/")
+    request_payload = {"data": "x" * 50}
+
+    slim = slimmer.slim("boom", request_payload, None)
+
+    assert slim.request_payload == '{"data":"x... [51 more chars]'
+    assert slim.error_message == "boom"
+    assert slim.payload_bytes == 61
+    original = gzip.decompress(slim.offload.data)
+    assert json.loads(original) == {
+        "errorMessage": "boom",
+        "requestPayload": request_payload,
+        "stackTrace": None,
+    }
+    digest = hashlib.sha256(original).hexdigest()
+    assert slim.offload.uri == f"s3://bucket/payloads/{digest[:2]}/{digest}.json.gz"
+    # The same failure is offloaded to the same object
+    assert slimmer.slim("boom", request_payload, None).offload.uri == slim.offload.uri
+
+
+def test_without_an_offload_prefix_payloads_are_only_cut():
+    slim = PayloadSlimmer(max_chars=10).slim("x" * 20, None, None)
+    assert slim.error_message == "xxxxxxxxxx... [10 more chars]"
+    assert slim.offload is None
+
+
+def test_offloads_are_stored_once_per_container(tmp_path):
+    slimmer = PayloadSlimmer(max_chars=10, offload_uri=str(tmp_path / "payloads"))
+    offloads = [slimmer.slim(f"error {index}" * 5, None, None).offload for index in range(3)]
+
+    assert slimmer.store(offloads + offloads[:1]) == 3
+    assert slimmer.store(offloads) == 0
+    for offload in offloads:
+        with open(offload.uri, "rb") as file:
+            assert file.read() == offload.data
+
+
+def test_existing_local_payloads_are_not_rewritten(tmp_path):
+    path = str(tmp_path / "ab" / "abc.json.gz")
+    put_once(path, b"first")
+    put_once(f"file://{path}", b"second")
+    with open(path, "rb") as file:
+        assert file.read() == b"first"
+    assert os.listdir(tmp_path / "ab") == ["abc.json.gz"]
+
+
+def test_s3_payloads_are_written_only_when_missing(s3):
+    put_once("s3://bucket/payloads/ab/abc.json.gz", b"data")
+    put_once("s3://bucket/payloads/ab/abc.json.gz", b"data")
+
+    assert s3.objects == {("bucket", "payloads/ab/abc.json.gz"): b"data"}
+    assert s3.puts == 1
+
+
+def test_s3_errors_other_than_a_missing_object_are_raised(s3):
+    s3.head_error = "403"
+    with pytest.raises(ClientError):
+        put_once("s3://bucket/payloads/ab/abc.json.gz", b"data")
+    assert s3.puts == 0
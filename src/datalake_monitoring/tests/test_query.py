@@ -0,0 +1,132 @@
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import monitor_schema as schema
+from commons.event_registry import EVENT_TYPE_FAIL, EVENT_TYPE_SUCCESS
+from commons.writers import ParquetWriter
+from query import DuckDBExecutor, MonitorQueries, ResultCache
+
+duckdb = pytest.importorskip("duckdb")
+
+NOW = datetime(2026, 10, 17, 12, 0, tzinfo=timezone.utc)
+
+
+def event(service_type, service_name, event_type, at, fingerprint=None) -> dict:
+    return {
+        "service_type": service_type,
+        "service_name": service_name,
+        "service_request_id": f"{service_name}-{at:%H%M}",
+        "event_type": event_type,
+        "timestamp": at.replace(tzinfo=None),
+        "retry_attempts": 0,
+        "error_message": None if event_type == EVENT_TYPE_SUCCESS else f"{service_name} failed",
+        "error_fingerprint": fingerprint,
+    }
+
+
+def put(uri: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(uri), exist_ok=True)
+    with open(uri, "wb") as file:
+        file.write(data)
+
+
+def hours(value: float) -> datetime:
+    return NOW - timedelta(hours=value)
+
+
+def write_table(table_uri: str, events: list) -> str:
+    """Monitor table as the pyarrow writer lays it out, each row written when it happened"""
+    writer = ParquetWriter(table_uri, put=put)
+    for item in events:
+        writer.write([item], schema.column_types(item), item["timestamp"])
+    return table_uri
+
+
+@pytest.fixture
+def table_dir(tmp_path) -> str:
+    events = [
+        event("glue_job", "load", EVENT_TYPE_FAIL, hours(2), "fp-load"),
+        event("glue_job", "load", EVENT_TYPE_SUCCESS, hours(1.5)),
+        event("glue_job", "load", EVENT_TYPE_FAIL, hours(1), "fp-load"),
+        event("lambda", "fn", EVENT_TYPE_FAIL, hours(3), "fp-fn"),
+        event("lambda", "fn", EVENT_TYPE_FAIL, hours(2.5), "fp-fn"),
+        event("lambda", "fn", EVENT_TYPE_SUCCESS, hours(0.5)),
+        # Outside the window, in a partition the queries do not read
+        event("lambda", "fn", EVENT_TYPE_FAIL, hours(48), "fp-fn"),
+    ]
+    return write_table(str(tmp_path / "monitor"), events)
+
+
+def queries(table_dir: str, cache=None) -> MonitorQueries:
+    return MonitorQueries(
+        DuckDBExecutor(table_dir), cache=cache, bucket_seconds=3600, clock=NOW.timestamp
+    )
+
+
+def test_failure_rate_and_recent_failures(table_dir):
+    monitor = queries(table_dir)
+
+    rates = monitor.failure_rate(hours=24).to_pylist()
+    # Equal rates are ordered by service type, then name
+    assert [(row["service_name"], row["failures"], row["events"]) for row in rates] == [
+        ("load", 2, 3),
+        ("fn", 2, 3),
+    ]
+    assert rates[0]["failure_rate"] == pytest.approx(2 / 3)
+
+    failures = monitor.recent_failures(hours=24, service_type="lambda").to_pylist()
+    assert [row["service_request_id"] for row in failures] == ["fn-0930", "fn-0900"]
+
+
+def test_top_fingerprints_and_mttr(table_dir):
+    monitor = queries(table_dir)
+
+    fingerprints = monitor.top_fingerprints(hours=24).to_pylist()
+    assert [(row["error_fingerprint"], row["failures"]) for row in fingerprints] == [
+        ("fp-fn", 2),
+        ("fp-load", 2),
+    ]
+
+    # fn recovered 2.5 h after its first failure; load's second failure is still open
+    mttr = {row["service_name"]: row for row in monitor.mttr(hours=24).to_pylist()}
+    assert mttr["fn"]["incidents"] == 1
+    assert mttr["fn"]["mttr_seconds"] == 2.5 * 3600
+    assert mttr["load"]["mttr_seconds"] == 0.5 * 3600
+
+
+def test_repeated_questions_are_served_from_the_cache(table_dir, tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    monitor = queries(table_dir, ResultCache(ttl_seconds=300, directory=cache_dir))
+    first = monitor.failure_rate(hours=24)
+    assert monitor.failure_rate(hours=24).equals(first)
+    assert monitor.executor.stats["queries"] == 1
+    assert monitor.stats["cache_hits"] == 1
+
+    # Another process reads the result back from the cache directory
+    other = queries(table_dir, ResultCache(ttl_seconds=300, directory=cache_dir))
+    assert other.failure_rate(hours=24, as_pandas=True)["failures"].tolist() == [2, 2]
+    assert other.executor.stats["queries"] == 0
+
+
+def test_timed_out_and_stopped_runs_are_failures(tmp_path):
+    table_uri = write_table(
+        str(tmp_path / "monitor"),
+        [
+            event("glue_job", "etl", "timeout", hours(3), "fp-etl"),
+            event("glue_job", "etl", "stopped", hours(2), "fp-etl"),
+            event("glue_job", "etl", EVENT_TYPE_SUCCESS, hours(1)),
+        ],
+    )
+    monitor = queries(table_uri)
+
+    [rate] = monitor.failure_rate(hours=24).to_pylist()
+    assert (rate["failures"], rate["events"]) == (2, 3)
+    failures = monitor.recent_failures(hours=24).to_pylist()
+    assert [row["service_request_id"] for row in failures] == ["etl-1000", "etl-0900"]
+    [fingerprint] = monitor.top_fingerprints(hours=24).to_pylist()
+    assert fingerprint["failures"] == 2
+    # One incident, from the timeout to the success
+    [mttr] = monitor.mttr(hours=24).to_pylist()
+    assert (mttr["incidents"], mttr["mttr_seconds"]) == (1, 2 * 3600)
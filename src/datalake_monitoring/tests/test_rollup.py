@@ -0,0 +1,123 @@
+import os
+from datetime import datetime
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import monitor_schema as schema
+import rollup
+from commons.writers import ParquetWriter
+
+DAY = "20261017"
+
+
+def put(uri: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(uri), exist_ok=True)
+    with open(uri, "wb") as file:
+        file.write(data)
+
+
+def write(table_uri: str, hour: int, *events) -> None:
+    """Monitor rows as the pyarrow writer writes them in `hour` of DAY"""
+    items = [
+        {
+            "service_type": service_type,
+            "service_name": service_name,
+            "event_type": event_type,
+            "timestamp": datetime(2026, 10, 17, hour, minute),
+            "retry_attempts": 1,
+            "error_fingerprint": fingerprint,
+        }
+        for service_type, service_name, event_type, minute, fingerprint in events
+    ]
+    types = schema.column_types(items[0])
+    ParquetWriter(table_uri, put=put).write(items, types, datetime(2026, 10, 17, hour, 59))
+
+
+def refresh(tmp_path, hours=None) -> rollup.RollupResult:
+    return rollup.refresh_day(
+        DAY,
+        hours,
+        str(tmp_path / "monitor"),
+        str(tmp_path / "hourly"),
+        str(tmp_path / "daily"),
+    )
+
+
+def read(tmp_path, table: str) -> list:
+    path = rollup.rollup_path(str(tmp_path / table), DAY)
+    return pq.read_table(path).to_pylist()
+
+
+def counts(rows: list, *keys) -> list:
+    return [
+        tuple(row[key] for key in keys) + (row["success_count"], row["failure_count"])
+        for row in rows
+    ]
+
+
+def test_rollups_count_successes_and_every_kind_of_failure(tmp_path):
+    table_uri = str(tmp_path / "monitor")
+    write(
+        table_uri,
+        10,
+        ("glue_job", "load", "failed", 0, "fp-a"),
+        ("glue_job", "load", "timeout", 10, "fp-b"),
+        ("glue_job", "load", "succeeded", 20, None),
+        ("lambda", "fn", "failed", 5, "fp-a"),
+    )
+    write(table_uri, 11, ("glue_job", "load", "stopped", 0, "fp-a"))
+
+    result = refresh(tmp_path)
+
+    assert (result.events, result.hourly_rows, result.daily_rows) == (5, 3, 2)
+    hourly = read(tmp_path, "hourly")
+    assert counts(hourly, "service_name", "hour") == [
+        ("load", "10", 1, 2),
+        ("load", "11", 0, 1),
+        ("fn", "10", 0, 1),
+    ]
+    assert hourly[0]["error_fingerprints"] == ["fp-a", "fp-b"]
+    assert hourly[0]["retry_attempts_total"] == 3
+    assert hourly[0]["first_failure_at"] == datetime(2026, 10, 17, 10, 0)
+    assert hourly[0]["last_failure_at"] == datetime(2026, 10, 17, 10, 10)
+    daily = read(tmp_path, "daily")
+    assert counts(daily, "service_name") == [("load", 1, 3), ("fn", 0, 1)]
+    assert daily[0]["distinct_fingerprints"] == 2
+
+
+def test_refreshing_hours_again_replaces_only_those_hours(tmp_path):
+    table_uri = str(tmp_path / "monitor")
+    write(table_uri, 10, ("lambda", "fn", "failed", 0, "fp-a"))
+    write(table_uri, 11, ("lambda", "fn", "succeeded", 0, None))
+    refresh(tmp_path)
+
+    # Re-running a day gives the same rollups
+    refresh(tmp_path)
+    assert counts(read(tmp_path, "hourly"), "hour") == [("10", 0, 1), ("11", 1, 0)]
+
+    write(table_uri, 11, ("lambda", "fn", "failed", 30, "fp-b"))
+    result = refresh(tmp_path, ["11"])
+
+    assert result.events == 2
+    assert counts(read(tmp_path, "hourly"), "hour") == [("10", 0, 1), ("11", 1, 1)]
+    assert counts(read(tmp_path, "daily"), "service_name") == [("fn", 1, 2)]
+
+
+def test_files_of_the_legacy_layout_are_skipped(tmp_path):
+    table_uri = str(tmp_path / "monitor")
+    write(table_uri, 10, ("lambda", "fn", "failed", 0, "fp-a"))
+    legacy = pa.table(
+        {
+            "service_type": ["lambda"],
+            "service_name": ["fn"],
+            "event_type": ["failed"],
+            "timestamp": ["2026-10-17T09:00:00.000Z"],
+        }
+    )
+    pq.write_table(legacy, f"{table_uri}/exported_on={DAY}/legacy.snappy.parquet")
+
+    result = refresh(tmp_path)
+
+    assert result.events == 1
+    assert counts(read(tmp_path, "daily"), "service_name") == [("fn", 0, 1)]
@@ -0,0 +1,142 @@
+import logging
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import handler
+from benchmarks.events import glue_crawler_event, glue_job_event, sns_record
+from commons import runs
+from commons.runs import DynamoDBRunStore, InMemoryRunStore, RunCorrelator, RunEvent, RunState
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FakeDynamoDB:
+    """BatchGetItem and BatchWriteItem of the run state table. The first BatchGetItem leaves
+    its last key unprocessed, as DynamoDB does under load"""
+
+    def __init__(self):
+        self.items = {}
+        self.get_calls = 0
+        self.write_calls = 0
+
+    def batch_get_item(self, RequestItems):
+        self.get_calls += 1
+        (table, request), = RequestItems.items()
+        keys = request["Keys"]
+        unprocessed = {}
+        if self.get_calls == 1 and len(keys) > 1:
+            keys, unprocessed = keys[:-1], {table: {**request, "Keys": keys[-1:]}}
+        names = [key["run_key"]["S"] for key in keys]
+        found = [self.items[name] for name in names if name in self.items]
+        return {"Responses": {table: found}, "UnprocessedKeys": unprocessed}
+
+    def batch_write_item(self, RequestItems):
+        self.write_calls += 1
+        for requests in RequestItems.values():
+            assert len(requests) <= 25
+            for request in requests:
+                item = request["PutRequest"]["Item"]
+                self.items[item["run_key"]["S"]] = item
+        return {}
+
+
+@pytest.fixture
+def dynamodb(monkeypatch):
+    client = FakeDynamoDB()
+    monkeypatch.setattr(runs, "get_client", lambda service_name, region_name=None: client)
+    return client
+
+
+def test_completions_get_durations_from_their_starts():
+    correlator = RunCorrelator(InMemoryRunStore())
+    correlator.correlate([RunEvent("glue_job:jr_1", 1000)], [])
+
+    durations, stats = correlator.correlate([], [RunEvent("glue_job:jr_1", 61000)])
+    assert durations == {RunEvent("glue_job:jr_1", 61000): 60000}
+
+    # A redelivered completion gets the same duration, a redelivered start is ignored
+    durations, stats = correlator.correlate(
+        [RunEvent("glue_job:jr_1", 1000)], [RunEvent("glue_job:jr_1", 61000)]
+    )
+    assert durations == {RunEvent("glue_job:jr_1", 61000): 60000}
+    assert stats["late_starts"] == 1
+
+
+def test_completion_before_its_start_is_unmatched():
+    correlator = RunCorrelator(InMemoryRunStore())
+
+    durations, stats = correlator.correlate([], [RunEvent("glue_crawler:c", 5000)])
+    assert durations == {RunEvent("glue_crawler:c", 5000): None}
+    assert stats["unmatched"] == 1
+
+    # The start delivered after its completion does not open a run that never closes
+    correlator.correlate([RunEvent("glue_crawler:c", 1000)], [])
+    assert correlator.store.load(["glue_crawler:c"]) == {
+        "glue_crawler:c": RunState(ended_at_ms=5000)
+    }
+
+
+def test_states_expire_after_the_ttl():
+    clock = FakeClock()
+    store = InMemoryRunStore(ttl_seconds=60, clock=clock)
+    store.save({"glue_job:jr_1": RunState(started_at_ms=1)})
+    clock.now += 61
+    assert store.load(["glue_job:jr_1"]) == {}
+
+
+def test_dynamodb_store_round_trips_states_across_chunks(dynamodb):
+    clock = FakeClock()
+    store = DynamoDBRunStore("runs", ttl_seconds=60, clock=clock)
+    states = {f"glue_job:jr_{index}": RunState(started_at_ms=index) for index in range(120)}
+    states["glue_job:jr_0"] = RunState(1, 2, 1)
+
+    store.save(states)
+    assert dynamodb.write_calls == 5
+
+    assert store.load(states) == states
+    # Two chunks of 100 keys, and the unprocessed key of the first one
+    assert dynamodb.get_calls == 3
+
+    clock.now += 61
+    assert store.load(states) == {}
+
+
+def test_handler_times_runs_and_flags_sla_breaches(monkeypatch):
+    monkeypatch.setattr(
+        handler, "RUNS", RunCorrelator(InMemoryRunStore(), sla_seconds={"nightly-load": 600})
+    )
+    monkeypatch.setattr(handler, "JOB_RUNS", None)
+    written = []
+    monkeypatch.setattr(
+        handler.ProcessEvent, "put_items_athena", lambda self: written.extend(self.items)
+    )
+    start = datetime(2026, 10, 17, 10, 0, tzinfo=timezone.utc)
+
+    def run(*events):
+        event = {"Records": [sns_record(message) for message in events]}
+        return handler.ProcessEvent(event, {}, handler.cf, logging.getLogger()).execute()
+
+    response = run(
+        glue_job_event("nightly-load", "RUNNING", run_id="jr_1", at=start),
+        glue_crawler_event("crawler", "Started", at=start),
+    )
+    assert [record["status"] for record in response["records"]] == [
+        handler.RECORD_RUN_STARTED
+    ] * 2
+
+    run(
+        glue_job_event("nightly-load", "SUCCEEDED", run_id="jr_1", at=start + timedelta(hours=1)),
+        glue_crawler_event("crawler", "Succeeded", at=start + timedelta(minutes=5)),
+    )
+    by_type = {item["service_type"]: item for item in written}
+    assert by_type["glue_job"]["duration_ms"] == 3600 * 1000
+    assert by_type["glue_job"]["sla_breached"] is True
+    assert by_type["glue_crawler"]["duration_ms"] == 300 * 1000
+    assert by_type["glue_crawler"]["sla_breached"] is None
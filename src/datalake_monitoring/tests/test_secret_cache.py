@@ -0,0 +1,182 @@
+import itertools
+import json
+import threading
+import time
+
+import boto3
+import pytest
+from botocore.stub import Stubber
+
+from commons.secret_cache import SecretCache
+from commons.utils import get_secret
+
+SECRET_ID = "datalake-monitoring"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def secretsmanager():
+    client = boto3.client(
+        "secretsmanager",
+        region_name="us-west-2",
+        aws_access_key_id="test",
+        aws_secret_access_key="test",
+    )
+    with Stubber(client) as stubber:
+        yield client, stubber
+
+
+def expect_fetch(stubber, webhook: str) -> None:
+    stubber.add_response(
+        "get_secret_value",
+        {"SecretString": json.dumps({"slack_webhook": webhook})},
+        {"SecretId": SECRET_ID},
+    )
+
+
+def make_cache(client, clock, **kwargs) -> SecretCache:
+    return SecretCache(
+        fetch=lambda secret_id: get_secret(secret_id, client=client),
+        ttl_seconds=300,
+        stale_seconds=3600,
+        clock=clock,
+        **kwargs,
+    )
+
+
+def test_fresh_value_is_served_from_memory(secretsmanager):
+    client, stubber = secretsmanager
+    expect_fetch(stubber, "https://hooks/1")
+    cache = make_cache(client, FakeClock())
+
+    assert cache.get(SECRET_ID)["slack_webhook"] == "https://hooks/1"
+    assert cache.get(SECRET_ID)["slack_webhook"] == "https://hooks/1"
+
+    stubber.assert_no_pending_responses()
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["hits"] == 1
+
+
+def test_stale_value_is_served_while_refreshing(secretsmanager):
+    client, stubber = secretsmanager
+    clock = FakeClock()
+    expect_fetch(stubber, "https://hooks/1")
+    expect_fetch(stubber, "https://hooks/2")
+    cache = make_cache(client, clock)
+    cache.get(SECRET_ID)
+
+    clock.now += 400
+    assert cache.get(SECRET_ID)["slack_webhook"] == "https://hooks/1"
+    cache._refreshing[SECRET_ID].join(5)
+    assert cache.get(SECRET_ID)["slack_webhook"] == "https://hooks/2"
+    stubber.assert_no_pending_responses()
+
+
+def test_expired_value_is_fetched_synchronously(secretsmanager):
+    client, stubber = secretsmanager
+    clock = FakeClock()
+    expect_fetch(stubber, "https://hooks/1")
+    expect_fetch(stubber, "https://hooks/2")
+    cache = make_cache(client, clock)
+    cache.get(SECRET_ID)
+
+    clock.now += 300 + 3600
+    assert cache.get(SECRET_ID)["slack_webhook"] == "https://hooks/2"
+    assert cache.stats()["misses"] == 2
+
+
+def test_failed_refresh_serves_last_known_value(secretsmanager):
+    client, stubber = secretsmanager
+    clock = FakeClock()
+    expect_fetch(stubber, "https://hooks/1")
+    stubber.add_client_error("get_secret_value", service_error_code="ThrottlingException")
+    cache = make_cache(client, clock)
+    cache.get(SECRET_ID)
+
+    clock.now += 300 + 3600
+    assert cache.get(SECRET_ID)["slack_webhook"] == "https://hooks/1"
+    assert cache.stats()["errors"] == 1
+
+
+def test_first_fetch_failure_is_raised(secretsmanager):
+    client, stubber = secretsmanager
+    stubber.add_client_error("get_secret_value", service_error_code="ResourceNotFoundException")
+    cache = make_cache(client, FakeClock())
+
+    with pytest.raises(Exception):
+        cache.get(SECRET_ID)
+
+
+def test_forced_refreshes_are_rate_limited(secretsmanager):
+    client, stubber = secretsmanager
+    clock = FakeClock()
+    expect_fetch(stubber, "https://hooks/1")
+    expect_fetch(stubber, "https://hooks/2")
+    cache = make_cache(client, clock, min_refresh_seconds=30)
+    cache.get(SECRET_ID)
+
+    # A webhook answering 4xx on every send does not fetch the secret every time
+    for _ in range(10):
+        assert cache.get(SECRET_ID, force_refresh=True)["slack_webhook"] == "https://hooks/1"
+    assert cache.stats()["throttled_refreshes"] == 10
+
+    clock.now += 30
+    assert cache.get(SECRET_ID, force_refresh=True)["slack_webhook"] == "https://hooks/2"
+    stubber.assert_no_pending_responses()
+
+
+def test_counters_are_exact_under_concurrency():
+    cache = SecretCache(fetch=lambda secret_id: {"slack_webhook": "x"}, clock=FakeClock())
+    cache.get(SECRET_ID)
+
+    def read():
+        for _ in range(2000):
+            cache.get(SECRET_ID)
+
+    threads = [threading.Thread(target=read) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert cache.stats()["hits"] == 8 * 2000
+
+
+@pytest.mark.parametrize("force_refresh", [False, True])
+def test_concurrent_misses_fetch_the_secret_once(force_refresh):
+    clock = FakeClock()
+    fetches = []
+    versions = itertools.count(1)
+
+    def fetch(secret_id):
+        fetches.append(secret_id)
+        time.sleep(0.1)
+        return {"slack_webhook": f"https://hooks/{next(versions)}"}
+
+    cache = SecretCache(fetch=fetch, min_refresh_seconds=30, clock=clock)
+    if force_refresh:
+        # A rotated webhook answers 4xx to every send in flight at once
+        cache.get(SECRET_ID)
+        clock.now += 30
+        fetches.clear()
+    barrier = threading.Barrier(8)
+    values = []
+
+    def read():
+        barrier.wait()
+        values.append(cache.get(SECRET_ID, force_refresh=force_refresh)["slack_webhook"])
+
+    threads = [threading.Thread(target=read) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert fetches == [SECRET_ID]
+    assert values == [f"https://hooks/{2 if force_refresh else 1}"] * 8